@@ -0,0 +1,95 @@
+"""
+" Binary encoding of input data arrays for Data.x_blob and Data.y_blob
+"
+" Arrays are stored as little-endian float64 in the .npy format (a magic
+" string and header giving dtype, order and shape, followed by the raw
+" array), optionally zlib compressed and then prefixed with ZNPY. Decoding
+" reads the header and maps the array directly onto the stored bytes,
+" without going through Python floats and lists as ArrayFields do.
+" Configured by settings.BINDFIT_DATA_STORAGE.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import io
+import zlib
+
+import numpy as np
+
+from django.conf import settings
+
+DTYPE = np.dtype("<f8")
+
+# Prefix of compressed blobs (uncompressed blobs start with the .npy magic
+# string, \x93NUMPY)
+ZLIB_MAGIC = b"ZNPY"
+
+DEFAULT_SETTINGS = {
+        "FORMAT":   "binary", # Storage of new Data rows, binary or array
+                              # (nested ArrayFields)
+        "COMPRESS": False,    # zlib compress binary arrays, smaller rows
+                              # but no zero-copy decoding
+        "LEVEL":    6,        # zlib compression level
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_DATA_STORAGE", DEFAULT_SETTINGS)
+
+def encode(array, compress=None):
+    """
+    Encode an array as .npy bytes.
+
+    Arguments:
+        array:    array-like  Converted to little-endian float64
+        compress: bool        zlib compress, default from settings
+
+    Returns:
+        bytes
+    """
+    conf = config()
+    if compress is None:
+        compress = conf.get("COMPRESS", DEFAULT_SETTINGS["COMPRESS"])
+
+    array = np.ascontiguousarray(array, dtype=DTYPE)
+
+    f = io.BytesIO()
+    np.lib.format.write_array(f, array, version=(1, 0), allow_pickle=False)
+    blob = f.getvalue()
+
+    if compress:
+        blob = ZLIB_MAGIC + zlib.compress(
+                blob, conf.get("LEVEL", DEFAULT_SETTINGS["LEVEL"]))
+    return blob
+
+def decode(blob):
+    """
+    Decode bytes written by encode.
+
+    Arguments:
+        blob: bytes or memoryview  As returned by a BinaryField
+
+    Returns:
+        ndarray  Read-only, backed by the (decompressed) blob's memory
+
+    Raises:
+        ValueError  If blob isn't an encoded float64 array
+    """
+    if bytes(blob[:len(ZLIB_MAGIC)]) == ZLIB_MAGIC:
+        blob = zlib.decompress(blob[len(ZLIB_MAGIC):])
+
+    f = io.BytesIO(blob)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        raise ValueError("Unsupported .npy version {}".format(version))
+
+    if dtype != DTYPE:
+        raise ValueError("Expected {} array, got {}".format(DTYPE, dtype))
+
+    count = int(np.prod(shape))
+    array = np.frombuffer(blob, dtype=dtype, count=count, offset=f.tell())
+    return array.reshape(shape, order="F" if fortran_order else "C")
@@ -0,0 +1,216 @@
+"""
+" Batch fitting
+"
+" Runs a list of FitView request bodies as jobs (see jobs.py), so they are
+" fitted on the runfitworker process pool rather than in web processes.
+" Small batches wait for their results (run), larger ones are submitted as a
+" batch whose results are polled by ID (submit, status) so no web worker is
+" held while they run. Each item's errors are caught and reported in its
+" result so one bad dataset doesn't fail the batch. Other work split into
+" jobs (e.g. landscape grid rows) is run the same way with map_jobs.
+" Configured by settings.BINDFIT_BATCH.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core import exceptions
+
+from . import models
+from . import formatter
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "MAX_ITEMS": 500, # Maximum fit specs per batch
+        "SYNC_MAX":  20,  # Larger batches are submitted, not waited for
+        "POLL":      0.2, # Job status polling interval while waiting (s)
+        "TIMEOUT":   120, # Jobs not finished after this are cancelled (s)
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_BATCH", DEFAULT_SETTINGS)
+
+def fit_item(args):
+    """
+    Run one batch item, returning its formatter.batch_item dict.
+
+    Arguments:
+        args: tuple  (index, FitView request body)
+    """
+    # Imported here, views import this module
+    from .views import FitView
+
+    index, spec = args
+    try:
+        return formatter.batch_item(index, FitView.run(spec), None)
+    except exceptions.ObjectDoesNotExist:
+        return formatter.batch_item(index, None, "Input data not found.")
+    except Exception as e:
+        logger.exception("batch.fit_item: item failed")
+        return formatter.batch_item(index, None, repr(e))
+
+
+
+#
+# Job fan-out
+#
+
+def map_jobs(kind, requests, ordered=True, priority=None, client=""):
+    """
+    Submit one job per request body and wait for them to finish. Jobs still
+    pending after the configured timeout, or when the caller stops
+    iterating, are cancelled.
+
+    Arguments:
+        kind:     string  Job kind, models.Job.KIND_*
+        requests: list    Job request bodies
+        ordered:  bool    If True yield jobs in input order, otherwise as
+                          they finish
+        priority: string  Priority class name, see jobs.submit
+
+    Returns:
+        iterator  (index, finished Job) for each request
+    """
+    # Imported here, jobs imports this module
+    from . import jobs
+
+    conf    = config()
+    poll    = conf.get("POLL",    DEFAULT_SETTINGS["POLL"])
+    timeout = conf.get("TIMEOUT", DEFAULT_SETTINGS["TIMEOUT"])
+
+    ids = [ jobs.submit(kind, request, priority=priority, client=client).id
+            for request in requests ]
+    index = { job_id: i for i, job_id in enumerate(ids) }
+
+    pending  = set(ids)
+    finished = {}
+    n_yielded = 0
+    deadline = time.time() + timeout
+
+    try:
+        while True:
+            if pending:
+                for job in models.Job.objects.filter(
+                        id__in=pending, status__in=models.Job.STATUS_FINAL):
+                    pending.discard(job.id)
+                    finished[index[job.id]] = job
+
+            if ordered:
+                while n_yielded in finished:
+                    yield n_yielded, finished.pop(n_yielded)
+                    n_yielded += 1
+            else:
+                for i in sorted(finished):
+                    yield i, finished.pop(i)
+                    n_yielded += 1
+
+            if n_yielded == len(ids):
+                return
+
+            if time.time() > deadline:
+                logger.warning("batch.map_jobs: cancelling {} jobs not "
+                               "finished after {} s".format(len(pending),
+                                                            timeout))
+                for job_id in pending:
+                    jobs.cancel(job_id)
+                deadline = float("inf")
+
+            time.sleep(poll)
+    finally:
+        # Stopped early (e.g. streaming client gone), don't leave work queued
+        for job_id in pending:
+            jobs.cancel(job_id)
+
+def job_item(index, job):
+    # formatter.batch_item dict of a finished batch job
+    if job.status == models.Job.STATUS_DONE:
+        item = json.loads(job.result)
+        item["index"] = index
+        return item
+    elif job.status == models.Job.STATUS_CANCELLED:
+        return formatter.batch_item(index, None, "Cancelled.")
+    return formatter.batch_item(index, None, job.error)
+
+def run(specs, ordered=True, priority=None, client=""):
+    """
+    Fit a batch of FitView request bodies.
+
+    Arguments:
+        specs:    list    FitView request bodies
+        ordered:  bool    If True yield results in input order, otherwise as
+                          they complete
+        priority: string  Priority class name of the fit jobs, default batch
+
+    Returns:
+        iterator  formatter.batch_item dict for each spec
+    """
+    requests = [ {"index": i, "fit": spec} for i, spec in enumerate(specs) ]
+    return ( job_item(i, job)
+             for i, job in map_jobs(models.Job.KIND_BATCH, requests,
+                                    ordered=ordered, priority=priority,
+                                    client=client) )
+
+
+
+#
+# Asynchronous batches
+#
+
+def submit(specs, priority=None, client=""):
+    """
+    Submit a batch of FitView request bodies without waiting for them.
+
+    Returns:
+        UUID  Batch ID, see status
+    """
+    # Imported here, jobs imports this module
+    from . import jobs
+
+    batch_id = uuid.uuid4()
+    for i, spec in enumerate(specs):
+        jobs.submit(models.Job.KIND_BATCH, {"index": i, "fit": spec},
+                    priority=priority, client=client, batch=batch_id)
+    return batch_id
+
+def status(batch_id):
+    """
+    Progress and finished results of a submitted batch.
+
+    Returns:
+        dict  formatter.batch_status response, None if there is no such
+              batch
+    """
+    items = []
+    for job in models.Job.objects.filter(batch=batch_id):
+        index = json.loads(job.request)["index"]
+        if job.status in models.Job.STATUS_FINAL:
+            items.append(job_item(index, job))
+        else:
+            items.append(formatter.batch_pending(index, job.status))
+
+    if not items:
+        return None
+
+    items.sort(key=lambda item: item["index"])
+    return formatter.batch_status(batch_id, items)
+
+def cancel(batch_id):
+    """
+    Cancel a submitted batch's unfinished items.
+
+    Returns:
+        int  Number of items cancelled
+    """
+    from . import jobs
+    return sum(1 for job_id in models.Job.objects.filter(
+                                   batch=batch_id).exclude(
+                                           status__in=models.Job.STATUS_FINAL
+                                           ).values_list("id", flat=True)
+               if jobs.cancel(job_id))
@@ -0,0 +1,118 @@
+"""
+" Benchmark helpers shared by bindfit benchmark modules.
+" Benchmarks are run through the benchmark_* management commands.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import timeit
+import tracemalloc
+
+import numpy as np
+from scipy import stats
+
+from .. import functions
+
+# Default true parameter values used to generate synthetic data
+PARAMS_TRUE = {
+        "nmr1to1":  {"k":   1000},
+        "uv1to1":   {"k":   1000},
+        "nmr1to2":  {"k1":  10000, "k2":  1000},
+        "uv1to2":   {"k1":  10000, "k2":  1000},
+        "nmr2to1":  {"k1":  10000, "k2":  1000},
+        "uv2to1":   {"k1":  10000, "k2":  1000},
+        "nmrdimer": {"ke":  100},
+        "uvdimer":  {"ke":  100},
+        "nmrcoek":  {"ke":  200,   "rho": 0.3},
+        "uvcoek":   {"ke":  2700,  "rho": 0.003},
+        }
+
+def synthetic_x(fitter, points, h0=1e-3, geq=20):
+    """
+    Generate x data for a titration of given number of points.
+
+    Binding fitters titrate guest into host (with slight host dilution),
+    aggregation fitters vary [H]0.
+    """
+    if "dimer" in fitter or "coek" in fitter:
+        return np.linspace(h0/10, h0*50, points)[np.newaxis]
+
+    host  = h0*np.linspace(1, 0.8, points)
+    guest = np.linspace(0, geq*h0, points)
+    return np.vstack((host, guest))
+
+def synthetic_data(fitter, points, signals,
+                   params=None, flavour="none", noise=0.005, seed=0):
+    """
+    Generate noisy synthetic y data from a fitter's own model function.
+
+    Returns:
+        (x, y, params)  x and y arrays, and true parameter dict used
+    """
+    rng = np.random.RandomState(seed)
+
+    params = params if params is not None else PARAMS_TRUE[fitter]
+    function = functions.construct(fitter, flavour=flavour)
+    x = synthetic_x(fitter, points)
+
+    species, _ = function.f([ params[k] for k in sorted(params) ],
+                            x,
+                            flavour=flavour)
+    species = np.real(species)
+
+    coeffs = 1 + rng.rand(signals, species.shape[0])
+    y = coeffs.dot(species)
+    y *= 1 + noise*rng.standard_normal(y.shape)
+    return x, y, params
+
+def params_init(params, scale=0.5):
+    # Parameter dict in Fitter.run_scipy input format, offset from the true
+    # values by the given factor
+    return { key: {"init": value*scale,
+                   "bounds": {"min": 0, "max": None}}
+             for key, value in params.items() }
+
+def timed(fn, number=100, repeat=5, warmup=0):
+    """
+    Time a callable.
+
+    Arguments:
+        warmup: int  Untimed calls made first
+
+    Returns:
+        dict  Best and mean time per call (s) over repeats, half width of
+              the mean's 95% confidence interval, and calls/s at best time
+    """
+    for i in range(warmup):
+        fn()
+
+    times = np.array(timeit.repeat(fn, number=number, repeat=repeat))/number
+    ci95 = stats.t.ppf(0.975, repeat - 1)*times.std(ddof=1)/np.sqrt(repeat) \
+           if repeat > 1 else float("nan")
+    return {
+        "best": float(times.min()),
+        "mean": float(times.mean()),
+        "std":  float(times.std()),
+        "ci95": float(ci95),
+        "rate": float(1/times.min()),
+        }
+
+def peak_alloc(fn):
+    """
+    Peak memory (bytes) allocated while running a callable once, as traced
+    by tracemalloc (includes numpy array data).
+    """
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - base
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,130 @@
+"""
+" Hot-path logging overhead benchmark: objective evaluation and full fit
+" times with the supramolecular logger at DEBUG (file or queue handler) and
+" numerical core tracing off, sampled, or tracing every evaluation (the
+" logging volume before numtrace guarded it)
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import logging
+import tempfile
+
+import numpy as np
+
+from .. import functions
+from .. import numtrace
+from ..fitter import Fitter
+from ..workspace import Workspace
+from . import synthetic_data, params_init, timed
+
+from supramolecular.log import QueueFileHandler
+
+# (name, logger level, handler, numtrace enabled, numtrace every)
+MODES = [
+        ("logger off",       logging.WARNING, None,    False, 1),
+        ("debug, file",      logging.DEBUG,   "file",  False, 1),
+        ("debug, queue",     logging.DEBUG,   "queue", False, 1),
+        ("trace every 100",  logging.DEBUG,   "file",  True,  100),
+        ("trace all",        logging.DEBUG,   "file",  True,  1),
+        ]
+
+def run(fitter="nmr1to2", points=50, signals=10, number=200, repeat=5):
+    """
+    Time objective evaluations (workspace and allocating paths) and full fits
+    in each logging mode.
+
+    Returns:
+        list  One result dict per mode
+    """
+    x, y, params = synthetic_data(fitter, points, signals)
+    p = np.array([ params[k] for k in sorted(params) ])*1.1
+
+    function = functions.construct(fitter)
+    ws = Workspace(x, y)
+    y_norm = ws.y.copy()
+
+    def objective_ws():
+        return function.objective(p, ws.x, ws.y, True, workspace=ws)
+
+    def objective_alloc():
+        return function.objective(p, x, y_norm, False, ydata_init=y[:,0])
+
+    def fit():
+        Fitter(x, y, functions.construct(fitter)).run_scipy(
+                params_init(params, 0.9))
+
+    logger = logging.getLogger("supramolecular")
+    saved = (logger.level, list(logger.handlers), logger.propagate,
+             numtrace.enabled, numtrace._every)
+    tmp = tempfile.mkdtemp()
+
+    results = []
+    try:
+        for name, level, handler, trace, every in MODES:
+            for h in list(logger.handlers):
+                logger.removeHandler(h)
+            logger.setLevel(level)
+            logger.propagate = False
+
+            h = None
+            path = os.path.join(tmp, name.replace(" ", "_")+".log")
+            if handler == "file":
+                h = logging.FileHandler(path)
+            elif handler == "queue":
+                h = QueueFileHandler(path)
+            if h is not None:
+                h.setFormatter(logging.Formatter(
+                    "[%(asctime)s] %(levelname)s [%(name)s:%(lineno)s] "
+                    "%(message)s"))
+                logger.addHandler(h)
+
+            numtrace.configure(enable=trace, every=every)
+
+            objective_ws()
+            t_ws    = timed(objective_ws,    number=number, repeat=repeat)
+            t_alloc = timed(objective_alloc, number=number, repeat=repeat)
+            t_fit   = timed(fit, number=1, repeat=repeat)
+
+            if h is not None:
+                logger.removeHandler(h)
+                h.close()
+
+            results.append({
+                "mode":             name,
+                "objective_ws":     t_ws["best"],
+                "objective_alloc":  t_alloc["best"],
+                "fit":              t_fit["best"],
+                "log_bytes":        os.path.getsize(path)
+                                    if os.path.exists(path) else 0,
+                })
+    finally:
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        level, handlers, propagate, trace, every = saved
+        logger.setLevel(level)
+        for h in handlers:
+            logger.addHandler(h)
+        logger.propagate = propagate
+        numtrace.configure(enable=trace, every=every)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return results
+
+def format_results(results):
+    lines = ["{:<16} {:>16} {:>18} {:>10} {:>12}".format(
+                "mode", "objective (us)", "objective+ (us)", "fit (ms)",
+                "log (kB)")]
+    for r in results:
+        lines.append("{:<16} {:>16.1f} {:>18.1f} {:>10.1f} {:>12.1f}".format(
+            r["mode"],
+            r["objective_ws"]*1e6,
+            r["objective_alloc"]*1e6,
+            r["fit"]*1e3,
+            r["log_bytes"]/1024))
+    lines.append("objective+: allocating objective path (scalar=False), as "
+                 "used by statistics")
+    return "\n".join(lines)
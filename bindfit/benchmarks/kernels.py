@@ -0,0 +1,344 @@
+"""
+" Equilibrium kernel microbenchmarks: each model function in functions.py,
+" and the binding and aggregation objectives, timed over realistic array
+" sizes and extreme binding constants, with accuracy measured against
+" extended precision (np.longdouble) reference solutions. Results can be
+" compared with a baseline report to accept or reject kernel changes.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import timeit
+import itertools
+
+import numpy as np
+
+from .. import functions
+from .. import helpers
+from ..workspace import Workspace
+from . import synthetic_x, synthetic_data, timed
+
+LD = np.longdouble
+
+POINTS  = (10, 100, 1000)
+SIGNALS = (10, 100)
+
+# Kernel: (fitter key, parameter sets from low to extreme binding)
+KERNELS = {
+        "nmr_1to1":  ("nmr1to1",  [[1e1], [1e3], [1e6], [1e9]]),
+        "uv_1to1":   ("uv1to1",   [[1e1], [1e3], [1e6], [1e9]]),
+        "nmr_1to2":  ("nmr1to2",  [[1e2, 1e1], [1e4, 1e3], [1e7, 1e6]]),
+        "uv_1to2":   ("uv1to2",   [[1e2, 1e1], [1e4, 1e3], [1e7, 1e6]]),
+        "nmr_2to1":  ("nmr2to1",  [[1e2, 1e1], [1e4, 1e3], [1e7, 1e6]]),
+        "uv_2to1":   ("uv2to1",   [[1e2, 1e1], [1e4, 1e3], [1e7, 1e6]]),
+        "nmr_dimer": ("nmrdimer", [[1e-1], [1e2], [1e5]]),
+        "uv_dimer":  ("uvdimer",  [[1e-1], [1e2], [1e5]]),
+        "nmr_coek":  ("nmrcoek",  [[1e-1, 0.3], [2e2, 0.3], [1e5, 0.3]]),
+        "uv_coek":   ("uvcoek",   [[1e-1, 0.003], [2.7e3, 0.003],
+                                   [1e5, 0.003]]),
+        "inhibitor_response":
+                     ("inhibitor",[[-1, -2], [-3, 0], [-0.5, 0.5]]),
+        }
+
+# Kernels solving a cubic, timed with and without previous roots
+CUBIC = ("nmr_1to2", "uv_1to2", "nmr_2to1", "uv_2to1")
+
+OBJECTIVES = {
+        "BindingMixin.objective": ("nmr1to2",  {"k1": 1e4, "k2": 1e3}),
+        "AggMixin.objective":     ("nmrdimer", {"ke": 1e2}),
+        }
+
+
+
+#
+# Extended precision references
+#
+
+def _bisect(f, lo, hi, n_iter=200):
+    # Root of increasing f between lo and hi (arrays), by bisection
+    for i in range(n_iter):
+        mid = (lo + hi)/2
+        neg = f(mid) < 0
+        lo = np.where(neg, mid, lo)
+        hi = np.where(neg, hi, mid)
+    return (lo + hi)/2
+
+def _cubic(a, b, c, d):
+    return lambda x: ((a*x + b)*x + c)*x + d
+
+def _1to1(params, x):
+    # [HG] by the cancellation-free root of the mass balance quadratic
+    k = LD(params[0])
+    h0, g0 = x
+    s = g0 + h0 + 1/k
+    hg = 2*h0*g0/(s + np.sqrt(s*s - 4*h0*g0))
+    return h0 - hg, hg
+
+def _1to2(params, x):
+    # Concentrations of H, HG and HG2 from free [G]
+    k11, k12 = LD(params[0]), LD(params[1])
+    h0, g0 = x
+    g = _bisect(_cubic(k11*k12,
+                       2*k11*k12*h0 + k11 - g0*k11*k12,
+                       1 + k11*h0 - k11*g0,
+                       -g0),
+                np.zeros_like(g0), g0)
+    denom = 1 + g*k11 + g*g*k11*k12
+    hg  = h0*g*k11/denom
+    hg2 = h0*g*g*k11*k12/denom
+    return h0 - hg - hg2, hg, hg2
+
+def _2to1(params, x):
+    # Concentrations of H, HG and H2G (as H) from free [H]
+    k11, k12 = LD(params[0]), LD(params[1])
+    h0, g0 = x
+    h = _bisect(_cubic(k11*k12,
+                       2*k11*k12*g0 + k11 - h0*k11*k12,
+                       1 + k11*g0 - k11*h0,
+                       -h0),
+                np.zeros_like(h0), h0)
+    denom = 1 + h*k11 + h*h*k11*k12
+    hg  = g0*h*k11/denom
+    h2g = g0*2*h*h*k11*k12/denom
+    return h0 - hg - h2g, hg, h2g
+
+def _agg(h, u, rho, h0, scale):
+    # Monomer, in stack and at end fractions from free monomer fraction
+    hs = rho*h*(h*u)**2/(1 - h*u)**2
+    he = 2*rho*h*h*u/(1 - h*u)
+    return (h*h0, hs*h0, he*h0) if scale else (h, hs, he)
+
+def _dimer(params, x, scale=False):
+    # Free monomer fraction by the cancellation-free form of eq 143
+    u = LD(params[0])*x[0]
+    h = 2/((2*u + 1) + np.sqrt(4*u + 1))
+    return _agg(h, u, 1, x[0], scale)
+
+def _coek(params, x, scale=False):
+    # Free monomer fraction from eq 146, bracketed by [0, 1/(Ke [H]0)]
+    ke, rho = LD(params[0]), LD(params[1])
+    u = ke*x[0]
+    h = _bisect(_cubic(u*u*(1 - rho), 2*rho*u - 2*u - u*u, 2*u + 1, -1),
+                np.zeros_like(u), 1/u)
+    return _agg(h, u, rho, x[0], scale)
+
+def _inhibitor(params, x):
+    hillslope, logic50 = LD(params[0]), LD(params[1])
+    return (100/(1 + 10**((logic50 - x[1])*hillslope)),)
+
+def reference(kernel, params, x):
+    """
+    Extended precision equivalent of a kernel's fitted output rows.
+    """
+    x = x.astype(LD)
+    if kernel == "nmr_1to1":
+        h, hg = _1to1(params, x)
+        return np.vstack((h/x[0], hg/x[0]))
+    if kernel == "uv_1to1":
+        return np.vstack(_1to1(params, x))
+    if kernel == "nmr_1to2":
+        return np.vstack(_1to2(params, x))/x[0]
+    if kernel == "uv_1to2":
+        return np.vstack(_1to2(params, x))
+    if kernel == "nmr_2to1":
+        return np.vstack(_2to1(params, x))/x[0]
+    if kernel == "uv_2to1":
+        return np.vstack(_2to1(params, x))
+    if kernel in ("nmr_dimer", "uv_dimer"):
+        return np.vstack(_dimer(params, x, kernel == "uv_dimer"))
+    if kernel in ("nmr_coek", "uv_coek"):
+        return np.vstack(_coek(params, x, kernel == "uv_coek"))
+    if kernel == "inhibitor_response":
+        return np.vstack(_inhibitor(params, x))
+    raise KeyError(kernel)
+
+def accuracy(result, ref):
+    """
+    Largest error of each row relative to the row's largest reference
+    value (tiny species aren't held to full relative precision).
+    """
+    result = np.real(np.atleast_2d(result)).astype(LD)
+    scale = np.max(np.abs(ref), axis=1)
+    scale[scale == 0] = 1
+    return float(np.max(np.max(np.abs(result - ref), axis=1)/scale))
+
+
+
+#
+# Timing
+#
+
+def calibrate(fn, target=0.05):
+    # Calls per timing repeat so that a repeat takes about target seconds
+    number = 1
+    while True:
+        t = timeit.timeit(fn, number=number)
+        if t >= target or number >= 1e6:
+            return number
+        number *= max(2, int(target/max(t, 1e-9)))
+
+def _x(fitter, points):
+    if fitter == "inhibitor":
+        return np.vstack((np.ones(points), np.linspace(-4, 1, points)))
+    return synthetic_x(fitter, points)
+
+def run_kernel(kernel, points, repeat=10, warmup=3):
+    fitter, param_sets = KERNELS[kernel]
+    f = getattr(functions, kernel)
+    x = _x(fitter, points)
+
+    results = []
+    for params in param_sets:
+        p = np.array(params, dtype=float)
+
+        modes = [("direct", lambda: f(p, x))]
+        if kernel in CUBIC:
+            # Newton refinement from the roots of slightly different params,
+            # as between optimiser steps
+            prev = np.full(points, np.nan)
+            f(p*1.01, x, roots=prev)
+            roots = prev.copy()
+            def newton():
+                roots[:] = prev
+                return f(p, x, roots=roots)
+            modes.append(("newton", newton))
+
+        for mode, fn in modes:
+            with np.errstate(all="ignore"):
+                out = fn()
+                if kernel == "inhibitor_response":
+                    out = (out,)
+                error = accuracy(out[0], reference(kernel, params, x))
+                t = timed(fn, number=calibrate(fn), repeat=repeat,
+                          warmup=warmup)
+
+            results.append({
+                "name":   kernel,
+                "mode":   mode,
+                "params": params,
+                "points": points,
+                "time":   t,
+                "error":  error,
+                })
+    return results
+
+def run_objective(name, points, signals, repeat=10, warmup=3):
+    fitter, params = OBJECTIVES[name]
+    x, y, _ = synthetic_data(fitter, points, signals, params=params)
+    function = functions.construct(fitter)
+    p = np.array([ params[k] for k in sorted(params) ])
+
+    y_norm = helpers.normalise(y)
+    ws = Workspace(x, y)
+
+    modes = [
+            ("alloc",     lambda: function.objective(p, x, y_norm, True)),
+            ("workspace", lambda: function.objective(p, ws.x, ws.y, True,
+                                                     workspace=ws)),
+            ]
+
+    results = []
+    ssr = {}
+    for mode, fn in modes:
+        with np.errstate(all="ignore"):
+            ssr[mode] = fn()
+            t = timed(fn, number=calibrate(fn), repeat=repeat, warmup=warmup)
+        results.append({
+            "name":    name,
+            "mode":    mode,
+            "params":  list(p),
+            "points":  points,
+            "signals": signals,
+            "time":    t,
+            # Agreement of the two objective paths
+            "error":   None,
+            })
+
+    results[1]["error"] = float(abs(ssr["workspace"] - ssr["alloc"])
+                                / max(abs(ssr["alloc"]), 1e-300))
+    return results
+
+def run(kernels=None, points=POINTS, signals=SIGNALS, objectives=True,
+        repeat=10, warmup=3):
+    """
+    Run the kernel microbenchmarks.
+
+    Returns:
+        list  One result dict per kernel, parameter set, size and mode
+    """
+    results = []
+    for kernel, n in itertools.product(kernels or sorted(KERNELS), points):
+        results.extend(run_kernel(kernel, n, repeat=repeat, warmup=warmup))
+
+    if objectives:
+        for name, n, m in itertools.product(sorted(OBJECTIVES), points,
+                                            signals):
+            results.extend(run_objective(name, n, m, repeat=repeat,
+                                         warmup=warmup))
+    return results
+
+def key(r):
+    # Identifies a result across reports
+    return "{} {} {} n={}{}".format(
+            r["name"], r["mode"],
+            ",".join("{:g}".format(p) for p in r["params"]),
+            r["points"],
+            " m={}".format(r["signals"]) if "signals" in r else "")
+
+def compare(results, baseline, error_tolerance=10):
+    """
+    Compare results with a baseline report's. A case is faster or slower
+    only if the 95% confidence intervals of the mean times don't overlap,
+    and less accurate if its error grew by more than error_tolerance times
+    (and above 1e-12).
+
+    Returns:
+        list  Dicts of key, verdict ("faster", "slower", "less accurate"),
+              and the ratio of mean times
+    """
+    base = { key(r): r for r in baseline }
+    verdicts = []
+
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+
+        t, tb = r["time"], b["time"]
+        ratio = t["mean"]/tb["mean"]
+        if t["mean"] + t["ci95"] < tb["mean"] - tb["ci95"]:
+            verdicts.append({"key": key(r), "verdict": "faster",
+                             "ratio": ratio})
+        elif t["mean"] - t["ci95"] > tb["mean"] + tb["ci95"]:
+            verdicts.append({"key": key(r), "verdict": "slower",
+                             "ratio": ratio})
+
+        if r["error"] is not None and b["error"] is not None and \
+                r["error"] > max(b["error"]*error_tolerance, 1e-12):
+            verdicts.append({"key": key(r), "verdict": "less accurate",
+                             "ratio": ratio})
+
+    return verdicts
+
+def format_results(results, verdicts=None):
+    lines = ["{:<48} {:>12} {:>10} {:>10}".format(
+                "case", "mean (us)", "ci95 (us)", "error")]
+    for r in results:
+        lines.append("{:<48} {:>12.2f} {:>10.2f} {:>10}".format(
+            key(r),
+            r["time"]["mean"]*1e6,
+            r["time"]["ci95"]*1e6,
+            "{:.1e}".format(r["error"]) if r["error"] is not None else "-"))
+    lines.append("error: kernels, largest error relative to the species' "
+                 "largest extended precision value; objectives, workspace "
+                 "vs. allocating SSR")
+
+    if verdicts is not None:
+        lines.append("")
+        lines.append("Against baseline ({} changed)".format(len(verdicts)))
+        for v in verdicts:
+            lines.append("  {:<48} {:<14} {:.2f}x".format(
+                v["key"], v["verdict"], v["ratio"]))
+
+    return "\n".join(lines)
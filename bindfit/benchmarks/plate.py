@@ -0,0 +1,126 @@
+"""
+" Plate-mode dose-response benchmark: vectorised plate fitter vs. looping the
+" single-curve inhibitor objective through scipy.optimize.minimize, configured
+" as Fitter.run_scipy does
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+from functools import partial
+
+import numpy as np
+import scipy.optimize
+
+from .. import functions
+from .. import plate
+from ..workspace import Workspace
+
+PLATES = (96, 384, 1536)
+
+def synthetic_plate(curves, doses=12, noise=3., seed=0):
+    """
+    Generate noisy 2 parameter dose-response curves.
+
+    Returns:
+        (x, y, p)  n log doses, c x n responses and c x 4 true parameters
+    """
+    rng = np.random.RandomState(seed)
+
+    x = np.linspace(-4, 1, doses)
+    p = np.zeros((curves, 4))
+    p[:,0] = rng.uniform(-3, 0, curves)
+    p[:,1] = rng.uniform(0.5, 2, curves)*rng.choice([-1, 1], curves)
+    p[:,3] = 100
+
+    y = plate.response(p, np.broadcast_to(x, (curves, doses)))
+    y += noise*rng.standard_normal(y.shape)
+    return x, y, p
+
+def fit_loop(x, y, p0):
+    """
+    Fit each curve separately with the inhibitor objective.
+
+    Returns:
+        array  c x 2 (logIC50, hillslope) results
+    """
+    function = functions.construct("inhibitor")
+    xdata = np.vstack((np.ones_like(x), x))
+    results = np.empty((y.shape[0], 2))
+
+    for i in range(y.shape[0]):
+        ws = Workspace(xdata, y[i:i+1], normalise=False)
+        # Inhibitor parameters in sorted order: hillslope, logic50
+        result = scipy.optimize.minimize(
+                partial(function.objective, workspace=ws),
+                [p0[i,1], p0[i,0]],
+                args=(ws.x, ws.y, True),
+                method="Nelder-Mead",
+                tol=1e-18)
+        results[i] = result.x[1], result.x[0]
+
+    return results
+
+def run(plates=PLATES, doses=12, loop_max=384):
+    """
+    Time plate and looped fits of synthetic plates of each size. Looped fits
+    of plates larger than loop_max are timed on loop_max curves and scaled.
+
+    Returns:
+        list  One result dict per plate size
+    """
+    results = []
+
+    for curves in plates:
+        x, y, p_true = synthetic_plate(curves, doses)
+
+        tic = time.perf_counter()
+        r = plate.fit(x, y)
+        t_plate = time.perf_counter() - tic
+
+        # Same starting points for both
+        p0 = plate.initial_params(np.broadcast_to(x, y.shape), y)
+
+        n_loop = min(curves, loop_max)
+        tic = time.perf_counter()
+        looped = fit_loop(x, y[:n_loop], p0[:n_loop])
+        t_loop = (time.perf_counter() - tic)*curves/n_loop
+
+        # None (undefined) values as NaN
+        columns = { k: np.array(v, dtype="float64")
+                    for k, v in r["columns"].items() }
+        results.append({
+            "curves":     curves,
+            "doses":      doses,
+            "plate_time": t_plate,
+            "loop_time":  t_loop,
+            "loop_scaled":n_loop < curves,
+            "speedup":    t_loop/t_plate,
+            "flagged":    int(np.count_nonzero(columns["flags"])),
+            "max_iter":   int(columns["n_iter"].max()),
+            # Agreement with looped fits and with the true values
+            "logic50_max_diff_loop": float(np.abs(
+                columns["logic50"][:n_loop] - looped[:,0]).max()),
+            "logic50_median_err":    float(np.median(np.abs(
+                columns["logic50"] - p_true[:,0]))),
+            })
+
+    return results
+
+def format_results(results):
+    lines = ["{:>6} {:>12} {:>12} {:>9} {:>8} {:>14}".format(
+                "curves", "plate (s)", "loop (s)", "speedup", "flagged",
+                "max |dlogIC50|")]
+    for r in results:
+        lines.append("{:>6d} {:>12.4f} {:>11.3f}{} {:>9.1f} {:>8d} {:>14.2e}".format(
+            r["curves"],
+            r["plate_time"],
+            r["loop_time"],
+            "*" if r["loop_scaled"] else " ",
+            r["speedup"],
+            r["flagged"],
+            r["logic50_max_diff_loop"]))
+    if any(r["loop_scaled"] for r in results):
+        lines.append("* extrapolated from a subset of curves")
+    return "\n".join(lines)
@@ -0,0 +1,221 @@
+"""
+" Scaling benchmark: time and memory of each stage of a fit request
+" (Data.to_dict, objective evaluation, Fitter.run_scipy, statistics,
+" formatter.fit and JSON rendering) across titration point and signal
+" counts, with complexity exponents fitted to the results
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import resource
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from rest_framework.renderers import JSONRenderer
+
+from .. import models
+from .. import functions
+from .. import formatter
+from ..fitter import Fitter
+from ..workspace import Workspace
+from . import synthetic_data, params_init, peak_alloc
+
+FITTERS = ("nmr1to1", "uv1to2")
+POINTS  = (10, 30, 100, 300, 1000)
+SIGNALS = (1, 10, 100, 500, 2000)
+
+STAGES  = ("to_dict", "objective", "run_scipy", "statistics", "format",
+           "render")
+
+def _stage(fn, memory=True):
+    # Time (s) of one call, and peak traced allocation (bytes) of a second
+    tic = time.perf_counter()
+    fn()
+    t = time.perf_counter() - tic
+    return {"time": t, "bytes": peak_alloc(fn) if memory else None}
+
+def _objective_time(fn, min_time=0.2):
+    # Mean time per call over at least min_time
+    n = 0
+    tic = time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.perf_counter() - tic
+        if elapsed >= min_time:
+            return elapsed/n
+
+def run_case(args):
+    """
+    Measure each stage for one (fitter, points, signals) case.
+
+    Arguments:
+        args: tuple  (fitter, points, signals, memory)
+
+    Returns:
+        dict  Per stage time (s) and peak traced allocation (bytes), and the
+              process' peak RSS (kB) before and after the case
+    """
+    fitter, points, signals, memory = args
+    rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    x, y, params = synthetic_data(fitter, points, signals)
+    stages = {}
+
+    # Stored as configured by settings.BINDFIT_DATA_STORAGE
+    data = models.Data.from_arrays(
+            "benchmark", x, y[np.newaxis],
+            [ "x{}".format(i) for i in range(x.shape[0]) ],
+            [ "y{}".format(i) for i in range(signals) ])
+    result = {}
+    def to_dict():
+        result["data"] = data.to_dict(fitter=fitter)
+    stages["to_dict"] = _stage(to_dict, memory)
+    data = result["data"]
+    datax = data["data"]["x"]
+    datay = data["data"]["y"]
+
+    f = Fitter(datax, datay, functions.construct(fitter))
+
+    ws = Workspace(datax, datay)
+    p = np.array([ params[k] for k in sorted(params) ])
+    def objective():
+        f.function.objective(p, ws.x, ws.y, True, workspace=ws)
+    objective()
+    stages["objective"] = {
+            "time":  _objective_time(objective),
+            "bytes": peak_alloc(objective) if memory else None,
+            }
+
+    def run_scipy():
+        f.run_scipy(params_init(params, 0.9))
+    stages["run_scipy"] = _stage(run_scipy, memory)
+
+    def statistics():
+        f.statistics(f._params_raw, f.fit, f.coeffs_raw, f.residuals)
+    stages["statistics"] = _stage(statistics, memory)
+
+    def format_fit():
+        result["response"] = formatter.fit(fitter      =fitter,
+                                           data        =data,
+                                           y           =f.fit,
+                                           params      =f.params,
+                                           residuals   =f.residuals,
+                                           coeffs_raw  =f.coeffs_raw,
+                                           molefrac_raw=f.molefrac_raw,
+                                           coeffs      =f.coeffs,
+                                           molefrac    =f.molefrac,
+                                           time        =f.time,
+                                           dilute      =False,
+                                           normalise   =True,
+                                           method      ="",
+                                           flavour     ="")
+    stages["format"] = _stage(format_fit, memory)
+
+    response = result["response"]
+    def render():
+        result["body"] = JSONRenderer().render(response)
+    stages["render"] = _stage(render, memory)
+
+    return {
+            "fitter":        fitter,
+            "points":        points,
+            "signals":       signals,
+            "stages":        stages,
+            "response_size": len(result["body"]),
+            "rss_base":      rss_base,
+            "rss_peak":      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+
+def run(fitters=FITTERS, points=POINTS, signals=SIGNALS, memory=True,
+        isolate=True):
+    """
+    Run the scaling benchmark.
+
+    Arguments:
+        memory:  bool  Measure traced allocations (runs each stage twice)
+        isolate: bool  Run each case in a fresh process, so its peak RSS
+                       isn't that of an earlier, larger case
+
+    Returns:
+        dict  Case results, and fitted complexity exponents
+    """
+    cases = [ (fitter, n, m, memory)
+              for fitter, n, m in itertools.product(fitters, points, signals) ]
+
+    if isolate:
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            results = pool.map(run_case, cases, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [ run_case(case) for case in cases ]
+
+    return {"cases": results, "exponents": exponents(results)}
+
+def exponents(results):
+    """
+    Fit log(t) = a + b*log(points) + c*log(signals) per fitter and stage,
+    for time and (where measured) traced allocation.
+
+    Returns:
+        list  Dicts of fitter, stage, metric and exponents b (points) and
+              c (signals)
+    """
+    fits = []
+    for fitter in sorted(set(r["fitter"] for r in results)):
+        rs = [ r for r in results if r["fitter"] == fitter ]
+        n = np.array([ r["points"]  for r in rs ], dtype=float)
+        m = np.array([ r["signals"] for r in rs ], dtype=float)
+
+        for stage, metric in itertools.product(STAGES, ("time", "bytes")):
+            v = np.array([ r["stages"][stage][metric] or 0 for r in rs ],
+                         dtype=float)
+            select = v > 0
+            # Need both dimensions to vary to fit both exponents
+            if len(set(n[select])) < 2 or len(set(m[select])) < 2:
+                continue
+
+            a = np.vstack((np.ones(select.sum()),
+                           np.log(n[select]),
+                           np.log(m[select]))).T
+            coeffs = np.linalg.lstsq(a, np.log(v[select]))[0]
+            fits.append({"fitter": fitter,
+                         "stage":  stage,
+                         "metric": metric,
+                         "points": float(coeffs[1]),
+                         "signals":float(coeffs[2])})
+    return fits
+
+def format_results(results):
+    lines = ["{:<8} {:>6} {:>7} ".format("fitter", "points", "signals")
+             +" ".join("{:>11}".format(s) for s in STAGES)
+             +" {:>9} {:>9}".format("resp (kB)", "rss (MB)")]
+    for r in results["cases"]:
+        lines.append("{:<8} {:>6d} {:>7d} ".format(r["fitter"], r["points"],
+                                                    r["signals"])
+                     +" ".join("{:>11.3g}".format(r["stages"][s]["time"]*1e3)
+                               for s in STAGES)
+                     +" {:>9.1f} {:>9.1f}".format(
+                         r["response_size"]/1024,
+                         (r["rss_peak"] - r["rss_base"])/1024))
+    lines.append("Stage times in ms (objective: per evaluation), rss: peak "
+                 "RSS increase during the case")
+
+    lines.append("")
+    lines.append("{:<8} {:<11} {:<6} {:>8} {:>8}".format(
+        "fitter", "stage", "metric", "points", "signals"))
+    for e in results["exponents"]:
+        lines.append("{:<8} {:<11} {:<6} {:>8.2f} {:>8.2f}".format(
+            e["fitter"], e["stage"], e["metric"], e["points"], e["signals"]))
+    lines.append("Complexity exponents: time or allocation ~ "
+                 "points^a * signals^b, fitted over all cases (fixed "
+                 "overheads lower them at small sizes)")
+
+    return "\n".join(lines)
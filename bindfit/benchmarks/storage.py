@@ -0,0 +1,144 @@
+"""
+" Data storage benchmark: save and load times and stored size of input data
+" arrays as nested ArrayFields vs. arraycodec binary blobs (uncompressed and
+" zlib compressed), across titration point and signal counts
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import itertools
+
+import numpy as np
+
+from .. import arraycodec
+from . import synthetic_data, timed
+
+POINTS  = (20, 100, 500)
+SIGNALS = (1, 100, 1000)
+
+# Name: (Data storage, compress)
+FORMATS = (
+        ("array",       ("array",  None)),
+        ("binary",      ("binary", False)),
+        ("binary+zlib", ("binary", True)),
+        )
+
+def _pg_literal(lists):
+    # Postgres array literal, as sent for an ArrayField value
+    return json.dumps(lists).replace("[", "{").replace("]", "}")
+
+def _pg_parse(text):
+    # Nested lists from a Postgres array literal, as returned for an
+    # ArrayField value
+    return json.loads(text.replace("{", "[").replace("}", "]"))
+
+def _codecs(x, y, storage, compress):
+    # (save, load) callables converting x and y to and from their stored
+    # representation, and the stored size (bytes)
+    if storage == "array":
+        stored = (_pg_literal(x.tolist()), _pg_literal(y.tolist()))
+        def save():
+            return _pg_literal(x.tolist()), _pg_literal(y.tolist())
+        def load():
+            return (np.array(_pg_parse(stored[0])),
+                    np.array(_pg_parse(stored[1])))
+        # float8[] values are stored as 8 bytes per element
+        return save, load, 8*(x.size + y.size)
+
+    stored = (arraycodec.encode(x, compress), arraycodec.encode(y, compress))
+    def save():
+        return arraycodec.encode(x, compress), arraycodec.encode(y, compress)
+    def load():
+        return arraycodec.decode(stored[0]), arraycodec.decode(stored[1])
+    return save, load, len(stored[0]) + len(stored[1])
+
+def _database(x, y, storage, compress, number, repeat):
+    # Save and load times through the ORM, and stored column sizes, of a Data
+    # row saved in a transaction that is rolled back
+    from django.db import connection, transaction
+    from .. import models
+
+    result = {}
+    with transaction.atomic():
+        def save():
+            models.Data.from_arrays("benchmark", x, y, [], [],
+                                    storage=storage,
+                                    compress=compress).save()
+        def load():
+            d = models.Data.objects.get(id="benchmark")
+            return d.x_array(), d.y_array()
+
+        result["save"] = timed(save, number=number, repeat=repeat)
+        result["load"] = timed(load, number=number, repeat=repeat)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT coalesce(pg_column_size(x), 0) "
+                "+ coalesce(pg_column_size(y), 0) "
+                "+ coalesce(pg_column_size(x_blob), 0) "
+                "+ coalesce(pg_column_size(y_blob), 0) "
+                "FROM bindfit_data WHERE id = %s", ["benchmark"])
+            result["bytes"] = cursor.fetchone()[0]
+
+        transaction.set_rollback(True)
+    return result
+
+def run(points=POINTS, signals=SIGNALS, fitter="uv1to1", database=False,
+        number=20, repeat=5):
+    """
+    Run the storage benchmark.
+
+    Arguments:
+        database: bool  Also time saving and loading Data rows through the
+                        configured database (in a rolled back transaction)
+
+    Returns:
+        list  One result dict per (points, signals, format) case
+    """
+    results = []
+    for n, m in itertools.product(points, signals):
+        x, y, _ = synthetic_data(fitter, n, m)
+        y = y[np.newaxis]
+
+        for name, (storage, compress) in FORMATS:
+            save, load, size = _codecs(x, y, storage, compress)
+            result = {
+                    "points":  n,
+                    "signals": m,
+                    "format":  name,
+                    "save":    timed(save, number=number, repeat=repeat),
+                    "load":    timed(load, number=number, repeat=repeat),
+                    "bytes":   size,
+                    "db":      None,
+                    }
+            if database:
+                result["db"] = _database(x, y, storage, compress, number,
+                                         repeat)
+            results.append(result)
+
+    return results
+
+def format_results(results):
+    lines = ["{:>6} {:>7} {:<12} {:>10} {:>10} {:>10} {:>10} {:>10} "
+             "{:>10}".format("points", "signals", "format", "save (ms)",
+                             "load (ms)", "kB", "db save", "db load",
+                             "db kB")]
+    for r in results:
+        db = r["db"]
+        lines.append("{:>6d} {:>7d} {:<12} {:>10.3f} {:>10.3f} {:>10.1f} "
+                     "{:>10} {:>10} {:>10}".format(
+            r["points"],
+            r["signals"],
+            r["format"],
+            r["save"]["best"]*1e3,
+            r["load"]["best"]*1e3,
+            r["bytes"]/1024,
+            "{:.3f}".format(db["save"]["best"]*1e3) if db else "-",
+            "{:.3f}".format(db["load"]["best"]*1e3) if db else "-",
+            "{:.1f}".format(db["bytes"]/1024) if db else "-"))
+    lines.append("save/load: conversion to and from the stored value (array: "
+                 "via the Postgres array literal), best of repeats. db: "
+                 "through the ORM and database, with stored column sizes")
+    return "\n".join(lines)
@@ -0,0 +1,262 @@
+"""
+" Fitting benchmark suite: fits noisy synthetic titrations across fitters,
+" binding constants, point and signal counts, timing Fitter.run_scipy (with
+" statistics) and calc_monte_carlo, and checking recovery of the true
+" parameters. Reports can be compared against a stored baseline report to
+" flag regressions.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import json
+import itertools
+
+import numpy as np
+
+from bindsim import simulators
+
+from .. import functions
+from .. import diagnostics
+from ..fitter import Fitter, raw_value
+from . import synthetic_data, params_init
+
+H0  = 1e-3 # Initial host concentration of simulated titrations (M)
+GEQ = 20   # Final guest equivalents
+
+# Fitter: bindsim simulator, and its argument for each fitter parameter
+SIMULATORS = {
+        "nmr1to1": (simulators.nmr_1to1, {"k":  "k1"}),
+        "uv1to1":  (simulators.uv_1to1,  {"k":  "k1"}),
+        "nmr1to2": (simulators.nmr_1to2, {"k1": "k1", "k2": "k2"}),
+        "uv1to2":  (simulators.uv_1to2,  {"k1": "k1", "k2": "k2"}),
+        "nmr2to1": (simulators.nmr_2to1, {"k1": "k1", "k2": "k2"}),
+        "uv2to1":  (simulators.uv_2to1,  {"k1": "k1", "k2": "k2"}),
+        }
+
+# Simulator response arguments, drawn per signal from these ranges
+RESPONSES = {
+        "nmr": {"dh": (7, 9), "dhg": (6, 10), "dhg2": (6, 10), "dh2g": (6, 10)},
+        "uv":  {"dh": (0.1, 1), "dhg": (0.5, 2), "dhg2": (0.5, 2),
+                "dh2g": (0.5, 2)},
+        }
+
+# Fitter: true parameter sets (low to high binding constants)
+PARAMS = {
+        "nmr1to1":  [{"k": 1e2}, {"k": 1e3}, {"k": 1e4}],
+        "uv1to1":   [{"k": 1e2}, {"k": 1e3}, {"k": 1e4}],
+        "nmr1to2":  [{"k1": 1e3, "k2": 1e2}, {"k1": 1e4, "k2": 1e3}],
+        "uv1to2":   [{"k1": 1e3, "k2": 1e2}, {"k1": 1e4, "k2": 1e3}],
+        "nmr2to1":  [{"k1": 1e3, "k2": 1e2}, {"k1": 1e4, "k2": 1e3}],
+        "uv2to1":   [{"k1": 1e3, "k2": 1e2}, {"k1": 1e4, "k2": 1e3}],
+        "nmrdimer": [{"ke": 1e2}, {"ke": 1e3}],
+        "uvdimer":  [{"ke": 1e2}, {"ke": 1e3}],
+        "nmrcoek":  [{"ke": 2e2, "rho": 0.3}],
+        "uvcoek":   [{"ke": 2.7e3, "rho": 0.003}],
+        }
+
+POINTS  = (20, 50)
+SIGNALS = (1, 10)
+
+def simulate(fitter, params, points, signals, noise=0.005, seed=0):
+    """
+    Generate a noisy synthetic titration with the bindsim simulators, one
+    simulator run per signal with random responses. Fitters without a
+    simulator (aggregation models) use their own model function (see
+    benchmarks.synthetic_data).
+
+    Returns:
+        (x, y, source)  x and y arrays, and "bindsim" or "model"
+    """
+    if fitter not in SIMULATORS:
+        x, y, _ = synthetic_data(fitter, points, signals, params=params,
+                                 noise=noise, seed=seed)
+        return x, y, "model"
+
+    rng = np.random.RandomState(seed)
+    simulator, names = SIMULATORS[fitter]
+    responses = RESPONSES["uv" if fitter.startswith("uv") else "nmr"]
+
+    args = { names[key]: value for key, value in params.items() }
+    args.update({"h0_init": H0, "g0h0_final": GEQ, "num": points})
+
+    code = simulator.__code__
+
+    y = []
+    for i in range(signals):
+        for name, (low, high) in responses.items():
+            if name in code.co_varnames[:code.co_argcount]:
+                args[name] = rng.uniform(low, high)
+        g0h0, dd = simulator(**args)[:2]
+        y.append(dd)
+
+    y = np.array(y)
+    y *= 1 + noise*rng.standard_normal(y.shape)
+
+    x = np.vstack((H0*np.ones(points), H0*g0h0))
+    return x, y, "bindsim"
+
+def cases(fitters=None, points=POINTS, signals=SIGNALS):
+    """
+    Benchmark cases: (fitter, params, points, signals) tuples.
+    """
+    fitters = fitters or sorted(PARAMS)
+    return [ (fitter, params, n, m)
+             for fitter in fitters
+             for params, n, m in itertools.product(PARAMS[fitter],
+                                                   points,
+                                                   signals) ]
+
+def case_key(fitter, params, points, signals):
+    # Identifies a case across reports
+    return "{} {} n={} m={}".format(
+            fitter,
+            ",".join("{}={:g}".format(k, params[k]) for k in sorted(params)),
+            points,
+            signals)
+
+def run_case(fitter, params, points, signals, mc_iter=20, noise=0.005,
+             seed=0):
+    x, y, source = simulate(fitter, params, points, signals, noise, seed)
+
+    result = {
+            "key":     case_key(fitter, params, points, signals),
+            "fitter":  fitter,
+            "params":  params,
+            "points":  points,
+            "signals": signals,
+            "source":  source,
+            "error":   None,
+            }
+
+    f = Fitter(x, y, functions.construct(fitter))
+
+    try:
+        with diagnostics.collect() as diag:
+            tic = time.perf_counter()
+            f.run_scipy(params_init(params, 0.5))
+            result["fit_time"] = time.perf_counter() - tic
+
+        result["optimise_time"]   = diag.timings.get("optimise")
+        result["statistics_time"] = diag.timings.get("statistics")
+        result["evaluations"]     = diag.counters.get("objective", 0)
+        result["iterations"]      = diag.optimiser["iterations"]
+
+        # Largest relative error of recovered parameters. Only meaningful
+        # for bindsim data, synthetic_data's aggregation species don't match
+        # the fitted model's (h + he/2, hs + he/2) terms
+        if source == "bindsim":
+            result["recovery_error"] = float(max(
+                    abs(raw_value(f.params[k]) - v)/v
+                    for k, v in params.items()))
+        else:
+            result["recovery_error"] = None
+
+        if mc_iter:
+            tic = time.perf_counter()
+            f.calc_monte_carlo(mc_iter, [0.01]*x.shape[0], 0.01, seed=seed)
+            result["mc_time"] = time.perf_counter() - tic
+            result["mc_rate"] = mc_iter/result["mc_time"]
+    except Exception as e:
+        # Ill-conditioned cases are reported, not fatal
+        result["error"] = repr(e)
+
+    return result
+
+def run(fitters=None, points=POINTS, signals=SIGNALS, mc_iter=20,
+        noise=0.005, seed=0):
+    """
+    Run the benchmark suite.
+
+    Returns:
+        list  One result dict per case
+    """
+    return [ run_case(fitter, params, n, m, mc_iter=mc_iter, noise=noise,
+                      seed=seed)
+             for fitter, params, n, m in cases(fitters, points, signals) ]
+
+def compare(results, baseline, time_tolerance=1.25, error_tolerance=0.01,
+            evaluation_tolerance=1.1):
+    """
+    Compare results against a baseline report's results.
+
+    Arguments:
+        time_tolerance:       float  Flag fit and MC times above this
+                                     multiple of baseline
+        error_tolerance:      float  Flag recovery error increases above this
+        evaluation_tolerance: float  Flag objective evaluations above this
+                                     multiple of baseline
+
+    Returns:
+        list  Regression dicts (key, metric, baseline and current values)
+    """
+    base = { r["key"]: r for r in baseline }
+    regressions = []
+
+    def flag(r, metric, old, new):
+        regressions.append({"key": r["key"], "metric": metric,
+                            "baseline": old, "current": new})
+
+    for r in results:
+        b = base.get(r["key"])
+        if b is None:
+            continue
+
+        if r["error"] is not None:
+            if b["error"] is None:
+                flag(r, "error", None, r["error"])
+            continue
+        if b["error"] is not None:
+            continue
+
+        for metric in ("fit_time", "mc_time"):
+            if metric in r and metric in b and \
+                    r[metric] > b[metric]*time_tolerance:
+                flag(r, metric, b[metric], r[metric])
+        if r["evaluations"] > b["evaluations"]*evaluation_tolerance:
+            flag(r, "evaluations", b["evaluations"], r["evaluations"])
+        if r["recovery_error"] is not None and \
+                b["recovery_error"] is not None and \
+                r["recovery_error"] > b["recovery_error"] + error_tolerance:
+            flag(r, "recovery_error", b["recovery_error"],
+                 r["recovery_error"])
+
+    return regressions
+
+def load_report(path):
+    # Results of a report written by the benchmark_suite command
+    with open(path) as f:
+        report = json.load(f)
+    return report["results"]
+
+def format_results(results, regressions=None):
+    lines = ["{:<38} {:>8} {:>9} {:>10} {:>7} {:>9} {:>9}".format(
+                "case", "source", "fit (ms)", "stats (ms)", "evals",
+                "mc it/s", "recovery")]
+    for r in results:
+        if r["error"] is not None:
+            lines.append("{:<38} {:>8} {}".format(r["key"], r["source"],
+                                                  r["error"]))
+            continue
+        lines.append("{:<38} {:>8} {:>9.1f} {:>10.1f} {:>7d} {:>9} {:>9}".format(
+            r["key"],
+            r["source"],
+            r["fit_time"]*1e3,
+            r["statistics_time"]*1e3,
+            r["evaluations"],
+            "{:.1f}".format(r["mc_rate"]) if "mc_rate" in r else "-",
+            "{:.2e}".format(r["recovery_error"])
+            if r["recovery_error"] is not None else "-"))
+    lines.append("recovery: largest relative error of fitted parameters "
+                 "(bindsim data only)")
+
+    if regressions is not None:
+        lines.append("")
+        lines.append("{} regression(s) against baseline".format(
+            len(regressions)))
+        for g in regressions:
+            lines.append("  {:<38} {:<14} {} -> {}".format(
+                g["key"], g["metric"], g["baseline"], g["current"]))
+
+    return "\n".join(lines)
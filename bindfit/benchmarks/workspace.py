@@ -0,0 +1,85 @@
+"""
+" Objective evaluation benchmark: allocating objective vs. preallocated
+" Workspace objective, both solving cubics with np.roots
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from .. import functions
+from .. import helpers
+from ..workspace import Workspace
+from . import synthetic_data, timed, peak_alloc
+
+CASES = [
+        ("nmr1to1",  "none"),
+        ("uv1to1",   "none"),
+        ("nmr1to2",  "none"),
+        ("uv1to2",   "add"),
+        ("nmrdimer", "none"),
+        ("uvcoek",   "none"),
+        ]
+
+def run(points=50, signals=10, number=200, repeat=5):
+    """
+    Evaluate the scalar objective for each case with and without a workspace.
+
+    Returns:
+        list  One result dict per case
+    """
+    results = []
+
+    for fitter, flavour in CASES:
+        x, y, params = synthetic_data(fitter, points, signals, flavour=flavour)
+        p = np.array([ params[k] for k in sorted(params) ])*1.1
+
+        function = functions.construct(fitter, flavour=flavour)
+
+        # Allocating path: preprocessing done up front, as Fitter did
+        y_norm = helpers.normalise(y)
+        def alloc():
+            return function.objective(p, x, y_norm, True)
+
+        ws = Workspace(x, y)
+        # Solve cubics directly as alloc() does, so only allocation is
+        # compared (the warm-started solver is timed by benchmark_kernels)
+        ws.roots = None
+        def prealloc():
+            return function.objective(p, ws.x, ws.y, True, workspace=ws)
+
+        # Warm up (also allocates workspace species buffers)
+        ssr_alloc = alloc()
+        ssr_ws    = prealloc()
+
+        t_alloc = timed(alloc,    number=number, repeat=repeat)
+        t_ws    = timed(prealloc, number=number, repeat=repeat)
+
+        results.append({
+            "fitter":   fitter,
+            "flavour":  flavour,
+            "points":   points,
+            "signals":  signals,
+            "alloc":    {"time": t_alloc, "bytes": peak_alloc(alloc)},
+            "workspace":{"time": t_ws,    "bytes": peak_alloc(prealloc)},
+            "speedup":  t_alloc["best"]/t_ws["best"],
+            "ssr_rel_diff": float(abs(ssr_ws - ssr_alloc)/ssr_alloc),
+            })
+
+    return results
+
+def format_results(results):
+    lines = ["{:<10} {:<8} {:>12} {:>12} {:>8} {:>12} {:>12}".format(
+                "fitter", "flavour", "alloc eval/s", "ws eval/s", "speedup",
+                "alloc bytes", "ws bytes")]
+    for r in results:
+        lines.append("{:<10} {:<8} {:>12.0f} {:>12.0f} {:>8.2f} {:>12d} {:>12d}".format(
+            r["fitter"],
+            r["flavour"],
+            r["alloc"]["time"]["rate"],
+            r["workspace"]["time"]["rate"],
+            r["speedup"],
+            r["alloc"]["bytes"],
+            r["workspace"]["bytes"]))
+    return "\n".join(lines)
@@ -0,0 +1,338 @@
+"""
+" Content-addressed cache of fit responses
+"
+" Fit responses (the output of formatter.fit) are stored under a SHA1 key of
+" the canonicalised fit inputs (data ID, fitter, options, initial parameters)
+" and the version of the numerical model code. Storage is delegated to a
+" pluggable backend selected by settings.BINDFIT_FIT_CACHE.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import pickle
+import hashlib
+import threading
+import tempfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+# Modules whose source defines fit results - any change to these invalidates
+# previously cached fits
+MODEL_MODULES = ("functions.py", "fitter.py", "helpers.py",
+                 "formatter.py", "workspace.py")
+
+DEFAULT_SETTINGS = {
+        "BACKEND": "bindfit.cache.LocMemBackend",
+        "OPTIONS": {
+            "max_size": 64*1024*1024, # Bytes
+            },
+        }
+
+_model_version = None
+
+def model_version():
+    """
+    Return version string of the numerical model code, either as set in
+    settings.BINDFIT_MODEL_VERSION or a hash of the model modules' source.
+    """
+    global _model_version
+
+    if _model_version is None:
+        version = getattr(settings, "BINDFIT_MODEL_VERSION", None)
+        if version is None:
+            h = hashlib.sha1()
+            root = os.path.dirname(os.path.abspath(__file__))
+            for name in MODEL_MODULES:
+                with open(os.path.join(root, name), "rb") as f:
+                    h.update(f.read())
+            version = h.hexdigest()
+        _model_version = version
+
+    return _model_version
+
+def key(data_id, fitter, options, params):
+    """
+    Calculate canonical cache key for a set of fit inputs.
+
+    Arguments:
+        data_id: string  Input data ID
+        fitter:  string  Fitter key
+        options: dict    Fit options (dilute, normalise, method, flavour,
+                         bands)
+        params:  dict    Parsed parameter dict, only init and bounds values
+                         are used
+
+    Returns:
+        string  SHA1 hex digest
+    """
+    canonical = {
+        "version": model_version(),
+        "data_id": data_id,
+        "fitter":  fitter,
+        "options": {
+            "dilute":    bool(options.get("dilute",    False)),
+            "normalise": bool(options.get("normalise", True)),
+            "method":    options.get("method",  "") or "",
+            "flavour":   options.get("flavour", "") or "",
+            # Responses with bands (see FitView.build_response) differ
+            "bands":     options.get("bands", False) or False,
+            },
+        "params": { name: {"init":   p["init"],
+                           "bounds": {"min": p["bounds"]["min"],
+                                      "max": p["bounds"]["max"]}}
+                    for name, p in params.items() },
+        }
+
+    return digest(canonical)
+
+def digest(obj):
+    """
+    SHA1 hex digest of the canonical JSON serialisation of a JSON-compatible
+    object.
+    """
+    s = json.dumps(obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+
+
+#
+# Storage backends
+# Backends store and return serialised (bytes) values
+#
+
+class LocMemBackend(object):
+    """
+    In-process LRU store bounded by total size of stored values.
+    """
+
+    def __init__(self, max_size=64*1024*1024):
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self._store = OrderedDict()
+        self._lock  = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._store.pop(key, None)
+            if value is not None:
+                # Move to most recently used end
+                self._store[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            old = self._store.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            if len(value) > self.max_size:
+                return
+
+            self._store[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_size:
+                _, evicted = self._store.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._store)
+
+class FileBackend(object):
+    """
+    Directory of one file per entry, shared between processes. Least recently
+    used entries (by file modification time, updated on read) are removed
+    when the total size exceeds max_size.
+    """
+
+    SUFFIX = ".fit"
+
+    def __init__(self, path, max_size=256*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        self.evictions = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _path(self, key):
+        return os.path.join(self.path, key+self.SUFFIX)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+
+        # Atomic write: readers in other processes see whole entries only
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.rename(tmp, self._path(key))
+
+        self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(e[1] for e in entries)
+
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            size -= entry_size
+
+    @property
+    def size(self):
+        return sum(e[1] for e in self._entries())
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+class DjangoCacheBackend(object):
+    """
+    Store entries in one of Django's configured caches. Size bounds and
+    eviction are handled by the Django cache's own settings
+    (e.g. OPTIONS.MAX_ENTRIES).
+    """
+
+    PREFIX = "bindfit:fit:"
+
+    def __init__(self, alias="default", timeout=None):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.evictions = None
+        self.size = None
+
+    def get(self, key):
+        return self.cache.get(self.PREFIX+key)
+
+    def set(self, key, value):
+        self.cache.set(self.PREFIX+key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+    def __len__(self):
+        return 0
+
+
+
+#
+# Cache front end
+#
+
+class FitCache(object):
+    """
+    Fit response cache with hit/miss accounting (per process).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits    = 0
+        self.misses  = 0
+        self.sets    = 0
+        # Counters are updated from concurrent request threads
+        self._lock   = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, response):
+        value = pickle.dumps(response, pickle.HIGHEST_PROTOCOL)
+        self.backend.set(key, value)
+        with self._lock:
+            self.sets += 1
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses, sets = self.hits, self.misses, self.sets
+
+        lookups = hits + misses
+        return {
+            "backend":   type(self.backend).__name__,
+            "hits":      hits,
+            "misses":    misses,
+            "sets":      sets,
+            "hit_ratio": hits/lookups if lookups else None,
+            "entries":   len(self.backend),
+            "size":      self.backend.size,
+            "evictions": self.backend.evictions,
+            }
+
+_fit_cache = None
+
+def get_cache():
+    """
+    Return process-wide FitCache configured from settings.BINDFIT_FIT_CACHE.
+    """
+    global _fit_cache
+
+    if _fit_cache is None:
+        config = getattr(settings, "BINDFIT_FIT_CACHE", DEFAULT_SETTINGS)
+        backend_cls = import_string(config["BACKEND"])
+        backend = backend_cls(**config.get("OPTIONS", {}))
+        _fit_cache = FitCache(backend)
+
+    return _fit_cache
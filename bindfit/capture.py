@@ -0,0 +1,330 @@
+"""
+" Slow fit capture and replay
+"
+" FitView fits taking longer than a threshold are saved as cases: input
+" arrays, fitter, options and initial params in a compressed .npz file,
+" along with the fit's timings, work counters (see diagnostics.py) and
+" results. A fit still running at the threshold is saved then, so hanging
+" fits are captured too, and updated when it finishes. Cases are replayed
+" against the current code with the replayfits management command.
+" Configured by settings.BINDFIT_CAPTURE.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import time
+import uuid
+import datetime
+import tempfile
+import threading
+import multiprocessing
+from copy import deepcopy
+from contextlib import contextmanager
+
+import numpy as np
+
+from django.conf import settings
+
+from . import functions
+from . import diagnostics
+from . import cache
+from .fitter import Fitter
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "ENABLED":   True,
+        "THRESHOLD": 10,   # Capture fits taking longer than this (s)
+        "PATH":      os.path.join(getattr(settings, "BINDFIT_VAR_DIR", "var"),
+                                  "captures"),
+        "MAX_CASES": 200,  # Oldest cases are removed beyond this number
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_CAPTURE", DEFAULT_SETTINGS)
+
+class Case(object):
+    """
+    A captured fit.
+    """
+
+    def __init__(self, fitter_name, xdata, ydata, options, params):
+        """
+        Arguments:
+            fitter_name: string  Fitter key
+            xdata:       array   Input x data, as passed to Fitter
+            ydata:       array   Input y data, as passed to Fitter
+            options:     dict    FitView request options
+            params:      dict    Initial params, as parsed by FitView
+        """
+        self.id          = "{}-{}-{}".format(
+                datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S"),
+                fitter_name,
+                uuid.uuid4().hex[:8])
+        self.fitter_name = fitter_name
+        self.xdata       = np.asarray(xdata, dtype=float)
+        self.ydata       = np.asarray(ydata, dtype=float)
+        self.options     = deepcopy(options)
+        # Fitter.run_scipy adds results to the params dict passed to it
+        self.params      = deepcopy(params)
+
+        self.status      = "running"
+        self.elapsed     = None
+        self.error       = None
+        self.diagnostics = None
+        self.result      = None
+
+    def finish(self, fitter, diag=None):
+        """
+        Record the results of the fitter run on this case.
+        """
+        self.result = result(fitter)
+        if diag is not None:
+            self.diagnostics = diag.to_dict()
+
+    def meta(self):
+        return {
+                "id":            self.id,
+                "time":          time.time(),
+                "model_version": cache.model_version(),
+                "fitter":        self.fitter_name,
+                "options":       self.options,
+                "params":        self.params,
+                "status":        self.status,
+                "elapsed":       self.elapsed,
+                "error":         self.error,
+                "diagnostics":   self.diagnostics,
+                "result":        self.result,
+                }
+
+    def save(self, path):
+        """
+        Write case to <path>/<id>.npz, replacing any earlier save.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        fd, tmp = tempfile.mkstemp(dir=path, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f,
+                                x=self.xdata,
+                                y=self.ydata,
+                                meta=np.array(json.dumps(self.meta())))
+        os.rename(tmp, os.path.join(path, self.id+".npz"))
+
+def result(fitter):
+    # Comparable summary of a fitter's results
+    return {
+            "params": list(map(float, fitter._params_raw)),
+            "ssr":    float(np.sum(np.square(fitter.residuals))),
+            "time":   fitter.time,
+            }
+
+def load(path):
+    """
+    Return (xdata, ydata, meta dict) of a saved case.
+    """
+    with np.load(path) as f:
+        return f["x"], f["y"], json.loads(str(f["meta"]))
+
+def cleanup(path, max_cases):
+    # Remove oldest cases beyond max_cases
+    try:
+        names = [ n for n in os.listdir(path) if n.endswith(".npz") ]
+    except OSError:
+        return
+
+    names.sort(key=lambda n: os.path.getmtime(os.path.join(path, n)))
+    for n in names[:max(len(names) - max_cases, 0)]:
+        try:
+            os.remove(os.path.join(path, n))
+        except OSError:
+            pass
+
+@contextmanager
+def watch(fitter_name, xdata, ydata, options, params):
+    """
+    Capture the fit run in the block if it takes longer than the configured
+    threshold. Yields the Case (None if capture is disabled), whose finish()
+    should be called with the fitter once it has run.
+    """
+    conf = config()
+    if not conf.get("ENABLED", True):
+        yield None
+        return
+
+    threshold = conf.get("THRESHOLD", DEFAULT_SETTINGS["THRESHOLD"])
+    path      = conf.get("PATH", DEFAULT_SETTINGS["PATH"])
+
+    case = Case(fitter_name, xdata, ydata, options, params)
+
+    def save():
+        try:
+            case.save(path)
+            cleanup(path, conf.get("MAX_CASES", DEFAULT_SETTINGS["MAX_CASES"]))
+        except Exception:
+            logger.exception("capture.watch: saving case failed")
+
+    # Save inputs while still running, in case the fit never finishes
+    timer = threading.Timer(threshold, save)
+    timer.daemon = True
+    timer.start()
+
+    start = time.perf_counter()
+    try:
+        yield case
+        case.status = "ok"
+    except Exception as e:
+        case.status = "error"
+        case.error  = repr(e)
+        raise
+    finally:
+        timer.cancel()
+        # A save in progress must finish before it's replaced
+        timer.join()
+        case.elapsed = time.perf_counter() - start
+        if case.elapsed >= threshold:
+            logger.info("capture.watch: slow {} fit ({:.1f} s) captured as "
+                        "{}".format(fitter_name, case.elapsed, case.id))
+            save()
+
+
+
+#
+# Replay
+#
+
+def replay(path):
+    """
+    Run a captured case against the current code.
+
+    Returns:
+        dict  Captured and replayed elapsed time, results and counters, and
+              their differences
+    """
+    xdata, ydata, meta = load(path)
+    options = meta["options"]
+
+    report = {
+            "id":              meta["id"],
+            "fitter":          meta["fitter"],
+            "captured_status": meta["status"],
+            "captured_time":   meta["elapsed"],
+            "same_version":    meta["model_version"] == cache.model_version(),
+            "status":          None,
+            "error":           None,
+            "time":            None,
+            "speedup":         None,
+            "params_delta":    None,
+            "ssr_delta":       None,
+            "objective":       None,
+            "objective_delta": None,
+            }
+
+    normalise = options.get("normalise", True)
+    function = functions.construct(meta["fitter"],
+                                   normalise=normalise,
+                                   flavour=options.get("flavour", ""))
+    fitter = Fitter(xdata, ydata, function, normalise=normalise)
+
+    start = time.perf_counter()
+    try:
+        with diagnostics.collect() as diag:
+            fitter.run_scipy(deepcopy(meta["params"]),
+                             method=options.get("method", ""))
+    except Exception as e:
+        report["status"] = "error"
+        report["error"]  = repr(e)
+        return report
+    finally:
+        report["time"] = time.perf_counter() - start
+
+    report["status"] = "ok"
+    if report["captured_time"]:
+        report["speedup"] = report["captured_time"]/report["time"]
+
+    report["objective"] = diag.counters.get("objective", 0)
+    if meta["diagnostics"] is not None:
+        report["objective_delta"] = report["objective"] \
+                - meta["diagnostics"]["counters"].get("objective", 0)
+
+    new = result(fitter)
+    old = meta["result"]
+    if old is not None:
+        old_params = np.array(old["params"])
+        # Largest relative parameter change
+        report["params_delta"] = float(np.max(
+                np.abs(np.array(new["params"]) - old_params)
+                / np.maximum(np.abs(old_params), 1e-300)))
+        report["ssr_delta"] = new["ssr"] - old["ssr"]
+
+    return report
+
+def _replay(path):
+    # Pool worker, one case's failure mustn't stop the others
+    try:
+        return replay(path)
+    except Exception as e:
+        logger.exception("capture.replay: case failed")
+        return {"id": os.path.basename(path), "status": "error",
+                "error": repr(e)}
+
+def case_paths(paths=None):
+    """
+    Expand case files and directories of cases (default: the configured
+    capture directory) to a sorted list of case files.
+    """
+    if not paths:
+        paths = [config().get("PATH", DEFAULT_SETTINGS["PATH"])]
+
+    cases = []
+    for p in paths:
+        if os.path.isdir(p):
+            cases.extend(sorted(os.path.join(p, n) for n in os.listdir(p)
+                                if n.endswith(".npz")))
+        else:
+            cases.append(p)
+    return cases
+
+def replay_all(paths, processes=1):
+    """
+    Replay cases, on a pool of processes if processes > 1.
+
+    Returns:
+        list  replay() report for each case, in order
+    """
+    if processes > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(_replay, paths, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [ _replay(p) for p in paths ]
+
+def format_results(reports):
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    lines = ["{:<40} {:>9} {:>10} {:>8} {:>12} {:>12} {:>10}".format(
+                "case", "captured", "replay (s)", "speedup", "params d",
+                "ssr d", "objective")]
+    for r in reports:
+        if r["status"] != "ok":
+            lines.append("{:<40} {}".format(r["id"], r["error"]))
+            continue
+        lines.append("{:<40} {:>9} {:>10.3f} {:>8} {:>12} {:>12} {:>10}".format(
+            r["id"],
+            fmt(r["captured_time"], ".3f"),
+            r["time"],
+            fmt(r["speedup"], ".2f"),
+            fmt(r["params_delta"], ".2e"),
+            fmt(r["ssr_delta"], ".2e"),
+            fmt(r["objective_delta"], "+d")))
+    lines.append("params d: largest relative parameter change, objective: "
+                 "change in objective evaluations")
+    return "\n".join(lines)
@@ -0,0 +1,137 @@
+"""
+" Checkpoints for long-running Monte Carlo calculations
+"
+" Fitter.calc_monte_carlo periodically saves its completed parameter rows
+" and random number generator state to a compressed .npz file, and resumes
+" from it if present. A resumed calculation gives results identical to an
+" uninterrupted one. Checkpoints are removed on completion. Configured by
+" settings.BINDFIT_CHECKPOINTS.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import tempfile
+
+import numpy as np
+
+from django.conf import settings
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "PATH":     os.path.join(getattr(settings, "BINDFIT_VAR_DIR", "var"),
+                                 "checkpoints"),
+        "INTERVAL": 30,        # Seconds between checkpoints
+        "MAX_AGE":  7*24*3600, # Abandoned checkpoints are removed after this
+                               # many seconds
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_CHECKPOINTS", DEFAULT_SETTINGS)
+
+class MonteCarloCheckpoint(object):
+    def __init__(self, path, interval=30):
+        """
+        Arguments:
+            path:     string  Checkpoint file path
+            interval: float   Minimum seconds between saves, see due
+        """
+        self.path     = path
+        self.interval = interval
+        self._last    = time.time()
+
+    @classmethod
+    def for_name(cls, name):
+        """
+        Checkpoint of the given name (e.g. "mc-<job id>") in the configured
+        directory.
+        """
+        conf = config()
+        path = conf.get("PATH", DEFAULT_SETTINGS["PATH"])
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        cleanup(path, conf.get("MAX_AGE", DEFAULT_SETTINGS["MAX_AGE"]))
+        return cls(os.path.join(path, name+".npz"),
+                   interval=conf.get("INTERVAL", DEFAULT_SETTINGS["INTERVAL"]))
+
+    def due(self, force=False):
+        now = time.time()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
+
+    def save(self, n_iter, params_done, rng):
+        """
+        Arguments:
+            n_iter:      int          Total iterations of the calculation
+            params_done: ndarray      n_done x p completed parameter rows
+            rng:         RandomState  Generator state after n_done iterations
+        """
+        name, keys, pos, has_gauss, cached_gaussian = rng.get_state()
+
+        # Write to a temporary file first, an interrupted save must leave
+        # the previous checkpoint intact
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                   suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f,
+                                n_iter=n_iter,
+                                params=params_done,
+                                rng_name=np.array(name),
+                                rng_keys=keys,
+                                rng_pos=pos,
+                                rng_has_gauss=has_gauss,
+                                rng_cached_gaussian=cached_gaussian)
+        os.rename(tmp, self.path)
+
+        logger.debug("MonteCarloCheckpoint.save: saved iterations")
+        logger.debug(params_done.shape[0])
+
+    def load(self, n_iter):
+        """
+        Return (params_done, rng_state) of a saved calculation of n_iter
+        iterations, or None if there is none.
+        """
+        try:
+            with np.load(self.path) as f:
+                if int(f["n_iter"]) != n_iter:
+                    return None
+
+                rng_state = (str(f["rng_name"]),
+                             f["rng_keys"],
+                             int(f["rng_pos"]),
+                             int(f["rng_has_gauss"]),
+                             float(f["rng_cached_gaussian"]))
+                return f["params"], rng_state
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logger.exception("MonteCarloCheckpoint.load: unreadable "
+                             "checkpoint, ignoring")
+            return None
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def cleanup(path, max_age):
+    # Remove checkpoints (and temporary files of interrupted saves) not
+    # written to for max_age seconds
+    now = time.time()
+    for name in os.listdir(path):
+        if not name.endswith(".npz"):
+            continue
+        p = os.path.join(path, name)
+        try:
+            if now - os.stat(p).st_mtime > max_age:
+                os.remove(p)
+        except OSError:
+            pass
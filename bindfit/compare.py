@@ -0,0 +1,161 @@
+"""
+" Model comparison
+"
+" Fits one dataset to every host-guest binding model and flavour of a data
+" family (NMR or UV) on the batch worker pool and ranks the fits by
+" information criteria.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+from copy import deepcopy
+
+import numpy as np
+
+from . import batch
+from . import formatter
+from . import helpers
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+# Candidate models for each data family. The first is the simplest model,
+# nested in all others, and used as the F-test reference.
+FAMILIES = {
+        "nmr": ["nmr1to1", "nmr1to2", "nmr2to1"],
+        "uv":  ["uv1to1",  "uv1to2",  "uv2to1"],
+        }
+
+def specs(data_id, family, options=None):
+    """
+    Build FitView request bodies for each candidate model and flavour, using
+    the default initial parameters from formatter.options.
+
+    Arguments:
+        data_id: string  Input data ID
+        family:  string  Data family, key of FAMILIES
+        options: dict    Fit options (dilute, normalise, method) overriding
+                         the fitters' defaults
+
+    Returns:
+        list  FitView request bodies
+    """
+    options = options or {}
+    specs = []
+
+    for fitter in FAMILIES[family]:
+        defaults = formatter.options(fitter)
+
+        flavours = defaults["options"]["flavour"] or [{"key": ""}]
+        for flavour in flavours:
+            params = deepcopy(defaults["params"])
+            for name in flavour.get("exclude_params", []):
+                del params[name]
+
+            specs.append({
+                "fitter":  fitter,
+                "data_id": data_id,
+                "params":  params,
+                "options": {
+                    "dilute":    options.get("dilute",
+                                             defaults["options"]["dilute"]),
+                    "normalise": options.get("normalise",
+                                             defaults["options"]["normalise"]),
+                    "method":    options.get("method", ""),
+                    "flavour":   flavour["key"],
+                    },
+                })
+
+    return specs
+
+def _delta(score, best):
+    # AICc difference to the best fit, None if either is missing or infinite
+    if score is None or best is None or not np.isfinite(score["aicc"]):
+        return None
+    return score["aicc"] - best
+
+def _serialisable(score):
+    # Score with undefined (infinite) criteria as None
+    if score is None:
+        return None
+    return { k: v if v is None or np.isfinite(v) else None
+             for k, v in score.items() }
+
+def rank(specs, items):
+    """
+    Rank fits by AICc.
+
+    Arguments:
+        specs: list  FitView request bodies
+        items: list  formatter.batch_item dict for each spec, in order
+
+    Returns:
+        list  formatter.compare_row dict for each spec, fits with an AICc
+              first in order of increasing AICc. Failed fits and fits with
+              too few points for an AICc are unranked, with aicc None.
+    """
+    scores = []
+    for spec, item in zip(specs, items):
+        if item["status"] != "ok":
+            scores.append(None)
+            continue
+
+        result = item["result"]
+        ssr = float(result["qof"]["ssr"])
+        n   = int(result["fit"]["n_y"])
+        k   = int(result["fit"]["n_params"])
+
+        score = {"ssr": ssr, "n": n, "k": k}
+        score.update(helpers.information_criteria(ssr, n, k))
+        scores.append(score)
+
+    # Akaike weights, None for all fits if no AICc is finite (too few data
+    # points for every model)
+    aiccs = [ s["aicc"] for s in scores
+              if s is not None and np.isfinite(s["aicc"]) ]
+    best = min(aiccs) if aiccs else None
+    deltas = [ _delta(s, best) for s in scores ]
+    rel = [ np.exp(-d/2) if d is not None else 0 for d in deltas ]
+    total = sum(rel)
+
+    # F-test reference: simplest model if it fitted
+    reference = scores[0]
+
+    rows = []
+    for spec, item, score, d, r in zip(specs, items, scores, deltas, rel):
+        f, p = None, None
+        if (score is not None 
+                and reference is not None 
+                and score is not reference):
+            f, p = helpers.f_test(reference["ssr"], reference["k"],
+                                  score["ssr"],     score["k"],
+                                  score["n"])
+
+        rows.append(formatter.compare_row(
+            spec,
+            item["error"],
+            _serialisable(score),
+            delta_aicc=d,
+            weight    =r/total if score is not None and best is not None
+                                else None,
+            f_test    ={"reference": specs[0]["fitter"], "f": f, "p": p},
+            result    =item["result"]))
+
+    rows.sort(key=lambda row: (row["aicc"] is None, row["aicc"]))
+    for i, row in enumerate(rows):
+        row["rank"] = i + 1 if row["aicc"] is not None else None
+
+    return rows
+
+def run(data_id, family, options=None):
+    """
+    Fit all candidate models for a dataset concurrently and rank them.
+
+    Returns:
+        list  Ranked formatter.compare_row dicts
+    """
+    s = specs(data_id, family, options)
+    # The request waits for these fits
+    items = list(batch.run(s, priority="interactive"))
+    return rank(s, items)
@@ -0,0 +1,188 @@
+"""
+" Process-local cache of parsed input data
+"
+" Data rows are content-addressed (Data.id is the SHA1 of the uploaded
+" array), so the arrays parsed from them by Data.to_dict can be kept between
+" requests. Entries are keyed by (data ID, fitter, dilute, block), hold
+" read-only numpy arrays and are evicted least recently used first when
+" their total size exceeds MAX_SIZE. Labels aren't part of the hash and can
+" change on re-upload, so entries also expire after TIMEOUT seconds (saves
+" in this process invalidate them immediately). Configured by
+" settings.BINDFIT_DATA_CACHE.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import models
+from . import formatter
+from . import metrics
+from . import tracing
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "MAX_SIZE": 32*1024*1024, # Bytes of cached arrays
+        "TIMEOUT":  300,          # Seconds, None to keep until evicted
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_DATA_CACHE", DEFAULT_SETTINGS)
+
+class Entry(object):
+    """
+    Parsed arrays and labels of one (data, fitter, dilute, block).
+    """
+
+    def __init__(self, data_id, x, x_plot, y, labels_x, labels_y):
+        self.data_id  = data_id
+        self.x        = x
+        self.x_plot   = x_plot
+        self.y        = y
+        self.labels_x = labels_x
+        self.labels_y = labels_y
+        self.time     = time.time()
+
+        # Shared between requests, must not be modified in place
+        for a in (x, x_plot, y):
+            a.setflags(write=False)
+
+        self.size = x.nbytes + x_plot.nbytes + y.nbytes
+
+    def to_dict(self):
+        # New structure for each caller, the arrays themselves are shared
+        return formatter.data(self.data_id, self.x, self.x_plot, self.y,
+                              list(self.labels_x), list(self.labels_y))
+
+class DataCache(object):
+    """
+    LRU cache of Entries bounded by total array size, with hit/miss
+    accounting (per process).
+    """
+
+    def __init__(self, max_size=DEFAULT_SETTINGS["MAX_SIZE"],
+                 timeout=DEFAULT_SETTINGS["TIMEOUT"]):
+        self.max_size  = max_size
+        self.timeout   = timeout
+        self.size      = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._store = OrderedDict()
+        self._lock  = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._store.pop(key, None)
+            if entry is None:
+                return None
+
+            if self.timeout is not None and \
+                    time.time() - entry.time > self.timeout:
+                self.size -= entry.size
+                return None
+
+            # Move to most recently used end
+            self._store[key] = entry
+            return entry
+
+    def _insert(self, key, entry):
+        with self._lock:
+            old = self._store.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+
+            if entry.size > self.max_size:
+                return
+
+            self._store[key] = entry
+            self.size += entry.size
+
+            while self.size > self.max_size:
+                _, evicted = self._store.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def get(self, data_id, fitter, dilute=False, block=0):
+        """
+        Return input data as formatted by Data.to_dict, loading and parsing
+        it on a miss. The returned arrays are read-only. Traced as a
+        "data-cache-hit" span, or "data-fetch" and "data-to-dict" spans on
+        a miss.
+
+        Raises:
+            Data.DoesNotExist  If there is no input data with this ID
+        """
+        key = (data_id, fitter, bool(dilute), block)
+
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            metrics.inc("bindfit_data_cache_requests_total", result="hit")
+            with tracing.span("data-cache-hit"):
+                return entry.to_dict()
+
+        self.misses += 1
+        metrics.inc("bindfit_data_cache_requests_total", result="miss")
+
+        with tracing.span("data-fetch"):
+            data = models.Data.objects.get(id=data_id)
+        with tracing.span("data-to-dict"):
+            x, x_plot, y = data.arrays(fitter, dilute=dilute, block=block)
+            entry = Entry(data.id, x, x_plot, y,
+                          data.labels_x, data.labels_y)
+            self._insert(key, entry)
+            return entry.to_dict()
+
+    def invalidate(self, data_id):
+        """
+        Remove all entries of a data ID.
+        """
+        with self._lock:
+            for key in [ k for k in self._store if k[0] == data_id ]:
+                self.size -= self._store.pop(key).size
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "hit_ratio": self.hits/lookups if lookups else None,
+            "entries":   len(self._store),
+            "size":      self.size,
+            "evictions": self.evictions,
+            }
+
+_data_cache = None
+
+def get_cache():
+    """
+    Return process-wide DataCache configured from settings.BINDFIT_DATA_CACHE.
+    """
+    global _data_cache
+
+    if _data_cache is None:
+        conf = config()
+        _data_cache = DataCache(
+                max_size=conf.get("MAX_SIZE", DEFAULT_SETTINGS["MAX_SIZE"]),
+                timeout =conf.get("TIMEOUT",  DEFAULT_SETTINGS["TIMEOUT"]))
+
+    return _data_cache
+
+def get(data_id, fitter, dilute=False, block=0):
+    """
+    Shortcut for get_cache().get(), see DataCache.get.
+    """
+    return get_cache().get(data_id, fitter, dilute=dilute, block=block)
@@ -0,0 +1,118 @@
+"""
+" Per-fit numerical work counters and phase timings
+"
+" A Diagnostics collector is made current for the calling thread with
+" collect(). Code in the fitting hot loop reports to it with count(), which
+" is a no-op when no collector is active. Returned in fit responses under
+" "diagnostics" (see formatter.diagnostics) and optionally logged, see
+" settings.BINDFIT_DIAGNOSTICS.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "LOG": False, # Log each fit's diagnostics at INFO level
+        }
+
+_local = threading.local()
+
+class Diagnostics(object):
+    def __init__(self):
+        self.counters  = {}
+        self.maxima    = {}
+        self.timings   = OrderedDict() # Phase: seconds, in order first run
+        self.optimiser = None
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def maximum(self, name, value):
+        if value > self.maxima.get(name, value - 1):
+            self.maxima[name] = value
+
+    @contextmanager
+    def phase(self, name):
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) \
+                                 + time.perf_counter() - tic
+
+    def set_optimiser(self, result):
+        # Termination of the last optimiser run, from its OptimizeResult
+        self.optimiser = {
+                "iterations": int(getattr(result, "nit",  0)),
+                "evaluations":int(getattr(result, "nfev", 0)),
+                "success":    bool(result.success),
+                "status":     int(result.status),
+                "message":    str(result.message),
+                }
+
+    def to_dict(self):
+        return {
+                "counters":  dict(self.counters),
+                "maxima":    dict(self.maxima),
+                "timings":   dict(self.timings),
+                "optimiser": self.optimiser,
+                }
+
+def current():
+    """
+    Return the calling thread's active Diagnostics, or None.
+    """
+    return getattr(_local, "diagnostics", None)
+
+@contextmanager
+def collect():
+    """
+    Make a new Diagnostics current for the calling thread for the duration of
+    the block, restoring any outer one afterwards.
+    """
+    outer = current()
+    d = Diagnostics()
+    _local.diagnostics = d
+    try:
+        yield d
+    finally:
+        _local.diagnostics = outer
+
+def count(name, n=1):
+    d = getattr(_local, "diagnostics", None)
+    if d is not None:
+        d.count(name, n)
+
+def maximum(name, value):
+    d = getattr(_local, "diagnostics", None)
+    if d is not None:
+        d.maximum(name, value)
+
+@contextmanager
+def phase(name):
+    d = getattr(_local, "diagnostics", None)
+    if d is None:
+        yield
+    else:
+        with d.phase(name):
+            yield
+
+def log(fitter_name, d):
+    """
+    Log a fit's diagnostics if enabled in settings.BINDFIT_DIAGNOSTICS.
+    """
+    config = getattr(settings, "BINDFIT_DIAGNOSTICS", DEFAULT_SETTINGS)
+    if config.get("LOG", False):
+        logger.info("fit diagnostics {}: {}".format(
+            fitter_name, json.dumps(d.to_dict(), sort_keys=True)))
@@ -3,8 +3,8 @@ from __future__ import print_function
 
 from math import sqrt
 from copy import deepcopy
+from functools import partial
 import time
-from itertools import product
 
 import numpy as np
 import numpy.matlib as ml
@@ -15,6 +15,11 @@ from scipy import stats
 
 from . import functions
 from . import helpers 
+from . import diagnostics
+from . import tracing
+from . import numtrace
+from . import metrics
+from .workspace import Workspace
 
 import logging
 logger = logging.getLogger('supramolecular')
@@ -28,6 +33,12 @@ class Fitter():
         # Fitter options
         self.normalise   = normalise
 
+        # Preprocessed input data and objective buffers, reused for every
+        # objective evaluation
+        self.workspace    = Workspace(xdata, ydata, normalise=normalise)
+        # Workspace for shifted Monte Carlo data, created on first use
+        self._workspace_mc = None
+
         # Populated on Fitter.run
         self._params_raw = None
         self.params      = params # Initialise with optimised param results
@@ -58,7 +69,34 @@ class Fitter():
 
         return f 
 
-    def run_scipy(self, params_init, save=True, xdata=None, ydata=None, method='Nelder-Mead'):
+    def _workspace(self, xdata=None, ydata=None):
+        # Return workspace loaded with the given (modified) input data, or the
+        # fitter's own workspace if none given
+        if xdata is None and ydata is None:
+            return self.workspace
+
+        x = self.xdata if xdata is None else xdata
+        y = self.ydata if ydata is None else ydata
+
+        if self._workspace_mc is None:
+            self._workspace_mc = Workspace(x, y, normalise=self.normalise)
+        else:
+            self._workspace_mc.load(x, y)
+
+        return self._workspace_mc
+
+    @staticmethod
+    def sort_params(params_init):
+        # Ordered (alphabetical) lists of initial parameter values and bounds
+        p = []
+        b = []
+        for key, value in sorted(params_init.items()):
+            p.append(value["init"])
+            b.append([value["bounds"]["min"],
+                      value["bounds"]["max"]])
+        return p, b
+
+    def run_scipy(self, params_init, save=True, xdata=None, ydata=None, method='Nelder-Mead', callback=None):
         """
         Arguments:
             params_init: dict  Initial parameter guesses for fitter    
@@ -68,36 +106,52 @@ class Fitter():
             ydata:       array Modified input array 
                                (used with save=False for Monte Carlo error 
                                calculation)
+            callback:    Optional callable, called after each optimiser 
+                         iteration as callback(n_iter, params) where params
+                         is the current raw parameter array. Exceptions
+                         raised by callback abort the fit.
         """
         logger.debug("Fitter.fit: called. Input params:")
         logger.debug(params_init)
 
         # Set input data
-        x = self.xdata if xdata is None else xdata
-        y = self._preprocess(self.ydata if ydata is None else ydata)
+        ws = self._workspace(xdata, ydata)
+        x  = ws.x
+        y  = ws.y
         
         # Sort parameter dict into ordered array of parameters and bounds
-        p = []
-        b = []
-        for key, value in sorted(params_init.items()):
-            p.append(value["init"])
-            b.append([value["bounds"]["min"],
-                      value["bounds"]["max"]])
+        p, b = self.sort_params(params_init)
 
         logger.debug("Fitter.fit: params and bounds read:")
         logger.debug(p)
         logger.debug(b)
 
+        # Optimiser progress reporting
+        if callback is not None:
+            n_iter = [0]
+            def iteration(xk):
+                n_iter[0] += 1
+                callback(n_iter[0], xk)
+        else:
+            iteration = None
+
         # Run optimizer 
-        tic = time.clock()
-        result = scipy.optimize.minimize(self.function.objective,
-                                         p,
-                                         bounds=b,
-                                         args=(x, y, True),
-                                         method=method if method else "Nelder-Mead",
-                                         tol=1e-18,
-                                        )
-        toc = time.clock()
+        tic = time.perf_counter()
+        with diagnostics.phase("optimise"), tracing.span("minimize"):
+            result = scipy.optimize.minimize(partial(self.function.objective,
+                                                     workspace=ws),
+                                             p,
+                                             bounds=b,
+                                             args=(x, y, True),
+                                             method=method if method else "Nelder-Mead",
+                                             tol=1e-18,
+                                             callback=iteration,
+                                            )
+        toc = time.perf_counter()
+
+        d = diagnostics.current()
+        if d is not None:
+            d.set_optimiser(result)
 
         logger.debug("Fitter.run: FIT FINISHED")
         logger.debug("Fitter.run: Fitter.function")
@@ -109,12 +163,12 @@ class Fitter():
         # Force molefraction (not free concentration) calculation for proper 
         # fitting in UV models
         logger.debug("Fitter.run: Calculating optimised fit")
-        logger.debug("Fitter.run: self.ydata vs. ydata")
-        logger.debug(self.ydata)
-        logger.debug(ydata)
         ydata_init = self.ydata[:,0] if ydata is None else ydata[:,0]
-        logger.debug("Fitter.run: ydata_init")
-        logger.debug(ydata_init)
+        if numtrace.enabled:
+            logger.debug("Fitter.run: self.ydata vs. ydata, ydata_init")
+            logger.debug(self.ydata)
+            logger.debug(ydata)
+            logger.debug(ydata_init)
         fit_norm, residuals, coeffs_raw, molefrac_raw, coeffs, molefrac = self.function.objective(result.x, x, y, scalar=False, ydata_init=ydata_init)
 
         # Postprocessing
@@ -143,7 +197,8 @@ class Fitter():
 
         # Calculate fit uncertainty statistics
         logger.debug("Fitter.run: Calculating uncertainty statistics")
-        err = self.statistics(result.x, fit, coeffs_raw, residuals)
+        with diagnostics.phase("statistics"), tracing.span("statistics"):
+            err = self.statistics(result.x, fit, coeffs_raw, residuals)
         logger.debug("Fitter.run: Done calculating uncertainty statistics")
 
         # Parse final optimised parameters and errors into parameters dict
@@ -171,6 +226,109 @@ class Fitter():
             # Standard deviation of calculated y
             # Standard deviation of calculated coefficients
         """
+        diffs = self.jacobian(params, fit, coeffs)
+
+        # Sum of squares of residuals
+        ssr = np.sum(np.square(residuals))
+        # Degrees of freedom:
+        # N datapoints - N fitted params - N calculated coefficients
+        d_free = self.ydata.size - len(params) - coeffs.size
+
+        return asymptotic_error(params, diffs, ssr, d_free)
+
+    def predict(self, params, coeffs, xdata):
+        """
+        Calculate fitted (postprocessed) data at arbitrary x data for given
+        parameters, with coefficients held fixed
+
+        Arguments:
+            params: array  Raw parameters
+            coeffs: array  Raw coefficients
+            xdata:  array  x x n array of x data to evaluate at
+
+        Returns:
+            array  y x n fitted data
+        """
+        ydata_init = self.workspace.y_init
+        # y data is only used for residuals here, which are discarded
+        fit_norm, _, _, _, _, _ = self.function.objective(
+                params,
+                xdata,
+                np.zeros((ydata_init.size, xdata.shape[1])),
+                scalar=False,
+                ydata_init=ydata_init,
+                fit_coeffs=coeffs)
+
+        if self.normalise:
+            # As _postprocess, for any number of points
+            return fit_norm + self.ydata[:,0][:,np.newaxis]
+        return fit_norm
+
+    def bands(self, points=None, level=0.95):
+        """
+        Pointwise confidence and prediction bands of the fitted data by the
+        delta method, from the asymptotic parameter covariance and the
+        Jacobian (see statistics). Coefficients are treated as fixed, as for
+        the parameter errors.
+
+        Arguments:
+            points: int    Evaluate on a dense grid of this many points 
+                           interpolated along the titration (see 
+                           helpers.interpolate_x), otherwise at the input 
+                           data points
+            level:  float  Confidence level
+
+        Returns:
+            dict  x:  x x n x data evaluated at
+                  y:  y x n fitted data
+                  ci: y x n confidence band half-widths
+                  pi: y x n prediction band half-widths
+        """
+        params = self._params_raw
+        coeffs = self.coeffs_raw
+
+        # Covariance from the Jacobian at the fitted data points
+        diffs = self.jacobian(params, self.fit, coeffs)
+        ssr = np.sum(np.square(self.residuals))
+        d_free = self.ydata.size - len(params) - coeffs.size
+        cov, s2 = covariance(diffs, ssr, d_free)
+
+        if points is None:
+            x = self.xdata
+            y = self.fit
+        else:
+            x = helpers.interpolate_x(self.xdata, points)
+            y = self.predict(params, coeffs, x)
+            diffs = self.jacobian(params, y, coeffs, xdata=x)
+
+        # Variance of each fitted point, J^T C J for every column of J
+        var = np.einsum("pn,pq,qn->n", diffs, cov, diffs).reshape(y.shape)
+
+        t = stats.t.ppf(1 - (1 - level)/2, d_free)
+
+        return {
+                "x":  x,
+                "y":  y,
+                "ci": t*np.sqrt(var),
+                "pi": t*np.sqrt(var + s2),
+                }
+
+    def jacobian(self, params, fit, coeffs, xdata=None):
+        """
+        Calculate partial differentials of the fitted data with respect to
+        each parameter, with coefficients held fixed
+
+        Arguments:
+            params: array  Optimised raw parameters
+            fit:    array  Fitted (postprocessed) data at params
+            coeffs: array  Raw coefficients at params
+            xdata:  array  Optional x data fit was calculated at (see 
+                           predict), defaults to the input x data
+
+        Returns:
+            array  P x N array of differentials for each of N flattened data
+                   points
+        """
         # Calculate deLevie uncertainty
         d = np.float64(1e-6) # delta
          
@@ -182,10 +340,15 @@ class Fitter():
             params_shift = np.copy(params)
             params_shift[i] = pi_shift
 
+            if xdata is not None:
+                fit_shift = self.predict(params_shift, coeffs, xdata)
+                diffs.append((fit_shift - fit).flatten()/(pi_shift - pi))
+                continue
+
             # Calculate fit with modified parameter set
-            x   = self.xdata
-            y   = self._preprocess(self.ydata)
-            ydata_init = self.ydata[:,0]
+            x   = self.workspace.x
+            y   = self.workspace.y
+            ydata_init = self.workspace.y_init
             fit_shift_norm, _, _, _, _, _ = self.function.objective(
                     params_shift, 
                     x, 
@@ -201,37 +364,10 @@ class Fitter():
             denom = pi_shift - pi
             diffs.append(np.divide(num, denom))
 
-        diffs = np.array(diffs)
+        return np.array(diffs)
 
-        # 1. Calculate PxP matrix M and invert
-        P = len(params)
-        M = np.zeros((P, P))
-        for i, j in product(range(P), range(P)):
-            M[i, j] = np.sum(diffs[i]*diffs[j])
-
-        M_inv = np.linalg.inv(M)
-        m_diag = np.diagonal(M_inv)
-
-        # 2. Calculate standard deviations sigma of P parameters pi
-        # Sum of squares of residuals
-        ssr = np.sum(np.square(residuals))
-        # Degrees of freedom:
-        # N datapoints - N fitted params - N calculated coefficients
-        d_free = self.ydata.size - len(params) - coeffs.size
-
-        sigma = np.sqrt((m_diag*ssr)/(d_free - 1))
-
-        # 3. Calculate confidence intervals
-        # Calculate t-value at 95%
-        # Studnt, n=d_free, p<0.05, 2-tail
-        t = stats.t.ppf(1 - 0.025, d_free)
-
-        ci = np.array([params - t*sigma, params + t*sigma])
-        ci_percent = (t*sigma)/params * 100
-
-        return ci_percent
-
-    def calc_monte_carlo(self, n_iter, xdata_error, ydata_error, method=None):
+    def calc_monte_carlo(self, n_iter, xdata_error, ydata_error, method=None,
+                         callback=None, seed=None, checkpoint=None):
         """
         Calculate error on fit using a Monte Carlo method
 
@@ -241,6 +377,14 @@ class Fitter():
                          rows of xdata
             ydata_error: Float corresponding to n percentage error on each
                          row of ydata
+            callback:    Optional callable, called after each iteration as
+                         callback(n_done, n_iter, params_done) where 
+                         params_done is the n_done x p array of completed 
+                         parameter results
+            seed:        Optional random seed
+            checkpoint:  Optional MonteCarloCheckpoint (see checkpoint.py)
+                         to periodically save progress to and resume from.
+                         Removed on completion.
 
         Returns:
             something
@@ -261,16 +405,30 @@ class Fitter():
         params_init = {}
         for key, param in self.params.items():
             params_init[key] = param
-            params_init[key]["init"] = param["value"]
+            params_init[key]["init"] = raw_value(param)
 
         params_arr = np.zeros((n_iter, len(params_init)))
 
-        for n in range(n_iter):
+        rng = np.random.RandomState(seed)
+        start = 0
+
+        if checkpoint is not None:
+            saved = checkpoint.load(n_iter)
+            if saved is not None:
+                params_done, rng_state = saved
+                start = params_done.shape[0]
+                params_arr[:start] = params_done
+                rng.set_state(rng_state)
+
+                logger.debug("Fitter.monte_carlo: resuming from iteration")
+                logger.debug(start)
+
+        for n in range(start, n_iter):
             # Calculate error multiplier arrays matching ydata, xdata shapes
-            xdata_error_arr = np.random.standard_normal(xdata.shape)\
+            xdata_error_arr = rng.standard_normal(xdata.shape)\
                               *ml.repmat(xdata_error, xdata.shape[1], 1).T\
                               + 1
-            ydata_error_arr = np.random.standard_normal(ydata.shape)\
+            ydata_error_arr = rng.standard_normal(ydata.shape)\
                               *ydata_error\
                               + 1
 
@@ -278,8 +436,15 @@ class Fitter():
             xdata_shift = xdata*xdata_error_arr
             ydata_shift = ydata*ydata_error_arr
 
-            logger.debug("Fitter.monte_carlo: params_init")
-            logger.debug(params_init)
+            if numtrace.enabled:
+                logger.debug("Fitter.monte_carlo: params_init")
+                logger.debug(params_init)
+
+            # Each iteration starts without the previous one's free 
+            # concentrations, so results only depend on the iteration's data
+            # (and a resumed run matches an uninterrupted one)
+            if self._workspace_mc is not None:
+                self._workspace_mc.roots[:] = np.nan
 
             results = self.run_scipy(params_init=params_init,
                                      save       =False, 
@@ -287,21 +452,33 @@ class Fitter():
                                      ydata      =ydata_shift,
                                      method     =method)
 
-            logger.debug("Fitter.monte_carlo: results")
-            logger.debug(results)
+            if numtrace.enabled:
+                logger.debug("Fitter.monte_carlo: results")
+                logger.debug(results)
 
             # Log resulting params
             params_arr[n] = results["_params_raw"]
+            metrics.inc("bindfit_mc_iterations_total")
+
+            if checkpoint is not None and n + 1 < n_iter and checkpoint.due():
+                checkpoint.save(n_iter, params_arr[:n + 1], rng)
+
+            if callback is not None:
+                callback(n + 1, n_iter, params_arr[:n + 1])
+
+        if checkpoint is not None:
+            checkpoint.delete()
 
         percentile_params = np.percentile(params_arr, [2.5, 97.5], axis=0).T
 
-        logger.debug("Fitter.monte_carlo: params_arr, percentile_params")
-        logger.debug(params_arr)
-        logger.debug(percentile_params)
+        if numtrace.enabled:
+            logger.debug("Fitter.monte_carlo: params_arr, percentile_params")
+            logger.debug(params_arr)
+            logger.debug(percentile_params)
 
         # Calculate errors and update input params dict with results
         for i, (key, param) in enumerate(sorted(self.params.items())):
-            p = param["value"]            # Actual param result
+            p = raw_value(param)          # Actual param result
             per = percentile_params[i] # Calc'd percentile for this param
 
             lower = (100*(per[0] - p))/p
@@ -313,3 +490,60 @@ class Fitter():
         logger.debug(self.params)
 
         return self.params
+
+def raw_value(param):
+    """
+    Optimised value of a result params dict entry. Aggregation fitters
+    report Ke as [Ke, Kd].
+    """
+    value = param["value"]
+    return value[0] if isinstance(value, (list, tuple)) else value
+
+def covariance(diffs, ssr, d_free):
+    """
+    Asymptotic covariance of parameters
+
+    Arguments:
+        diffs:  array  P x N partial differentials, see Fitter.jacobian
+        ssr:    float  Sum of squares of residuals
+        d_free: int    Degrees of freedom
+
+    Returns:
+        (array, float)  P x P covariance matrix and residual variance
+    """
+    # 1. Calculate PxP matrix M and invert
+    M = diffs.dot(diffs.T)
+    M_inv = np.linalg.inv(M)
+
+    s2 = ssr/(d_free - 1)
+    return M_inv*s2, s2
+
+def asymptotic_error(params, diffs, ssr, d_free):
+    """
+    Calculate asymptotic 95% confidence intervals of parameters
+
+    Arguments:
+        params: array  Optimised raw parameters
+        diffs:  array  P x N partial differentials, see Fitter.jacobian
+        ssr:    float  Sum of squares of residuals
+        d_free: int    Degrees of freedom
+
+    Returns:
+        array  Confidence interval half-widths as percentage of each 
+               parameter
+    """
+    # 1. Calculate parameter covariance
+    cov, _ = covariance(diffs, ssr, d_free)
+
+    # 2. Calculate standard deviations sigma of P parameters pi
+    sigma = np.sqrt(np.diagonal(cov))
+
+    # 3. Calculate confidence intervals
+    # Calculate t-value at 95%
+    # Studnt, n=d_free, p<0.05, 2-tail
+    t = stats.t.ppf(1 - 0.025, d_free)
+
+    ci = np.array([params - t*sigma, params + t*sigma])
+    ci_percent = (t*sigma)/params * 100
+
+    return ci_percent
@@ -12,6 +12,7 @@ import numpy as np
 from copy import deepcopy
 
 from . import helpers
+from . import tracing
 from . import functions # For Function-specific formatting 
 
 import logging
@@ -799,7 +800,7 @@ def fit(fitter, data,
         molefrac=None, coeffs=None, 
         time=None, 
         dilute=None, normalise=None, method=None, flavour=None,
-        no_fit=False, meta_dict=None):
+        no_fit=False, meta_dict=None, cached=False, bands=None):
     """
     Return dictionary containing fit result information 
     (defines format used as JSON response in views)
@@ -814,6 +815,9 @@ def fit(fitter, data,
         coeffs:    ndarray  Fitted species coefficients
         time:      ndarray  Time taken to fit
         dilute:    bool     (option) Dilution factor flag
+        cached:    bool     Response served from fit result cache
+        bands:     dict     Optional confidence/prediction bands, see 
+                            formatter.bands
 
     Returns:
         fit:
@@ -834,6 +838,7 @@ def fit(fitter, data,
             rms:
             rms_total:
         time:
+        cached:
     """
 
     fn = fitter_name(fitter)
@@ -853,6 +858,7 @@ def fit(fitter, data,
                     "params":      params,
                     "n_y":         np.array(y).size,
                     "n_params":    len(params) + np.array(coeffs_raw).size,
+                    "bands":       bands,
                     },
                 "qof": {
                     "residuals": residuals,
@@ -869,6 +875,7 @@ def fit(fitter, data,
                     "method":    method,
                     "flavour":   flavour,
                     },
+                "cached": cached,
                 }
     else:
         fit = {
@@ -878,7 +885,8 @@ def fit(fitter, data,
                 }   
 
     # Merge with data dictionary
-    response = deepcopy(data)
+    with tracing.span("deepcopy"):
+        response = deepcopy(data)
     response.update(fit)
 
     if meta_dict is not None:
@@ -898,6 +906,38 @@ def fit(fitter, data,
 
     return response
 
+def diagnostics(d):
+    """
+    Numerical work counters and phase timings of a fit (see 
+    diagnostics.Diagnostics)
+
+    Returns:
+        counters:  dict  objective, lstsq, lstsq_rank_deficient and 
+                         roots_* call and point counts
+        maxima:    dict  lstsq_cond, largest condition number of the linear
+                         regressions
+        timings:   dict  Seconds spent in each phase (load, preprocess,
+                         optimise, statistics, format)
+        optimiser: dict  Iterations, evaluations and termination status of
+                         the optimiser
+    """
+    return d.to_dict()
+
+def bands(x, x_plot, y, ci, pi, level):
+    """
+    Pointwise bands of fitted data (see Fitter.bands). Lower and upper bands
+    are y -/+ ci (confidence) and y -/+ pi (prediction).
+    """
+    response = {
+            "x":      x,
+            "x_plot": x_plot,
+            "y":      y,
+            "ci":     ci,
+            "pi":     pi,
+            "level":  level,
+            }
+    return response
+
 def data(data_id, x, x_plot, y, labels_x, labels_y):
     response = {
             "data_id": data_id,
@@ -937,6 +977,211 @@ def upload(data_id):
             }
     return response
 
+def job(id, kind, status, priority, client, progress, detail, created, 
+        started, finished, error):
+    response = {
+            "job_id":   id,
+            "kind":     kind,
+            "status":   status,
+            "priority": priority,
+            "client":   client,
+            "progress": progress,
+            "detail":   detail,
+            "created":  created,
+            "started":  started,
+            "finished": finished,
+            "error":    error,
+            }
+    return response
+
+def fit_global(fitter, params, datasets, time, 
+               dilute=None, normalise=None, method=None, flavour=None):
+    """
+    Return dictionary containing global fit result information
+
+    Arguments:
+        fitter:    string  Name (key) of fitter used
+        params:    dict    Fitted shared parameters
+        datasets:  list    formatter.fit response for each dataset
+        time:      float   Time taken to fit
+    """
+    n_y      = sum(d["fit"]["n_y"] for d in datasets)
+    # Shared parameters counted once
+    n_params = len(params) + sum(d["fit"]["n_params"] - len(params)
+                                 for d in datasets)
+    ssr      = sum(d["qof"]["ssr"] for d in datasets)
+
+    response = {
+            "fitter":      fitter,
+            "fitter_name": fitter_name(fitter),
+            "params":      params,
+            "datasets":    datasets,
+            "qof": {
+                "ssr":       ssr,
+                "rms_total": np.sqrt(ssr/n_y),
+                "n_y":       n_y,
+                "n_params":  n_params,
+                },
+            "time": time,
+            "options": {
+                "dilute":    dilute,
+                "normalise": normalise,
+                "method":    method,
+                "flavour":   flavour,
+                },
+            }
+    return response
+
+def session(session_id, fitter, n_points, n_fits, fit=None, error=None):
+    response = {
+            "session_id": session_id,
+            "fitter":     fitter,
+            "n_points":   n_points,
+            "n_fits":     n_fits,
+            "fit":        fit,  # Latest fit (formatter.fit), None if too few
+                                # points to fit yet
+            "error":      error,
+            }
+    return response
+
+def batch_item(index, result, error):
+    response = {
+            "index":  index,  # Position of the fit spec in the batch
+            "status": "ok" if error is None else "error",
+            "result": result, # formatter.fit response, None on error
+            "error":  error,
+            }
+    return response
+
+def batch(items):
+    response = {
+            "results":  items,
+            "n_failed": sum(1 for i in items if i["status"] == "error"),
+            }
+    return response
+
+def batch_pending(index, status):
+    # Batch item whose job hasn't finished, status is the job status
+    response = {
+            "index":  index,
+            "status": status,
+            "result": None,
+            "error":  None,
+            }
+    return response
+
+def batch_status(batch_id, items):
+    """
+    Submitted batch progress
+
+    Arguments:
+        batch_id: UUID  Batch ID
+        items:    list  batch_item dict for each finished fit and
+                        batch_pending dict for each other, in order
+    """
+    n_pending = sum(1 for i in items if i["status"] not in ("ok", "error"))
+    response = {
+            "batch_id":  batch_id,
+            "status":    "running" if n_pending else "done",
+            "n_items":   len(items),
+            "n_pending": n_pending,
+            "n_failed":  sum(1 for i in items if i["status"] == "error"),
+            "results":   items,
+            }
+    return response
+
+def compare_row(spec, error, score, delta_aicc, weight, f_test, result):
+    """
+    Model comparison table row
+
+    Arguments:
+        spec:       dict   FitView request body for the model
+        error:      string Fit error, None if the fit succeeded
+        score:      dict   ssr, n, k, aic, aicc, bic, None if the fit failed.
+                           aicc is None with too few points
+        delta_aicc: float  AICc difference to the best model
+        weight:     float  Akaike weight
+        f_test:     dict   reference: F-test reference fitter key, f, p
+        result:     dict   Full FitView response
+    """
+    score = score or {}
+    response = {
+            "fitter":      spec["fitter"],
+            "fitter_name": fitter_name(spec["fitter"]),
+            "flavour":     spec["options"]["flavour"],
+            "status":      "ok" if error is None else "error",
+            "error":       error,
+            "ssr":         score.get("ssr"),
+            "n":           score.get("n"),
+            "k":           score.get("k"),
+            "aic":         score.get("aic"),
+            "aicc":        score.get("aicc"),
+            "bic":         score.get("bic"),
+            "delta_aicc":  delta_aicc,
+            "weight":      weight,
+            "f_test":      f_test,
+            "rank":        None,
+            # FitView request body, returns the (cached) full fit
+            "request":     spec,
+            "result":      result,
+            }
+    return response
+
+def compare(data_id, family, rows, include_fits=False):
+    if not include_fits:
+        rows = [ dict(row, result=None) for row in rows ]
+
+    response = {
+            "data_id": data_id,
+            "family":  family,
+            "models":  rows,
+            }
+    return response
+
+def plate(data_id, results):
+    """
+    Plate-mode dose-response fit results (see plate.fit), one entry per curve
+    in each column
+    """
+    response = {
+            "data_id":   data_id,
+            "n_curves":  results["n_curves"],
+            "flag_bits": results["flag_bits"],
+            "columns":   results["columns"],
+            }
+    return response
+
+def landscape(data_id, fitter, options, grids, minimum, time):
+    """
+    SSR landscape scan results (see landscape.run). Each grid has its two 
+    axes' names and values and an n_a x n_b SSR array (null where the model
+    could not be evaluated), the first grid is the requested one and any
+    further ones are refinements around the minimum.
+    """
+    response = {
+            "data_id": data_id,
+            "fitter":  fitter,
+            "options": options,
+            "grids":   grids,
+            "minimum": minimum,
+            "time":    time,
+            }
+    return response
+
+def traces(traces):
+    response = {
+            "traces": traces, # Most recent last, see tracing.Trace.to_dict
+            }
+    return response
+
+def cache_stats(stats, singleflight_stats, data_stats=None):
+    response = {
+            "cache":        stats,
+            "singleflight": singleflight_stats,
+            "data_cache":   data_stats,
+            }
+    return response
+
 def fit_summary(id, fitter, name, author, timestamp):
     fn = fitter_name(fitter)
 
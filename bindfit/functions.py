@@ -11,6 +11,8 @@ import numpy as np
 import numpy.matlib as ml
 
 from . import helpers
+from . import diagnostics
+from . import numtrace
 
 import logging
 logger = logging.getLogger('supramolecular')
@@ -53,11 +55,27 @@ class BaseFunction(object):
 # Objective function mixins
 #
 
+def _lstsq(a, b):
+    # np.linalg.lstsq solution, reporting conditioning to any active 
+    # diagnostics collector
+    coeffs, _, rank, sv = np.linalg.lstsq(a, b)
+
+    d = diagnostics.current()
+    if d is not None:
+        d.count("lstsq")
+        if rank < a.shape[1]:
+            d.count("lstsq_rank_deficient")
+        if sv.size and sv[-1] > 0:
+            d.maximum("lstsq_cond", float(sv[0]/sv[-1]))
+
+    return coeffs
+
 class BindingMixin():
     def objective(self, params, xdata, ydata, 
                   scalar=True, 
                   ydata_init=None,
                   fit_coeffs=None,
+                  workspace=None,
                   *args, **kwargs):
         """
         Objective function:
@@ -76,15 +94,26 @@ class BindingMixin():
                                      required if scalar=False
             fit_coeffs:     ndarray  Use pre-calculated coefficient values, 
                                      used in error calculations
+            workspace:      Workspace Preallocated buffers to evaluate into,
+                                     xdata and ydata must be the workspace's
+                                     x and y. Only used if scalar=True
 
         Returns:
             float:  Sum of least squares
         """
 
-        logger.debug("Function.objective: params, xdata shape, ydata shape")
-        logger.debug(params)
-        logger.debug(xdata.shape)
-        logger.debug(ydata.shape)
+        diagnostics.count("objective")
+        if numtrace.enabled:
+            numtrace.tick()
+
+        if scalar and workspace is not None:
+            return self._objective_workspace(params, workspace)
+
+        if numtrace.on:
+            logger.debug("Function.objective: params, xdata shape, ydata shape")
+            logger.debug(params)
+            logger.debug(xdata.shape)
+            logger.debug(ydata.shape)
 
         # Calculate predicted HG complex concentrations for this set of 
         # parameters and concentrations
@@ -101,16 +130,16 @@ class BindingMixin():
         else:
             # Solve by matrix division - linear regression by least squares
             # Equivalent to << coeffs = molefrac\ydata (EA = HG\DA) >> in Matlab
-            coeffs_raw, _, _, _ = np.linalg.lstsq(molefrac_raw.T, ydata.T)
+            coeffs_raw = _lstsq(molefrac_raw.T, ydata.T)
 
         # Restrict UV coefficients to +ve values when normalised
         if not self.normalise and "uv" in self.fitter:
-            logger.debug("Function.objective: normalised UV fit - removing negative coeffs")
             coeffs_raw[coeffs_raw < 0] = 0
 
-        logger.debug("Function.objective: molefrac_raw fitted, calc'd coeffs_raw")
-        logger.debug(molefrac_raw)
-        logger.debug(coeffs_raw)
+        if numtrace.on:
+            logger.debug("Function.objective: molefrac_raw fitted, calc'd coeffs_raw")
+            logger.debug(molefrac_raw)
+            logger.debug(coeffs_raw)
 
         # Calculate data from fitted parameters 
         # (will be normalised if input data was norm'd)
@@ -118,9 +147,6 @@ class BindingMixin():
         # data array
         fit = molefrac_raw.T.dot(coeffs_raw).T
 
-        logger.debug("Function.objective: fit shape")
-        logger.debug(fit.shape)
-
         # Calculate residuals (fitted data - input data)
         residuals = fit - ydata
 
@@ -134,6 +160,35 @@ class BindingMixin():
                                         h0_init=xdata[0][0])
             return fit, residuals, coeffs_raw, molefrac_raw, coeffs, molefrac
 
+    def _objective_workspace(self, params, ws):
+        # Allocation-free equivalent of objective(scalar=True), writing 
+        # species, fit and residuals into the workspace's buffers
+        if ws.molefrac is None:
+            # First evaluation: let the model function allocate the species
+            # buffer, then keep it for reuse
+            ws.molefrac, _ = self.f(params, ws.x, flavour=self.flavour,
+                                    roots=ws.roots)
+        else:
+            self.f(params, ws.x, flavour=self.flavour, out=ws.molefrac,
+                   roots=ws.roots)
+
+        return self._regress_workspace(ws.molefrac, ws)
+
+    def _regress_workspace(self, molefrac, ws):
+        # Linear regression of the workspace's y data against model species
+        # calculated for its x data, writing fit and residuals into its
+        # buffers. Returns sum of squared residuals.
+        species = molefrac[1:] if self.normalise else molefrac
+
+        coeffs_raw = _lstsq(species.T, ws.y_T)
+
+        if not self.normalise and "uv" in self.fitter:
+            np.maximum(coeffs_raw, 0, out=coeffs_raw)
+
+        np.dot(coeffs_raw.T, species, out=ws.fit)
+        np.subtract(ws.fit, ws.y, out=ws.residuals)
+        return ws.ssr()
+
     def format_x(self, xdata):
         h0 = xdata[0]
         g0 = xdata[1]
@@ -154,9 +209,10 @@ class BindingMixin():
         # H coefficients
         h = np.copy(ydata_init)
         coeffs = np.array(coeffs)
-        logger.debug("FORMAT_COEFFS: H, COEFFS")
-        logger.debug(h)
-        logger.debug(coeffs)
+        if numtrace.enabled:
+            logger.debug("FORMAT_COEFFS: H, COEFFS")
+            logger.debug(h)
+            logger.debug(coeffs)
 
         if self.flavour == "add" or self.flavour == "stat":
             # Preprocess coeffs for additive flavours
@@ -206,14 +262,25 @@ class AggMixin():
                   scalar=False, 
                   ydata_init=None,
                   fit_coeffs=None,
+                  workspace=None,
                   *args, **kwargs):
         """
+        Objective function for aggregation models, see 
+        BindingMixin.objective for arguments.
         """
 
-        logger.debug("Function.objective: params, xdata shape, ydata shape")
-        logger.debug(params)
-        logger.debug(xdata.shape)
-        logger.debug(ydata.shape)
+        diagnostics.count("objective")
+        if numtrace.enabled:
+            numtrace.tick()
+
+        if scalar and workspace is not None:
+            return self._objective_workspace(params, workspace)
+
+        if numtrace.on:
+            logger.debug("Function.objective: params, xdata shape, ydata shape")
+            logger.debug(params)
+            logger.debug(xdata.shape)
+            logger.debug(ydata.shape)
 
         # Calculate predicted complex concentrations for this set of 
         # parameters and concentrations
@@ -230,7 +297,7 @@ class AggMixin():
         if fit_coeffs is not None:
             coeffs_raw = fit_coeffs
         else:
-            coeffs_raw, _, _, _ = np.linalg.lstsq(hmat.T, ydata.T)
+            coeffs_raw = _lstsq(hmat.T, ydata.T)
 
         # Calculate data from fitted parameters 
         # (will be normalised since input data was norm'd)
@@ -238,8 +305,9 @@ class AggMixin():
         # data array
         fit = hmat.T.dot(coeffs_raw).T
 
-        logger.debug("Function.objective: fit")
-        logger.debug(fit)
+        if numtrace.on:
+            logger.debug("Function.objective: fit")
+            logger.debug(fit)
 
         # Calculate residuals (fitted data - input data)
         residuals = fit - ydata
@@ -254,6 +322,31 @@ class AggMixin():
                                         h0_init=xdata[0][0])
             return fit, residuals, coeffs_raw, hmat, coeffs, molefrac
 
+    def _objective_workspace(self, params, ws):
+        # Allocation-free equivalent of objective(scalar=True)
+        if ws.molefrac is None:
+            ws.molefrac, _ = self.f(params, ws.x, flavour=self.flavour)
+        else:
+            self.f(params, ws.x, flavour=self.flavour, out=ws.molefrac)
+
+        return self._regress_workspace(ws.molefrac, ws)
+
+    def _regress_workspace(self, molefrac, ws):
+        # See BindingMixin._regress_workspace
+        h, hs, he = molefrac
+
+        # hmat = [h + he/2, hs + he/2]
+        hmat = ws.buffer("hmat", (2, h.shape[0]))
+        np.multiply(he, 0.5, out=hmat[0])
+        np.add(hmat[0], hs, out=hmat[1])
+        hmat[0] += h
+
+        coeffs_raw = _lstsq(hmat.T, ws.y_T)
+
+        np.dot(coeffs_raw.T, hmat, out=ws.fit)
+        np.subtract(ws.fit, ws.y, out=ws.residuals)
+        return ws.ssr()
+
     def format_x(self, xdata):
         return xdata[0]
 
@@ -314,11 +407,23 @@ class FunctionAgg(AggMixin, BaseFunction):
 #
 
 class FunctionInhibitorResponse(FunctionBinding):
-    def objective(self, params, xdata, ydata, scalar=False, *args, **kwargs): 
-        logger.debug("FunctionInhibitorResponse.objective: params, xdata, ydata")
-        logger.debug(params)
-        logger.debug(xdata)
-        logger.debug(ydata)
+    def objective(self, params, xdata, ydata, scalar=False, 
+                  workspace=None, *args, **kwargs): 
+        diagnostics.count("objective")
+        if numtrace.enabled:
+            numtrace.tick()
+
+        if scalar and workspace is not None:
+            ws = workspace
+            inhibitor_response(params, ws.x, out=ws.fit[0])
+            np.subtract(ws.fit, ws.y, out=ws.residuals)
+            return ws.ssr()
+
+        if numtrace.on:
+            logger.debug("FunctionInhibitorResponse.objective: params, xdata, ydata")
+            logger.debug(params)
+            logger.debug(xdata)
+            logger.debug(ydata)
 
         yfit = self.f(params, xdata)
         yfit = yfit[np.newaxis]
@@ -326,19 +431,17 @@ class FunctionInhibitorResponse(FunctionBinding):
         # Calculate residuals (fitted data - input data)
         residuals = yfit - ydata
 
-        logger.debug("FunctionInhibitorResponse.objective: yfit")
-        logger.debug(yfit)
+        if numtrace.on:
+            logger.debug("FunctionInhibitorResponse.objective: yfit")
+            logger.debug(yfit)
 
         if scalar:
-            logger.debug("FIR.objective: returning residuals sum:")
-            logger.debug(np.square(residuals).sum())
             return np.square(residuals).sum()
         else:
-            logger.debug("FIR.objective: returning detailed fit:")
             # Transpose any column-matrices to rows
             return yfit, residuals, np.zeros(1, dtype="float64"), np.zeros((1,1), dtype="float64")
 
-def inhibitor_response(params, xdata, *args, **kwargs):
+def inhibitor_response(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [HG] given data object parameters as input.
     """
@@ -349,7 +452,15 @@ def inhibitor_response(params, xdata, *args, **kwargs):
 
     inhibitor = xdata[1] # xdata[0] is just 1s to fudge geq calc
 
-    response = 100/(1+10**((logIC50 - inhibitor)*hillslope))
+    if out is None:
+        response = 100/(1+10**((logIC50 - inhibitor)*hillslope))
+    else:
+        # Same calculation evaluated in place
+        response = np.subtract(logIC50, inhibitor, out=out)
+        response *= hillslope
+        np.power(10, response, out=response)
+        response += 1
+        np.divide(100, response, out=response)
 
     return response
 
@@ -361,8 +472,153 @@ def inhibitor_response(params, xdata, *args, **kwargs):
 #
 # Function definitions
 #
+# Each model function returns a (fit, display) pair of species arrays. If an
+# out array (shaped like a previously returned fit array) is given, the fit
+# species are written into it and the display array is not calculated 
+# (None is returned in its place).
+#
+# Models solving a cubic for a free concentration (1:2, 2:1) also take an
+# optional roots array holding the previous solution for each point (NaN if
+# none). Solutions start from it and are written back into it, see 
+# _solve_binding_cubic.
+#
 
-def nmr_1to1(params, xdata, *args, **kwargs):
+def _stack(rows, out=None):
+    # np.vstack equivalent writing into out if given
+    if out is None:
+        return np.vstack(rows)
+
+    for i, row in enumerate(rows):
+        out[i] = row
+    return out
+
+def _cubic_roots(poly):
+    # Smallest real non-negative root of each row of an n x 4 array of cubic
+    # coefficients, 0 if there is none
+    x = np.zeros(poly.shape[0])
+    for i, p in enumerate(poly):
+        roots = np.roots(p)
+
+        select = np.all([np.imag(roots) == 0, np.real(roots) >= 0], axis=0)
+        if select.any():
+            soln = roots[select].min()
+            soln = float(np.real(soln))
+        else:
+            # No positive real roots, set solution to 0
+            soln = 0.0
+
+        x[i] = soln
+    return x
+
+def _single_root(poly, upper):
+    # Rows of an n x 4 array of cubic coefficients with exactly one root in
+    # [0, upper]: p(0) <= 0 <= p(upper), and no local maximum inside with
+    # p >= 0 (where, since p(0) <= 0, two more roots could lie). The root is
+    # then also the smallest non-negative one.
+    a, b, c, d = poly.T
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        p_upper = ((a*upper + b)*upper + c)*upper + d
+
+        # Local maximum: p'(x) = 3ax^2 + 2bx + c = 0 with p''(x) < 0, the
+        # same expression for either sign of a. Quadratics (a = 0) have one
+        # if b < 0.
+        disc = b*b - 3*a*c
+        x_max = np.where(a != 0,
+                         (-b - np.sqrt(np.maximum(disc, 0)))/(3*a),
+                         -c/(2*b))
+        has_max = np.where(a != 0, disc > 0, b < 0)
+        p_max = ((a*x_max + b)*x_max + c)*x_max + d
+        ambiguous = has_max & (x_max > 0) & (x_max < upper) & (p_max >= 0)
+
+        return np.isfinite(poly).all(axis=1) & np.isfinite(p_upper) & \
+               (d <= 0) & (p_upper >= 0) & ~ambiguous
+
+def _solve_binding_cubic(poly, upper, roots=None, max_iter=50, rtol=1e-14,
+                         ptol=1e-8):
+    """
+    Solve host-guest mass balance cubics for the free concentration, the
+    smallest non-negative root of each.
+
+    For non-negative binding constants these cubics have exactly one root in
+    [0, upper] (the total concentration of the species solved for):
+    p(0) = -upper <= 0 and p(upper) >= 0. Negative constants, as tried by
+    unbounded optimisers, can break this. Without previous solutions each
+    cubic is solved with np.roots. With previous solutions (roots), points
+    whose cubic has a single root in [0, upper] are refined together by
+    Newton iterations started from them, bisecting whenever a step leaves
+    the bracket. Other points, and points that don't converge to a root
+    (|p(x)| within ptol of the magnitude of its terms), fall back to
+    np.roots.
+
+    Arguments:
+        poly:  ndarray  n x 4 cubic coefficients, one row per point
+        upper: ndarray  Length n upper bound of each root
+        roots: ndarray  Optional length n previous solutions (NaN for none),
+                        updated in place
+
+    Returns:
+        ndarray  Length n free concentrations
+    """
+    diagnostics.count("roots_calls")
+
+    if roots is None:
+        diagnostics.count("roots_direct", poly.shape[0])
+        return _cubic_roots(poly)
+
+    x = np.zeros(poly.shape[0])
+    newton = _single_root(poly, upper)
+    done = np.zeros(poly.shape[0], dtype=bool)
+
+    if newton.any():
+        a, b, c, d = poly[newton].T
+        lo = np.zeros(a.shape[0])
+        hi = np.array(upper[newton], dtype=np.float64)
+        start = roots[newton]
+
+        xn = np.where(np.isfinite(start), np.clip(start, lo, hi), hi/2)
+        converged = np.zeros(a.shape[0], dtype=bool)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(max_iter):
+                p = ((a*xn + b)*xn + c)*xn + d
+
+                # Root lies where p changes sign
+                neg = p < 0
+                lo = np.where(neg, xn, lo)
+                hi = np.where(neg, hi, xn)
+
+                x_new = xn - p/((3*a*xn + 2*b)*xn + c)
+                outside = ~((x_new >= lo) & (x_new <= hi))
+                x_new = np.where(outside, (lo + hi)/2, x_new)
+
+                # Converged points are left as they are
+                x_new = np.where(converged, xn, x_new)
+                converged |= np.abs(x_new - xn) <= rtol*np.abs(x_new)
+                xn = x_new
+                if converged.all():
+                    break
+
+            # Only accept actual roots
+            p = ((a*xn + b)*xn + c)*xn + d
+            scale = ((np.abs(a)*xn + np.abs(b))*xn + np.abs(c))*xn + np.abs(d)
+            converged &= np.abs(p) <= ptol*scale
+
+        x[newton] = xn
+        done[newton] = converged
+
+        dc = diagnostics.current()
+        if dc is not None:
+            dc.count("roots_newton", a.shape[0])
+            dc.count("roots_newton_iterations", i + 1)
+
+    if not done.all():
+        diagnostics.count("roots_fallback", np.count_nonzero(~done))
+        x[~done] = _cubic_roots(poly[~done])
+
+    roots[...] = x
+    return x
+
+def nmr_1to1(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [HG] given data object parameters as input.
     """
@@ -390,12 +646,12 @@ def nmr_1to1(params, xdata, *args, **kwargs):
 
     # Make column vector
     #hg_mat = hg[np.newaxis]
-    hg_mat_fit = np.vstack((h, hg))
-    hg_mat     = np.vstack((h, hg))
+    hg_mat_fit = _stack((h, hg), out)
+    hg_mat     = np.vstack((h, hg)) if out is None else None
 
     return hg_mat_fit, hg_mat
 
-def uv_1to1(params, xdata, *args, **kwargs):
+def uv_1to1(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [HG] given data object parameters as input.
     """
@@ -418,12 +674,13 @@ def uv_1to1(params, xdata, *args, **kwargs):
     hg[inds] = np.sqrt(h0[inds] * g0[inds])
 
     # Make column vector
-    hg_mat_fit = np.vstack((h,    hg))    # Free concentration for correct fitting
-    hg_mat     = np.vstack((h/h0, hg/h0)) # Molefrac for display
+    hg_mat_fit = _stack((h, hg), out)                            # Free concentration for correct fitting
+    hg_mat     = np.vstack((h/h0, hg/h0)) if out is None else None # Molefrac for display
 
     return hg_mat_fit, hg_mat
 
-def uv_1to2(params, xdata, flavour="none", *args, **kwargs):
+def uv_1to2(params, xdata, flavour="none", out=None, roots=None, 
+            *args, **kwargs):
     """
     Calculates predicted [HG] and [HG2] given data object and binding constants
     as input.
@@ -447,21 +704,8 @@ def uv_1to2(params, xdata, flavour="none", *args, **kwargs):
     # Rows: data points, cols: poly coefficients
     poly = np.column_stack((a, b, c, d))
 
-    # Solve cubic in [G] for each observation
-    g = np.zeros(h0.shape[0])
-    for i, p in enumerate(poly):
-        roots = np.roots(p)
-
-        # Smallest real +ve root is [G]
-        select = np.all([np.imag(roots) == 0, np.real(roots) >= 0], axis=0)
-        if select.any():
-            soln = roots[select].min()
-            soln = float(np.real(soln))
-        else:
-            # No positive real roots, set solution to 0
-            soln = 0.0
-        
-        g[i] = soln
+    # Solve cubic in [G] for each observation, 0 <= [G] <= [G]0
+    g = _solve_binding_cubic(poly, g0, roots)
 
     # Calculate [HG] and [HG2] complex concentrations 
     hg  = h0*((g*k11)/(1+(g*k11)+(g*g*k11*k12)))
@@ -470,35 +714,32 @@ def uv_1to2(params, xdata, flavour="none", *args, **kwargs):
 
     if flavour == "add" or flavour == "stat":
         hg_add = hg + 2*hg2
-        hg_mat_fit = np.vstack((h, hg_add))
+        hg_mat_fit = _stack((h, hg_add), out)
     else:
-        hg_mat_fit = np.vstack((h, hg, hg2))
+        hg_mat_fit = _stack((h, hg, hg2), out)
         
+    if out is not None:
+        return hg_mat_fit, None
+
     hg_mat = np.vstack((h/h0, hg/h0, hg2/h0)) # Display-only molefracs
     return hg_mat_fit, hg_mat
 
-def nmr_1to2(params, xdata, flavour="none", *args, **kwargs):
+def nmr_1to2(params, xdata, flavour="none", out=None, roots=None, 
+             *args, **kwargs):
     """
     Calculates predicted [HG] and [HG2] given data object and binding constants
     as input.
     """
 
-    logger.debug("FLAVOUR RECEIVED NMR1TO2:")
-    logger.debug(flavour)
-
     k11 = params[0]
     if flavour == "noncoop" or flavour == "stat":
         k12 = k11/4
-        logger.debug("FLAVOUR: noncoop or stat")
-        logger.debug("k11, k12")
-        logger.debug(k11)
-        logger.debug(k12)
     else:
         k12 = params[1]
-        logger.debug("FLAVOUR: none or add")
-        logger.debug("k11, k12")
-        logger.debug(k11)
-        logger.debug(k12)
+
+    if numtrace.on:
+        logger.debug("nmr_1to2: flavour, k11, k12")
+        logger.debug((flavour, k11, k12))
 
     h0  = xdata[0]
     g0  = xdata[1]
@@ -512,21 +753,8 @@ def nmr_1to2(params, xdata, flavour="none", *args, **kwargs):
     # Rows: data points, cols: poly coefficients
     poly = np.column_stack((a, b, c, d))
 
-    # Solve cubic in [G] for each observation
-    g = np.zeros(h0.shape[0])
-    for i, p in enumerate(poly):
-        roots = np.roots(p)
-
-        # Smallest real +ve root is [G]
-        select = np.all([np.imag(roots) == 0, np.real(roots) >= 0], axis=0)
-        if select.any():
-            soln = roots[select].min()
-            soln = float(np.real(soln))
-        else:
-            # No positive real roots, set solution to 0
-            soln = 0.0
-        
-        g[i] = soln
+    # Solve cubic in [G] for each observation, 0 <= [G] <= [G]0
+    g = _solve_binding_cubic(poly, g0, roots)
 
 
     # Calculate [HG] and [HG2] complex concentrations 
@@ -535,17 +763,19 @@ def nmr_1to2(params, xdata, flavour="none", *args, **kwargs):
     h   = 1 - hg - hg2
 
     if flavour == "add" or flavour == "stat":
-        logger.debug("FLAVOUR: add or stat")
         hg_add = hg + 2*hg2
-        hg_mat_fit = np.vstack((h, hg_add))
+        hg_mat_fit = _stack((h, hg_add), out)
     else:
-        logger.debug("FLAVOUR: none or noncoop")
-        hg_mat_fit = np.vstack((h, hg, hg2))
+        hg_mat_fit = _stack((h, hg, hg2), out)
+
+    if out is not None:
+        return hg_mat_fit, None
 
     hg_mat = np.vstack((h, hg, hg2))
     return hg_mat_fit, hg_mat
 
-def nmr_2to1(params, xdata, flavour="none", *args, **kwargs):
+def nmr_2to1(params, xdata, flavour="none", out=None, roots=None, 
+             *args, **kwargs):
     """
     Calculates predicted [HG] and [H2G] given data object and binding constants
     as input.
@@ -554,16 +784,12 @@ def nmr_2to1(params, xdata, flavour="none", *args, **kwargs):
     k11 = params[0]
     if flavour == "noncoop" or flavour == "stat":
         k12 = k11/4
-        logger.debug("FLAVOUR: noncoop or stat")
-        logger.debug("k11, k12")
-        logger.debug(k11)
-        logger.debug(k12)
     else:
         k12 = params[1]
-        logger.debug("FLAVOUR: none or add")
-        logger.debug("k11, k12")
-        logger.debug(k11)
-        logger.debug(k12)
+
+    if numtrace.on:
+        logger.debug("nmr_2to1: flavour, k11, k12")
+        logger.debug((flavour, k11, k12))
 
     h0  = xdata[0]
     g0  = xdata[1]
@@ -577,21 +803,8 @@ def nmr_2to1(params, xdata, flavour="none", *args, **kwargs):
     # Rows: data points, cols: poly coefficients
     poly = np.column_stack((a, b, c, d))
 
-    # Solve cubic in [H] for each observation
-    h = np.zeros(h0.shape[0])
-
-    for i, p in enumerate(poly):
-        roots = np.roots(p)
-        # Smallest real +ve root is [H]
-        select = np.all([np.imag(roots) == 0, np.real(roots) >= 0], axis=0)
-        if select.any():
-            soln = roots[select].min()
-            soln = float(np.real(soln))
-        else:
-            # No positive real roots, set solution to 0
-            soln = 0.0
-
-        h[i] = soln
+    # Solve cubic in [H] for each observation, 0 <= [H] <= [H]0
+    h = _solve_binding_cubic(poly, h0, roots)
 
     # Calculate [HG] and [H2G] complex concentrations 
     hg  = (g0*h*k11)/(h0*(1+(h*k11)+(h*h*k11*k12)))
@@ -599,17 +812,19 @@ def nmr_2to1(params, xdata, flavour="none", *args, **kwargs):
     h   = 1 - hg - h2g
 
     if flavour == "add" or flavour == "stat":
-        logger.debug("FLAVOUR: add or stat")
         hg_add = hg + 2*h2g
-        hg_mat_fit = np.vstack((h, hg_add))
+        hg_mat_fit = _stack((h, hg_add), out)
     else:
-        logger.debug("FLAVOUR: none or noncoop")
-        hg_mat_fit = np.vstack((h, hg, h2g))
+        hg_mat_fit = _stack((h, hg, h2g), out)
+
+    if out is not None:
+        return hg_mat_fit, None
 
     hg_mat = np.vstack((h, hg, h2g))
     return hg_mat_fit, hg_mat
 
-def uv_2to1(params, xdata, flavour="none"):
+def uv_2to1(params, xdata, flavour="none", out=None, roots=None, 
+            *args, **kwargs):
     """
     Calculates predicted [HG] and [H2G] given data object and binding constants
     as input.
@@ -634,21 +849,8 @@ def uv_2to1(params, xdata, flavour="none"):
     # Rows: data points, cols: poly coefficients
     poly = np.column_stack((a, b, c, d))
 
-    # Solve cubic in [H] for each observation
-    h = np.zeros(h0.shape[0])
-
-    for i, p in enumerate(poly):
-        roots = np.roots(p)
-        # Smallest real +ve root is [H]
-        select = np.all([np.imag(roots) == 0, np.real(roots) >= 0], axis=0)
-        if select.any():
-            soln = roots[select].min()
-            soln = float(np.real(soln))
-        else:
-            # No positive real roots, set solution to 0
-            soln = 0.0
-
-        h[i] = soln
+    # Solve cubic in [H] for each observation, 0 <= [H] <= [H]0
+    h = _solve_binding_cubic(poly, h0, roots)
 
     # Calculate [HG] and [H2G] complex concentrations 
     hg  = g0*((h*k11)/(1+(h*k11)+(h*h*k11*k12)))
@@ -657,14 +859,17 @@ def uv_2to1(params, xdata, flavour="none"):
 
     if flavour == "add" or flavour == "stat":
         hg_add = hg + 2*h2g
-        hg_mat_fit = np.vstack((h, hg_add))
+        hg_mat_fit = _stack((h, hg_add), out)
     else:
-        hg_mat_fit = np.vstack((h, hg, h2g))
+        hg_mat_fit = _stack((h, hg, h2g), out)
+
+    if out is not None:
+        return hg_mat_fit, None
 
     hg_mat = np.vstack((h/h0, hg/h0, h2g/h0)) # Molefrac for display
     return hg_mat_fit, hg_mat
 
-def nmr_dimer(params, xdata, *args, **kwargs):
+def nmr_dimer(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [H] [Hs] and [He] given data object and binding
     constant as input.
@@ -675,6 +880,9 @@ def nmr_dimer(params, xdata, *args, **kwargs):
 
     if ke == 0:
         # Avoid dividing by zero ...
+        if out is not None:
+            out.fill(0)
+            return out, None
         mf = np.array([h0*0, h0*0, h0*0])
         return mf, mf
 
@@ -692,11 +900,11 @@ def nmr_dimer(params, xdata, *args, **kwargs):
     # from Thordarson book chapter
     he = (2*h*h*ke*h0)/(1 - h*ke*h0)
 
-    mf_fit = np.vstack((h, hs, he))
-    mf     = np.vstack((h, hs, he))
+    mf_fit = _stack((h, hs, he), out)
+    mf     = np.vstack((h, hs, he)) if out is None else None
     return mf_fit, mf
 
-def uv_dimer(params, xdata, *args, **kwargs):
+def uv_dimer(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [H] [Hs] and [He] given data object and binding
     constant as input.
@@ -707,6 +915,9 @@ def uv_dimer(params, xdata, *args, **kwargs):
 
     if ke == 0:
         # Avoid dividing by zero ...
+        if out is not None:
+            out.fill(0)
+            return out, None
         mf = np.array([h0*0, h0*0, h0*0])
         return mf, mf
 
@@ -727,11 +938,11 @@ def uv_dimer(params, xdata, *args, **kwargs):
     # Convert to free concentration
     hc = h0*h
 
-    mf_fit = np.vstack((hc,    hs,    he))    # Free concentration for fitting
-    mf     = np.vstack((hc/h0, hs/h0, he/h0)) # Real molefraction
+    mf_fit = _stack((hc, hs, he), out)                                  # Free concentration for fitting
+    mf     = np.vstack((hc/h0, hs/h0, he/h0)) if out is None else None # Real molefraction
     return mf_fit, mf
 
-def nmr_coek(params, xdata, *args, **kwargs):
+def nmr_coek(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [H] [Hs] and [He] given data object and binding constants
     as input.
@@ -754,6 +965,7 @@ def nmr_coek(params, xdata, *args, **kwargs):
     poly = np.column_stack((a, b, c, d))
 
     # Solve cubic in [H] for each observation
+    diagnostics.count("roots_direct", h0.shape[0])
     h = np.zeros(h0.shape[0])
     for i, p in enumerate(poly):
         roots = np.roots(p)
@@ -777,11 +989,11 @@ def nmr_coek(params, xdata, *args, **kwargs):
     # eq 150 from Thordarson book chapter
     he = (2*rho*h*h*ke*h0)/(1-h*ke*h0)
 
-    mf_fit = np.vstack((h, hs, he))
-    mf     = np.vstack((h, hs, he))
+    mf_fit = _stack((h, hs, he), out)
+    mf     = np.vstack((h, hs, he)) if out is None else None
     return mf_fit, mf
 
-def uv_coek(params, xdata, *args, **kwargs):
+def uv_coek(params, xdata, out=None, *args, **kwargs):
     """
     Calculates predicted [H] [Hs] and [He] given data object and binding constants
     as input.
@@ -804,6 +1016,7 @@ def uv_coek(params, xdata, *args, **kwargs):
     poly = np.column_stack((a, b, c, d))
 
     # Solve cubic in [H] for each observation
+    diagnostics.count("roots_direct", h0.shape[0])
     h = np.zeros(h0.shape[0])
     for i, p in enumerate(poly):
         roots = np.roots(p)
@@ -830,8 +1043,8 @@ def uv_coek(params, xdata, *args, **kwargs):
     # Convert to free concentration
     hc = h0*h
 
-    mf_fit = np.vstack((hc,    hs,    he))    # Free concentration for fitting
-    mf     = np.vstack((hc/h0, hs/h0, he/h0)) # Real molefraction
+    mf_fit = _stack((hc, hs, he), out)                                  # Free concentration for fitting
+    mf     = np.vstack((hc/h0, hs/h0, he/h0)) if out is None else None # Real molefraction
     return mf_fit, mf
 
 
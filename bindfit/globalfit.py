@@ -0,0 +1,160 @@
+"""
+" Global fitting of several datasets with shared nonlinear parameters
+"
+" Each dataset keeps its own linear coefficients (and normalisation), the
+" nonlinear parameters (K, Ke, rho, ...) are shared. The model function is
+" evaluated once per objective call on the concatenated x data of all
+" datasets, followed by one linear regression per dataset.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import scipy
+import scipy.optimize
+
+from . import diagnostics
+from .fitter import Fitter, asymptotic_error
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+# Binding and aggregation fitters, which model species for linear regression
+# (see BindingMixin._regress_workspace and AggMixin._regress_workspace)
+FITTERS = ("nmr1to1", "nmr1to2", "nmr2to1",
+           "uv1to1",  "uv1to2",  "uv2to1",
+           "nmrdimer", "uvdimer", "nmrcoek", "uvcoek")
+
+class GlobalFitter(object):
+    def __init__(self, datasets, function, normalise=True):
+        """
+        Arguments:
+            datasets:  list      (xdata, ydata) pairs
+            function:  Function  Binding or aggregation function object
+        """
+        self.function  = function
+        self.normalise = normalise
+
+        # One Fitter per dataset holds its data, workspace and results
+        self.fitters = [ Fitter(x, y, function, normalise=normalise)
+                         for x, y in datasets ]
+
+        # Concatenated x data of all datasets and each dataset's columns
+        self.x = np.ascontiguousarray(
+                np.hstack([ f.workspace.x for f in self.fitters ]))
+        bounds = np.cumsum([0] + [ f.workspace.x.shape[1]
+                                   for f in self.fitters ])
+        self.slices = [ slice(a, b) for a, b in zip(bounds[:-1], bounds[1:]) ]
+
+        # Species buffer and free concentration solutions for the 
+        # concatenated data, see objective
+        self._molefrac = None
+        self._roots    = np.full(self.x.shape[1], np.nan)
+
+        # Populated on GlobalFitter.run_scipy
+        self.params = None
+        self.time   = None
+
+    def objective(self, params, *args):
+        # Sum of squared residuals over all datasets
+        diagnostics.count("objective")
+
+        if self._molefrac is None:
+            self._molefrac, _ = self.function.f(params, self.x,
+                                                flavour=self.function.flavour,
+                                                roots=self._roots)
+        else:
+            self.function.f(params, self.x,
+                            flavour=self.function.flavour,
+                            out=self._molefrac,
+                            roots=self._roots)
+
+        ssr = 0.
+        for f, s in zip(self.fitters, self.slices):
+            ssr += self.function._regress_workspace(self._molefrac[:,s],
+                                                    f.workspace)
+        return ssr
+
+    def run_scipy(self, params_init, method="Nelder-Mead", callback=None):
+        """
+        Fit all datasets. Per-dataset fitted data, residuals, coefficients
+        and molefractions are saved to the dataset fitters (self.fitters),
+        the shared parameters to self.params.
+
+        Arguments:
+            params_init: dict  Initial parameter guesses, as for Fitter
+            callback:    Optional callable, see Fitter.run_scipy
+        """
+        p, b = Fitter.sort_params(params_init)
+
+        if callback is not None:
+            n_iter = [0]
+            def iteration(xk):
+                n_iter[0] += 1
+                callback(n_iter[0], xk)
+        else:
+            iteration = None
+
+        tic = time.perf_counter()
+        with diagnostics.phase("optimise"):
+            result = scipy.optimize.minimize(self.objective,
+                                             p,
+                                             bounds=b,
+                                             method=method if method else "Nelder-Mead",
+                                             tol=1e-18,
+                                             callback=iteration,
+                                            )
+        toc = time.perf_counter()
+
+        d = diagnostics.current()
+        if d is not None:
+            d.set_optimiser(result)
+
+        logger.debug("GlobalFitter.run_scipy: result.x")
+        logger.debug(result.x)
+
+        # Per-dataset results at the shared optimum
+        for f in self.fitters:
+            ws = f.workspace
+            fit_norm, residuals, coeffs_raw, molefrac_raw, coeffs, molefrac = \
+                    self.function.objective(result.x, ws.x, ws.y,
+                                            scalar=False,
+                                            ydata_init=f.ydata[:,0])
+
+            f.fit          = f._postprocess(f.ydata, fit_norm)
+            f.residuals    = residuals
+            f.coeffs       = coeffs
+            f.coeffs_raw   = coeffs_raw
+            f.molefrac     = molefrac
+            f.molefrac_raw = molefrac_raw
+            f._params_raw  = result.x
+
+        self._params_raw = result.x
+        self.time = toc - tic
+
+        with diagnostics.phase("statistics"):
+            err = self.statistics(result.x)
+        self.params = self.function.format_params(params_init, result.x, err)
+
+        for f in self.fitters:
+            f.params = self.params
+            f.time   = self.time
+
+    def statistics(self, params):
+        """
+        Asymptotic errors of the shared parameters from the combined
+        residuals of all datasets (see Fitter.statistics)
+        """
+        diffs = np.hstack([ f.jacobian(params, f.fit, f.coeffs_raw)
+                            for f in self.fitters ])
+
+        ssr = sum(np.sum(np.square(f.residuals)) for f in self.fitters)
+        # N datapoints - N calculated coefficients, over all datasets,
+        # - N shared params
+        d_free = sum(f.ydata.size - f.coeffs_raw.size
+                     for f in self.fitters) - len(params)
+
+        return asymptotic_error(params, diffs, ssr, d_free)
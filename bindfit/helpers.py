@@ -5,10 +5,13 @@
 from __future__ import division
 from __future__ import print_function
 
-from math import sqrt
+from math import sqrt, log
 import numpy as np
+from scipy import stats
 import numpy.matlib as ml
 
+from . import numtrace
+
 import logging
 logger = logging.getLogger('supramolecular')
 
@@ -16,6 +19,55 @@ def ssr(residuals):
     # Calculate the sum of squares of residuals
     return np.sum(np.square(residuals))
 
+# Floor for the sum of squares of residuals in information criteria, so exact
+# fits (ssr == 0) rank best rather than failing on log(0)
+SSR_MIN = np.finfo(float).tiny
+
+def information_criteria(ssr, n, k):
+    """
+    Calculate information criteria of a least squares fit, assuming normally
+    distributed residuals
+
+    Arguments:
+        ssr: float  Sum of squares of residuals, floored at SSR_MIN
+        n:   int    Number of fitted data points
+        k:   int    Number of fitted parameters (including linear 
+                    coefficients)
+
+    Returns:
+        dict  aic, aicc (small sample corrected AIC) and bic. aicc is inf if
+              n <= k + 1
+    """
+    lnl = n*log(max(ssr, SSR_MIN)/n)
+
+    aic = lnl + 2*k
+    if n - k - 1 > 0:
+        aicc = aic + (2*k*(k + 1))/(n - k - 1)
+    else:
+        aicc = float("inf")
+    bic = lnl + k*log(n)
+
+    return {"aic": aic, "aicc": aicc, "bic": bic}
+
+def f_test(ssr_simple, k_simple, ssr_full, k_full, n):
+    """
+    F-test of a full model against a simpler model nested within it
+
+    Returns:
+        tuple  (F statistic, p value), p < 0.05 favours the full model.
+               (None, None) if the models have equal parameter counts or 
+               the full model has no residual degrees of freedom or fits
+               exactly
+    """
+    df_num = k_full - k_simple
+    df_den = n - k_full
+
+    if df_num <= 0 or df_den <= 0 or ssr_full <= 0:
+        return None, None
+
+    f = ((ssr_simple - ssr_full)/df_num)/(ssr_full/df_den)
+    return f, stats.f.sf(f, df_num, df_den)
+
 def cov(data, residuals, total=False):
     # TODO: TEMP
     # Add axis to single y arrays for generalised calcs
@@ -71,8 +123,9 @@ def normalise(data):
     """
 
     logger.debug("helpers.normalise: called")
-    logger.debug("helpers.normalise: input data")
-    logger.debug(data)
+    if numtrace.enabled:
+        logger.debug("helpers.normalise: input data")
+        logger.debug(data)
 
     # Create matrix of initial values to subtract from original matrix
     initialmat = ml.repmat(data.T[0,:], len(data.T), 1).T
@@ -116,6 +169,25 @@ def dilute(h0, data):
     y_dil = (y*dilmat)
     return y_dil
 
+def interpolate_x(xdata, points):
+    """
+    Interpolate x data to a dense grid along a titration, linearly between
+    consecutive points in each row.
+
+    Arguments:
+        xdata:  ndarray  x x m array of input x data
+        points: int      Number of points in the returned grid
+
+    Returns:
+        ndarray  x x points array including the first and last input points
+    """
+    xdata = np.asarray(xdata, dtype=np.float64)
+    m = xdata.shape[1]
+
+    t  = np.arange(m)
+    ti = np.linspace(0, m - 1, points)
+    return np.array([ np.interp(ti, t, row) for row in xdata ])
+
 def pad_2d(items, const=None):
     # Pad a list to the specified size along second axis
     # All items in list must be lists
@@ -0,0 +1,540 @@
+"""
+" Asynchronous fit and Monte Carlo jobs
+"
+" Jobs are persisted as models.Job rows. The backend selected by
+" settings.BINDFIT_JOBS decides how they are executed: DatabaseBackend leaves
+" them queued for a runfitworker process pool, LocalBackend runs them
+" immediately in the submitting process (for tests and development).
+" runfitworker decides which queued jobs to start with scheduler.Scheduler.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import time
+import datetime
+import multiprocessing
+
+import numpy as np
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import models
+from . import scheduler
+from .checkpoint import MonteCarloCheckpoint
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "BACKEND": "bindfit.jobs.DatabaseBackend",
+        "OPTIONS": {},
+        }
+
+# Minimum interval between progress updates written to the database (s)
+PROGRESS_INTERVAL = 0.5
+
+# Event stream polling and keepalive comment intervals (s)
+EVENTS_POLL      = 0.5
+EVENTS_KEEPALIVE = 15
+# Default maximum duration of an event stream (s), see events
+EVENTS_MAX_DURATION = 300
+
+
+
+#
+# Job runners
+# Each takes the job ID and request body and returns the response body
+#
+
+def run_fit(job_id, request_data):
+    # Imported here, views import this module
+    from .views import FitView
+    progress = FitProgress(job_id, sorted(request_data["params"]))
+    return FitView.run(request_data, callback=progress)
+
+def run_monte_carlo(job_id, request_data):
+    from .views import FitMonteCarloView
+    progress = MonteCarloProgress(job_id, 
+                                  sorted(request_data["fit"]["fit"]["params"]))
+    # A requeued job resumes from its last checkpoint
+    return FitMonteCarloView.run(
+            request_data, 
+            callback=progress,
+            checkpoint=MonteCarloCheckpoint.for_name(checkpoint_name(job_id)))
+
+def checkpoint_name(job_id):
+    return "mc-{}".format(job_id)
+
+def run_batch_item(job_id, request_data):
+    # One item of a batch.run batch, errors are reported in the item
+    from .batch import fit_item
+    return fit_item((request_data["index"], request_data["fit"]))
+
+def run_landscape_rows(job_id, request_data):
+    # One block of grid rows of a landscape.scan
+    from .landscape import scan_rows
+    r = request_data
+    return scan_rows((r["fitter"], r["normalise"], r["flavour"],
+                      np.array(r["x"]), np.array(r["y"]),
+                      r["names"], r["index"],
+                      np.array(r["a"]), np.array(r["b"]),
+                      r["fixed"]))
+
+RUNNERS = {
+        models.Job.KIND_FIT:       run_fit,
+        models.Job.KIND_MC:        run_monte_carlo,
+        models.Job.KIND_BATCH:     run_batch_item,
+        models.Job.KIND_LANDSCAPE: run_landscape_rows,
+        }
+
+# Default priority class of each kind
+PRIORITIES = {
+        models.Job.KIND_FIT:       scheduler.PRIORITY_INTERACTIVE,
+        models.Job.KIND_MC:        scheduler.PRIORITY_ANALYSIS,
+        models.Job.KIND_BATCH:     scheduler.PRIORITY_BATCH,
+        # A request waits for the whole grid
+        models.Job.KIND_LANDSCAPE: scheduler.PRIORITY_INTERACTIVE,
+        }
+
+# Set by runfitworker while Monte Carlo jobs should pause, see
+# scheduler.Scheduler.should_yield. None outside worker processes.
+_yield_event = None
+
+# Interval at which paused jobs check whether to resume (s)
+YIELD_POLL = 0.1
+
+
+
+#
+# Job execution
+#
+
+class Cancelled(Exception):
+    pass
+
+class Progress(object):
+    """
+    Base progress callback, writes progress reports to the job's database row
+    at most once per PROGRESS_INTERVAL. Raises Cancelled on reporting if the
+    job has been cancelled, aborting the calculation.
+    """
+
+    def __init__(self, job_id, names):
+        self.job_id = job_id
+        self.names  = names # Sorted parameter names
+        self._start = time.time()
+        self._last  = 0
+
+    def due(self, force=False):
+        now = time.time()
+        if force or now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            return True
+        return False
+
+    def report(self, detail, progress=None):
+        detail["elapsed"] = time.time() - self._start
+
+        update = {"detail": json.dumps(detail, cls=JSONEncoder)}
+        if progress is not None:
+            update["progress"] = progress
+
+        updated = models.Job.objects.filter(
+                id=self.job_id,
+                status=models.Job.STATUS_RUNNING).update(**update)
+        if not updated:
+            raise Cancelled()
+
+class FitProgress(Progress):
+    # Fitter.run_scipy callback
+    def __call__(self, n_iter, params):
+        if self.due():
+            self.report({
+                "stage":     "fit",
+                "iteration": n_iter,
+                "params":    dict(zip(self.names, params.tolist())),
+                })
+
+class MonteCarloProgress(Progress):
+    # Fitter.calc_monte_carlo callback, also pauses the job while the worker
+    # asks it to yield to interactive fits
+    def __call__(self, n_done, n_total, params_done):
+        while _yield_event is not None and _yield_event.is_set():
+            time.sleep(YIELD_POLL)
+
+        if self.due(force=(n_done == n_total)):
+            # Current 95% interval estimate for each parameter
+            per = np.percentile(params_done, [2.5, 97.5], axis=0).T
+            self.report({
+                "stage":       "mc",
+                "iteration":   n_done,
+                "n_iter":      n_total,
+                "percentiles": dict(zip(self.names, per.tolist())),
+                }, progress=n_done/n_total)
+
+def submit(kind, request_data, priority=None, client="", batch=None):
+    """
+    Create a queued job and hand it to the configured backend.
+
+    Arguments:
+        kind:         string  Job kind, models.Job.KIND_*
+        request_data: dict    Synchronous view request body
+        priority:     string  Priority class name (see 
+                              scheduler.PRIORITY_NAMES), defaults to the
+                              kind's class
+        client:       string  Submitting client, for fair share
+        batch:        UUID    Batch the job belongs to, see batch.submit
+
+    Returns:
+        Job  Created job
+    """
+    if kind not in RUNNERS:
+        raise ValueError("Unknown job kind: "+str(kind))
+
+    if priority is None:
+        priority = PRIORITIES[kind]
+    elif priority in scheduler.PRIORITIES:
+        priority = scheduler.PRIORITIES[priority]
+    else:
+        raise ValueError("Unknown job priority: "+str(priority))
+
+    job = models.Job.objects.create(kind=kind,
+                                    priority=priority,
+                                    client=client[:100],
+                                    batch=batch,
+                                    request=json.dumps(request_data,
+                                                       cls=JSONEncoder))
+    get_backend().submit(job)
+    return job
+
+def claim(job_id):
+    # Atomically move a queued job to running, returns False if another
+    # worker got there first
+    claimed = models.Job.objects.filter(
+            id=job_id,
+            status=models.Job.STATUS_QUEUED).update(
+                    status=models.Job.STATUS_RUNNING,
+                    started=timezone.now())
+    return claimed == 1
+
+def cancel(job_id):
+    """
+    Cancel a queued or running job. Running jobs stop at their next progress
+    report.
+
+    Returns:
+        bool  False if the job had already finished
+    """
+    cancelled = models.Job.objects.filter(
+            id=job_id).exclude(
+                    status__in=models.Job.STATUS_FINAL).update(
+                            status=models.Job.STATUS_CANCELLED,
+                            finished=timezone.now())
+    return cancelled == 1
+
+def execute(job_id):
+    """
+    Claim and run a queued job, saving its result or error.
+    """
+    if not claim(job_id):
+        return
+
+    job = models.Job.objects.get(id=job_id)
+
+    logger.debug("jobs.execute: running job")
+    logger.debug(job_id)
+
+    # Only update jobs still running, a cancellation wins over any result
+    running = models.Job.objects.filter(id=job_id, 
+                                        status=models.Job.STATUS_RUNNING)
+
+    try:
+        result = RUNNERS[job.kind](job_id, json.loads(job.request))
+    except Cancelled:
+        logger.debug("jobs.execute: job cancelled")
+        MonteCarloCheckpoint.for_name(checkpoint_name(job_id)).delete()
+    except Exception as e:
+        logger.exception("jobs.execute: job failed")
+        MonteCarloCheckpoint.for_name(checkpoint_name(job_id)).delete()
+        running.update(
+                status=models.Job.STATUS_FAILED,
+                error=repr(e),
+                finished=timezone.now())
+    else:
+        running.update(
+                status=models.Job.STATUS_DONE,
+                result=json.dumps(result, cls=JSONEncoder),
+                progress=1,
+                finished=timezone.now())
+
+
+
+#
+# Progress event stream
+#
+
+def _event(name, data):
+    return "event: {}\ndata: {}\n\n".format(name, 
+                                              json.dumps(data, cls=JSONEncoder))
+
+def events(job_id, poll=EVENTS_POLL, keepalive=EVENTS_KEEPALIVE, 
+           cancel_on_close=False, max_duration=EVENTS_MAX_DURATION):
+    """
+    Generate Server-Sent Events reporting a job's progress until it finishes.
+
+    A "progress" event carrying the job dict (see formatter.job) is sent
+    whenever its status or progress changes, followed by a final "done",
+    "failed" or "cancelled" event. Streams of jobs still running after
+    max_duration end with a "timeout" event, after which clients reconnect
+    or poll the job's status instead.
+
+    The stream holds a web worker for its whole duration, so serve it from
+    an asynchronous or threaded worker class (e.g. gunicorn gevent or
+    gthread workers), not a small pool of sync workers.
+
+    Arguments:
+        job_id:          UUID   Job to follow
+        poll:            float  Database polling interval (s)
+        keepalive:       float  Interval of keepalive comments while nothing
+                                changes (s)
+        cancel_on_close: bool   Cancel the job if the stream is closed (i.e.
+                                the client disconnects) before it finishes
+        max_duration:    float  Maximum stream duration (s), None for no
+                                limit
+    """
+    last = None
+    last_sent = time.time()
+    start = last_sent
+    finished = False
+
+    try:
+        while True:
+            job = models.Job.objects.get(id=job_id)
+
+            if job.status in models.Job.STATUS_FINAL:
+                finished = True
+                yield _event(job.status, job.to_dict())
+                return
+
+            if max_duration is not None and \
+                    time.time() - start > max_duration:
+                # Ended by the server, not the client: leave the job running
+                finished = True
+                yield _event("timeout", job.to_dict())
+                return
+
+            state = (job.status, job.progress, job.detail)
+            if state != last:
+                last = state
+                last_sent = time.time()
+                yield _event("progress", job.to_dict())
+            elif time.time() - last_sent > keepalive:
+                last_sent = time.time()
+                yield ": keepalive\n\n"
+
+            time.sleep(poll)
+    finally:
+        if cancel_on_close and not finished:
+            cancel(job_id)
+
+
+
+#
+# Backends
+#
+
+class LocalBackend(object):
+    """
+    Run jobs synchronously in the submitting process.
+    """
+
+    def submit(self, job):
+        execute(job.id)
+
+class DatabaseBackend(object):
+    """
+    Leave jobs queued in the database for runfitworker to pick up.
+    """
+
+    def submit(self, job):
+        pass
+
+_backend = None
+
+def get_backend():
+    global _backend
+
+    if _backend is None:
+        config = getattr(settings, "BINDFIT_JOBS", DEFAULT_SETTINGS)
+        cls = import_string(config["BACKEND"])
+        _backend = cls(**config.get("OPTIONS", {}))
+
+    return _backend
+
+
+
+#
+# Worker pool
+#
+
+def _init_process(yield_event):
+    global _yield_event
+    _yield_event = yield_event
+
+    # Forked pool processes must not share the parent's DB connections
+    connections.close_all()
+
+def requeue_orphans(older_than=None):
+    """
+    Return jobs left running by a stopped worker to the queue. Running jobs
+    can't be told apart from orphaned ones, so without older_than this is
+    only safe when no other runfitworker serves the database.
+
+    Arguments:
+        older_than: float  Only requeue jobs started more than this many
+                           seconds ago
+
+    Returns:
+        int  Number of jobs requeued
+    """
+    running = models.Job.objects.filter(status=models.Job.STATUS_RUNNING)
+    if older_than is not None:
+        running = running.filter(
+                started__lt=timezone.now()
+                            - datetime.timedelta(seconds=older_than))
+
+    return running.update(status=models.Job.STATUS_QUEUED,
+                          started=None,
+                          progress=0)
+
+def serve(poll=1.0, requeue=False, requeue_older_than=None, once=False,
+          sched=None):
+    """
+    Run queued jobs on a pool of worker processes until interrupted.
+
+    Arguments:
+        poll:               float     Database polling interval (s)
+        requeue:            bool      Requeue jobs orphaned by a previous
+                                      worker on start (see requeue_orphans)
+        requeue_older_than: float     Only requeue jobs started more than
+                                      this many seconds ago
+        once:               bool      Return when the queue is empty instead
+                                      of polling forever
+        sched:              Scheduler Job scheduler, defaults to one
+                                      configured from
+                                      settings.BINDFIT_SCHEDULER. The pool
+                                      has sched.slots processes.
+    """
+    if sched is None:
+        sched = scheduler.Scheduler.from_settings()
+
+    if requeue:
+        n = requeue_orphans(requeue_older_than)
+        if n:
+            logger.info("jobs.serve: requeued {} orphaned jobs".format(n))
+
+    yield_event = multiprocessing.Event()
+
+    connections.close_all()
+    pool = multiprocessing.Pool(sched.slots, 
+                                initializer=_init_process,
+                                initargs=(yield_event,))
+    running = {}
+
+    try:
+        while True:
+            running = { e: r for e, r in running.items() if not r.ready() }
+
+            if len(running) < sched.slots:
+                queued = models.Job.objects.filter(
+                        status=models.Job.STATUS_QUEUED).exclude(
+                                id__in=[ e.id for e in running ]).order_by(
+                                        "created").values_list(
+                                                "id", "priority", "client")
+
+                for entry in sched.select(
+                        [ scheduler.Entry(*q) for q in queued ], running):
+                    running[entry] = pool.apply_async(execute, (entry.id,))
+
+            if sched.should_yield(running):
+                yield_event.set()
+            else:
+                yield_event.clear()
+
+            if once and not running:
+                break
+
+            time.sleep(poll)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+
+#
+# Monitoring
+#
+
+def stats(window=3600):
+    """
+    Queue depth and wait times per priority class.
+
+    Arguments:
+        window: float  Period over which wait times of started jobs are 
+                       summarised (s)
+
+    Returns:
+        dict  Per class name: queued and running counts, age of the oldest
+              queued job and mean/max wait (created to started) of jobs
+              started within window (s)
+    """
+    now = timezone.now()
+
+    counts = models.Job.objects.filter(
+            status__in=(models.Job.STATUS_QUEUED,
+                        models.Job.STATUS_RUNNING)).values(
+                                "priority", "status").annotate(n=Count("id"))
+
+    response = {}
+    for priority, name in scheduler.PRIORITY_NAMES.items():
+        response[name] = {
+                "queued":       0,
+                "running":      0,
+                "oldest_queued":None,
+                "wait_mean":    None,
+                "wait_max":     None,
+                "started":      0,
+                }
+
+    for c in counts:
+        name = scheduler.PRIORITY_NAMES.get(c["priority"])
+        if name is not None:
+            response[name][c["status"]] = c["n"]
+
+    for priority, name in scheduler.PRIORITY_NAMES.items():
+        oldest = models.Job.objects.filter(
+                status=models.Job.STATUS_QUEUED,
+                priority=priority).order_by("created").values_list(
+                        "created", flat=True)[:1]
+        if oldest:
+            response[name]["oldest_queued"] = (now - oldest[0]).total_seconds()
+
+        started = models.Job.objects.filter(
+                priority=priority,
+                started__gte=now - datetime.timedelta(seconds=window)
+                ).values_list("created", "started")
+        waits = [ (s - c).total_seconds() for c, s in started ]
+        if waits:
+            response[name]["started"]   = len(waits)
+            response[name]["wait_mean"] = sum(waits)/len(waits)
+            response[name]["wait_max"]  = max(waits)
+
+    return response
@@ -0,0 +1,248 @@
+"""
+" Parameter landscape scans
+"
+" Evaluates a fit's sum of squared residuals over a 2D grid of nonlinear
+" parameter values, e.g. (k1, k2) for 1:2 or (ke, rho) for CoEK models, to
+" diagnose ill-conditioned fits. Grid rows are evaluated in chunks with one
+" Workspace per chunk, as jobs on the runfitworker pool for large grids (see
+" batch.map_jobs). Configured by settings.BINDFIT_LANDSCAPE.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+
+import numpy as np
+
+from django.conf import settings
+
+from . import models
+from . import batch
+from . import formatter
+from . import functions
+from .workspace import Workspace
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "MAX_POINTS":   250000, # Maximum grid points per scan (per level)
+        "MAX_REFINE":   3,      # Maximum refined rescans per request
+        "PARALLEL_MIN": 2500,   # Grids smaller than this are evaluated in
+                                # the calling process
+        "CHUNK_ROWS":   8,      # Grid rows per worker task
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_LANDSCAPE", DEFAULT_SETTINGS)
+
+def param_names(fitter_name, flavour=""):
+    """
+    Names of a fitter's parameters for a flavour, from the fitter's default
+    options (see formatter.options).
+    """
+    defaults = formatter.options(fitter_name)
+    names = set(defaults["params"])
+    for f in defaults["options"]["flavour"] or []:
+        if f["key"] == flavour:
+            names -= set(f.get("exclude_params", []))
+    return sorted(names)
+
+def axis_values(axis):
+    """
+    Grid values of an axis dict {name, min, max, n, log}, log spaced if log
+    (default True).
+    """
+    n = int(axis.get("n", 50))
+    if axis.get("log", True):
+        if axis["min"] <= 0:
+            raise ValueError(
+                    "Log axis {} must have a positive minimum".format(
+                        axis["name"]))
+        return np.logspace(np.log10(axis["min"]), np.log10(axis["max"]), n)
+    else:
+        return np.linspace(axis["min"], axis["max"], n)
+
+def scan_rows(args):
+    """
+    Evaluate SSR over a block of grid rows.
+
+    Arguments:
+        args: tuple  (fitter_name, normalise, flavour, x, y, names, index,
+                     a, b, fixed) where names are the model's parameters in
+                     objective (sorted) order, index the positions of the two
+                     axis parameters in names, a and b the first axis values
+                     of this block and the second axis values, and fixed a
+                     dict of the remaining parameter values
+
+    Returns:
+        ndarray  len(a) x len(b) SSR, NaN where the model fails
+    """
+    fitter_name, normalise, flavour, x, y, names, index, a, b, fixed = args
+
+    function = functions.construct(fitter_name,
+                                   normalise=normalise,
+                                   flavour=flavour)
+    ws = Workspace(x, y, normalise=normalise)
+
+    params = np.array([ fixed.get(name, np.nan) for name in names ])
+    ssr = np.empty((len(a), len(b)))
+
+    with np.errstate(all="ignore"):
+        for i, value_a in enumerate(a):
+            params[index[0]] = value_a
+
+            # Alternate row direction so each point starts from its
+            # neighbour's free concentrations (see Workspace.roots)
+            cols = range(len(b)) if i % 2 == 0 else range(len(b)-1, -1, -1)
+            for j in cols:
+                params[index[1]] = b[j]
+                try:
+                    ssr[i,j] = function.objective(params, ws.x, ws.y, True,
+                                                  workspace=ws)
+                except (np.linalg.LinAlgError, ValueError):
+                    ssr[i,j] = np.nan
+                    ws.roots[:] = np.nan
+
+    ssr[~np.isfinite(ssr)] = np.nan
+    return ssr
+
+def scan(fitter_name, x, y, names, axes, fixed=None,
+         normalise=True, flavour=""):
+    """
+    Evaluate SSR over the grid spanned by two axes.
+
+    Arguments:
+        names: list  All model parameter names
+        axes:  list  Two axis dicts, see axis_values
+        fixed: dict  Values of parameters not on an axis
+
+    Returns:
+        (a, b, ssr)  Axis values and len(a) x len(b) SSR array
+    """
+    fixed = fixed or {}
+    names = sorted(names)
+
+    axis_names = [ axis["name"] for axis in axes ]
+    if len(axes) != 2 or len(set(axis_names)) != 2:
+        raise ValueError("Exactly two distinct axes are required")
+    for name in names:
+        if name not in axis_names and name not in fixed:
+            raise ValueError("No axis or fixed value for parameter "+name)
+    for name in axis_names:
+        if name not in names:
+            raise ValueError("Unknown parameter "+name)
+
+    a, b = axis_values(axes[0]), axis_values(axes[1])
+    index = (names.index(axis_names[0]), names.index(axis_names[1]))
+
+    conf = config()
+    if a.size*b.size > conf.get("MAX_POINTS", 250000):
+        raise ValueError("Grid too large")
+
+    step = conf.get("CHUNK_ROWS", 8)
+    tasks = [ (fitter_name, normalise, flavour, x, y, names, index,
+               a[i:i+step], b, fixed)
+              for i in range(0, a.size, step) ]
+
+    if a.size*b.size < conf.get("PARALLEL_MIN", 2500):
+        blocks = [ scan_rows(task) for task in tasks ]
+    else:
+        blocks = list(_scan_jobs(tasks))
+
+    return a, b, np.vstack(blocks)
+
+def _scan_jobs(tasks):
+    # Evaluate scan_rows tasks as jobs on the runfitworker pool
+    keys = ("fitter", "normalise", "flavour", "x", "y", "names", "index",
+            "a", "b", "fixed")
+    requests = [ dict(zip(keys, task)) for task in tasks ]
+
+    for i, job in batch.map_jobs(models.Job.KIND_LANDSCAPE, requests):
+        if job.status != models.Job.STATUS_DONE:
+            raise RuntimeError("Landscape scan job {}: {}".format(
+                job.status, job.error))
+        yield np.array(json.loads(job.result), dtype=np.float64)
+
+def refine_axes(axes, a, b, ssr, valley=0.1):
+    """
+    Axes of a grid zoomed to the valley around the minimum: the bounding box
+    of points within a relative SSR tolerance (valley) of the minimum, padded
+    by one grid step. Same point counts as the given axes.
+
+    Returns:
+        list  Two axis dicts, or None if the grid has no finite values or
+              the window can't shrink further
+    """
+    if not np.any(np.isfinite(ssr)):
+        return None
+
+    ssr_min = np.nanmin(ssr)
+    with np.errstate(invalid="ignore"):
+        rows, cols = np.nonzero(ssr <= ssr_min*(1 + valley))
+
+    refined = []
+    for axis, values, idx in ((axes[0], a, rows), (axes[1], b, cols)):
+        lo = max(idx.min() - 1, 0)
+        hi = min(idx.max() + 1, values.size - 1)
+        refined.append(dict(axis, min=values[lo], max=values[hi]))
+
+    if all(r["min"] == axis["min"] and r["max"] == axis["max"]
+           for r, axis in zip(refined, axes)):
+        return None
+    return refined
+
+def _grid(axes, a, b, ssr):
+    # Compact grid dict for formatter.landscape, null for failed points
+    return {
+            "axes": [ {"name":   axis["name"],
+                       "log":    axis.get("log", True),
+                       "values": values}
+                      for axis, values in zip(axes, (a, b)) ],
+            "ssr":  np.where(np.isfinite(ssr), ssr, None).tolist(),
+            }
+
+def run(fitter_name, x, y, names, axes, fixed=None,
+        normalise=True, flavour="", refine=0, valley=0.1):
+    """
+    Scan the SSR landscape, then optionally rescan refine times zoomed
+    towards the minimum valley (see refine_axes). refine is limited to
+    MAX_REFINE rescans.
+
+    Returns:
+        (grids, minimum)  List of grid dicts (coarsest first), and dict of
+                          lowest SSR found and its parameter values
+                          (including fixed ones), None if no point could be
+                          evaluated
+    """
+    max_refine = config().get("MAX_REFINE", DEFAULT_SETTINGS["MAX_REFINE"])
+    try:
+        refine = int(refine)
+    except (TypeError, ValueError):
+        refine = -1
+    if not 0 <= refine <= max_refine:
+        raise ValueError(
+                "refine must be an integer from 0 to {}".format(max_refine))
+
+    grids = []
+    minimum = None
+
+    for level in range(refine + 1):
+        a, b, ssr = scan(fitter_name, x, y, names, axes, fixed,
+                         normalise, flavour)
+        grids.append(_grid(axes, a, b, ssr))
+
+        if np.any(np.isfinite(ssr)):
+            i, j = np.unravel_index(np.nanargmin(ssr), ssr.shape)
+            if minimum is None or ssr[i,j] < minimum["ssr"]:
+                params = dict(fixed or {})
+                params[axes[0]["name"]] = a[i]
+                params[axes[1]["name"]] = b[j]
+                minimum = {"ssr": ssr[i,j], "params": params}
+
+        axes = refine_axes(axes, a, b, ssr, valley)
+        if axes is None:
+            break
+
+    return grids, minimum
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from bindfit.benchmarks import hotlog, write_report
+
+class Command(BaseCommand):
+    help = ("Benchmark objective and fit overhead of debug logging in the "
+            "numerical core, with tracing off, sampled and on")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fitter",  default="nmr1to2")
+        parser.add_argument("--points",  type=int, default=50)
+        parser.add_argument("--signals", type=int, default=10)
+        parser.add_argument("--number",  type=int, default=200,
+                            help="Evaluations per timing repeat")
+        parser.add_argument("--repeat",  type=int, default=5)
+        parser.add_argument("--output",  default=None,
+                            help="Write JSON report to this path")
+
+    def handle(self, *args, **options):
+        results = hotlog.run(fitter =options["fitter"],
+                             points =options["points"],
+                             signals=options["signals"],
+                             number =options["number"],
+                             repeat =options["repeat"])
+
+        self.stdout.write(hotlog.format_results(results))
+
+        if options["output"]:
+            write_report(results, options["output"])
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bindfit.benchmarks import kernels, write_report
+
+class Command(BaseCommand):
+    help = ("Microbenchmark the equilibrium model functions and objectives, "
+            "with accuracy against extended precision references and "
+            "optional comparison with a baseline report")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kernels",  nargs="+", default=None,
+                            choices=sorted(kernels.KERNELS),
+                            help="Model functions to benchmark "
+                                 "(default: all)")
+        parser.add_argument("--points",   type=int, nargs="+",
+                            default=list(kernels.POINTS))
+        parser.add_argument("--signals",  type=int, nargs="+",
+                            default=list(kernels.SIGNALS),
+                            help="Signals for the objective benchmarks")
+        parser.add_argument("--no-objectives", action="store_true")
+        parser.add_argument("--repeat",   type=int, default=10)
+        parser.add_argument("--warmup",   type=int, default=3)
+        parser.add_argument("--output",   default=None,
+                            help="Write JSON report to this path")
+        parser.add_argument("--baseline", default=None,
+                            help="Compare against this JSON report, failing "
+                                 "if any case is slower or less accurate")
+
+    def handle(self, *args, **options):
+        results = kernels.run(kernels   =options["kernels"],
+                              points    =options["points"],
+                              signals   =options["signals"],
+                              objectives=not options["no_objectives"],
+                              repeat    =options["repeat"],
+                              warmup    =options["warmup"])
+
+        verdicts = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                verdicts = kernels.compare(results, json.load(f))
+
+        self.stdout.write(kernels.format_results(results, verdicts))
+
+        if options["output"]:
+            write_report(results, options["output"])
+
+        if verdicts and any(v["verdict"] != "faster" for v in verdicts):
+            raise CommandError("Slower or less accurate than baseline")
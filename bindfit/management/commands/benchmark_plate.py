@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from bindfit.benchmarks import plate, write_report
+
+class Command(BaseCommand):
+    help = ("Benchmark vectorised plate-mode dose-response fitting against "
+            "looping the single-curve inhibitor fit")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plates",   type=int, nargs="+",
+                            default=list(plate.PLATES),
+                            help="Curves per plate")
+        parser.add_argument("--doses",    type=int, default=12)
+        parser.add_argument("--loop-max", type=int, default=384,
+                            help="Maximum curves fitted in the looped "
+                                 "timing, larger plates are extrapolated")
+        parser.add_argument("--output",   default=None,
+                            help="Write JSON report to this path")
+
+    def handle(self, *args, **options):
+        results = plate.run(plates  =options["plates"],
+                            doses   =options["doses"],
+                            loop_max=options["loop_max"])
+
+        self.stdout.write(plate.format_results(results))
+
+        if options["output"]:
+            write_report(results, options["output"])
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from bindfit.benchmarks import scaling, write_report
+
+class Command(BaseCommand):
+    help = ("Benchmark time and memory of each fit request stage across "
+            "titration point and signal counts, with fitted complexity "
+            "exponents")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fitters",   nargs="+",
+                            default=list(scaling.FITTERS))
+        parser.add_argument("--points",    type=int, nargs="+",
+                            default=list(scaling.POINTS))
+        parser.add_argument("--signals",   type=int, nargs="+",
+                            default=list(scaling.SIGNALS))
+        parser.add_argument("--no-memory", action="store_true",
+                            help="Skip traced allocation measurements "
+                                 "(which run each stage twice)")
+        parser.add_argument("--no-isolate", action="store_true",
+                            help="Run all cases in this process (peak RSS "
+                                 "then only grows)")
+        parser.add_argument("--output",    default=None,
+                            help="Write JSON report to this path")
+
+    def handle(self, *args, **options):
+        results = scaling.run(fitters=options["fitters"],
+                              points =options["points"],
+                              signals=options["signals"],
+                              memory =not options["no_memory"],
+                              isolate=not options["no_isolate"])
+
+        self.stdout.write(scaling.format_results(results))
+
+        if options["output"]:
+            write_report(results, options["output"])
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from bindfit.benchmarks import storage, write_report
+
+class Command(BaseCommand):
+    help = ("Benchmark save and load times and stored size of input data "
+            "arrays as ArrayFields vs. binary blobs")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points",   type=int, nargs="+",
+                            default=list(storage.POINTS))
+        parser.add_argument("--signals",  type=int, nargs="+",
+                            default=list(storage.SIGNALS))
+        parser.add_argument("--database", action="store_true",
+                            help="Also save and load Data rows through the "
+                                 "database (in a rolled back transaction)")
+        parser.add_argument("--number",   type=int, default=20,
+                            help="Calls per timing repeat")
+        parser.add_argument("--output",   default=None,
+                            help="Write JSON report to this path")
+
+    def handle(self, *args, **options):
+        results = storage.run(points  =options["points"],
+                              signals =options["signals"],
+                              database=options["database"],
+                              number  =options["number"])
+
+        self.stdout.write(storage.format_results(results))
+
+        if options["output"]:
+            write_report(results, options["output"])
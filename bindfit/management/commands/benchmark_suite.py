@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bindfit.benchmarks import suite, write_report
+
+class Command(BaseCommand):
+    help = ("Benchmark fitting of noisy bindsim-simulated titrations across "
+            "fitters, binding constants, point and signal counts, optionally "
+            "flagging regressions against a baseline report")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fitters",  nargs="+", default=None,
+                            choices=sorted(suite.PARAMS),
+                            help="Fitters to benchmark (default: all)")
+        parser.add_argument("--points",   type=int, nargs="+",
+                            default=list(suite.POINTS))
+        parser.add_argument("--signals",  type=int, nargs="+",
+                            default=list(suite.SIGNALS))
+        parser.add_argument("--mc-iter",  type=int, default=20,
+                            help="Monte Carlo iterations per case, 0 to skip")
+        parser.add_argument("--noise",    type=float, default=0.005)
+        parser.add_argument("--seed",     type=int, default=0)
+        parser.add_argument("--output",   default=None,
+                            help="Write JSON report to this path")
+        parser.add_argument("--baseline", default=None,
+                            help="Compare against this JSON report, failing "
+                                 "if any case regressed")
+        parser.add_argument("--time-tolerance", type=float, default=1.25,
+                            help="Flag times above this multiple of "
+                                 "baseline")
+
+    def handle(self, *args, **options):
+        results = suite.run(fitters =options["fitters"],
+                            points  =options["points"],
+                            signals =options["signals"],
+                            mc_iter =options["mc_iter"],
+                            noise   =options["noise"],
+                            seed    =options["seed"])
+
+        regressions = None
+        if options["baseline"]:
+            regressions = suite.compare(
+                    results,
+                    suite.load_report(options["baseline"]),
+                    time_tolerance=options["time_tolerance"])
+
+        self.stdout.write(suite.format_results(results, regressions))
+
+        if options["output"]:
+            write_report({"results":     results,
+                          "regressions": regressions}, options["output"])
+
+        if regressions:
+            raise CommandError("{} regression(s) against baseline".format(
+                len(regressions)))
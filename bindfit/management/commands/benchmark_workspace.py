@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from bindfit.benchmarks import workspace, write_report
+
+class Command(BaseCommand):
+    help = ("Benchmark objective evaluation throughput and per-evaluation "
+            "allocations with and without a preallocated Workspace")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points",  type=int, default=50)
+        parser.add_argument("--signals", type=int, default=10)
+        parser.add_argument("--number",  type=int, default=200,
+                            help="Evaluations per timing repeat")
+        parser.add_argument("--repeat",  type=int, default=5)
+        parser.add_argument("--output",  default=None,
+                            help="Write JSON report to this path")
+
+    def handle(self, *args, **options):
+        results = workspace.run(points =options["points"],
+                                signals=options["signals"],
+                                number =options["number"],
+                                repeat =options["repeat"])
+
+        self.stdout.write(workspace.format_results(results))
+
+        if options["output"]:
+            write_report(results, options["output"])
@@ -0,0 +1,53 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bindfit import profiling
+
+class Command(BaseCommand):
+    help = ("List stored request profiles, or summarise profiles by "
+            "cumulative (or other) time")
+
+    def add_arguments(self, parser):
+        parser.add_argument("ids", nargs="*",
+                            help="Profile (request) ids to summarise "
+                                 "together")
+        parser.add_argument("--match", default=None,
+                            help="Summarise all profiles whose path or view "
+                                 "contains this string")
+        parser.add_argument("--sort",  default="cumulative",
+                            help="pstats sort key, e.g. cumulative, tottime, "
+                                 "ncalls")
+        parser.add_argument("--limit", type=int, default=30,
+                            help="Functions to show")
+
+    def handle(self, *args, **options):
+        profiles = profiling.stored()
+
+        ids = list(options["ids"])
+        if options["match"]:
+            ids.extend(p["id"] for p in profiles
+                       if options["match"] in p["path"]
+                       or options["match"] in p["view"])
+
+        if not ids:
+            self.stdout.write("{:<34} {:<19} {:<6} {:>9} {:>6}  {}".format(
+                "id", "time", "method", "time (s)", "status", "path"))
+            for p in profiles:
+                self.stdout.write(
+                    "{:<34} {:<19} {:<6} {:>9.3f} {:>6}  {}".format(
+                        p["id"],
+                        datetime.datetime.fromtimestamp(
+                            p["time"]).strftime("%Y-%m-%d %H:%M:%S"),
+                        p["method"],
+                        p["duration"],
+                        p["status"],
+                        p["path"]))
+            return
+
+        try:
+            self.stdout.write(profiling.summarise(ids,
+                                                  sort =options["sort"],
+                                                  limit=options["limit"]))
+        except (IOError, OSError) as e:
+            raise CommandError(str(e))
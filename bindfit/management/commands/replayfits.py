@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from bindfit import capture
+from bindfit.benchmarks import write_report
+
+class Command(BaseCommand):
+    help = ("Replay captured slow fits against the current code, reporting "
+            "time and result differences")
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*",
+                            help="Case files or directories of cases "
+                                 "(default: BINDFIT_CAPTURE PATH)")
+        parser.add_argument("--processes", type=int, default=1,
+                            help="Replay cases in parallel on this many "
+                                 "processes")
+        parser.add_argument("--output",    default=None,
+                            help="Write JSON report to this path")
+
+    def handle(self, *args, **options):
+        paths = capture.case_paths(options["paths"])
+        if not paths:
+            self.stdout.write("No captured cases found")
+            return
+
+        reports = capture.replay_all(paths, processes=options["processes"])
+
+        self.stdout.write(capture.format_results(reports))
+
+        if options["output"]:
+            write_report(reports, options["output"])
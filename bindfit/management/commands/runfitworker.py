@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from django.conf import settings
+
+from bindfit import jobs
+from bindfit import scheduler
+
+class Command(BaseCommand):
+    help = ("Run queued asynchronous fit jobs on a local worker process "
+            "pool, in priority order")
+
+    def add_arguments(self, parser):
+        config = getattr(settings, "BINDFIT_JOBS", jobs.DEFAULT_SETTINGS)
+
+        parser.add_argument("--cpu-budget", type=int, default=None,
+                            help="Worker slots for non-interactive jobs "
+                                 "(default: BINDFIT_SCHEDULER CPU_BUDGET)")
+        parser.add_argument("--interactive-slots", type=int, default=None,
+                            help="Extra worker slots reserved for "
+                                 "interactive fits")
+        parser.add_argument("--poll",      type=float,
+                            default=config.get("POLL", 1.0),
+                            help="Queue polling interval (s)")
+        parser.add_argument("--requeue",   action="store_true",
+                            help="Requeue jobs left running by a previous "
+                                 "worker. Also requeues jobs other live "
+                                 "workers are running, only use it when "
+                                 "this is the only worker, or with "
+                                 "--requeue-older-than")
+        parser.add_argument("--requeue-older-than", type=float,
+                            default=None, metavar="SECONDS",
+                            help="Requeue only running jobs started more "
+                                 "than this long ago (implies --requeue)")
+        parser.add_argument("--once",      action="store_true",
+                            help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        sched = scheduler.Scheduler.from_settings()
+        if options["cpu_budget"] is not None:
+            sched.cpu_budget = options["cpu_budget"]
+        if options["interactive_slots"] is not None:
+            sched.interactive_slots = options["interactive_slots"]
+
+        older_than = options["requeue_older_than"]
+        jobs.serve(poll              =options["poll"],
+                   requeue           =options["requeue"] or
+                                      older_than is not None,
+                   requeue_older_than=older_than,
+                   once              =options["once"],
+                   sched             =sched)
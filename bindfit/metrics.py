@@ -0,0 +1,316 @@
+"""
+" Prometheus-style metrics
+"
+" Each process keeps its counters and histograms in memory and periodically
+" writes them to its own file (<pid>.json) in a directory shared by all WSGI
+" and worker processes on the host. The metrics endpoint sums the files of
+" all processes, past and present, and renders them in the Prometheus text
+" exposition format. Configured by settings.BINDFIT_METRICS.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+
+from django.conf import settings
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "PATH":           os.path.join(getattr(settings, "BINDFIT_VAR_DIR",
+                                               "var"), "metrics"),
+        "FLUSH_INTERVAL": 5,         # Seconds between writes of a process'
+                                     # metrics file
+        "MAX_AGE":        7*24*3600, # Files not written for this many
+                                     # seconds are removed
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_METRICS", DEFAULT_SETTINGS)
+
+BUCKETS_REQUEST = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+BUCKETS_FIT     = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+# Name: (type, help, histogram buckets)
+METRICS = {
+        "bindfit_http_request_duration_seconds": (
+            "histogram", "Request latency by route", BUCKETS_REQUEST),
+        "bindfit_fit_duration_seconds": (
+            "histogram", "Fit (optimisation and statistics) duration by "
+                         "fitter, method and flavour", BUCKETS_FIT),
+        "bindfit_objective_evaluations_total": (
+            "counter", "Objective function evaluations by fitter", None),
+        "bindfit_mc_iterations_total": (
+            "counter", "Completed Monte Carlo iterations", None),
+        "bindfit_fit_cache_requests_total": (
+            "counter", "Fit cache lookups by result (hit or miss)", None),
+        "bindfit_data_cache_requests_total": (
+            "counter", "Parsed input data cache lookups by result (hit or "
+                       "miss)", None),
+        }
+
+class Registry(object):
+    """
+    Metrics of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid        = os.getpid()
+        self.counters   = {} # (name, labels): value
+        self.histograms = {} # (name, labels): [bucket counts..., sum, count]
+        self._flushed   = 0
+
+    def _check_fork(self):
+        # A forked child starts empty, its parent's values are in the
+        # parent's file
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0]*(len(buckets) + 2)
+            for i, le in enumerate(buckets):
+                if value <= le:
+                    h[i] += 1
+                    break
+            h[-2] += value
+            h[-1] += 1
+        self.maybe_flush()
+
+    def to_dict(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                    "counters":   [ [name, dict(labels), value]
+                                    for (name, labels), value
+                                    in self.counters.items() ],
+                    "histograms": [ [name, dict(labels), list(h)]
+                                    for (name, labels), h
+                                    in self.histograms.items() ],
+                    }
+
+    def maybe_flush(self, force=False):
+        now = time.time()
+        if force or now - self._flushed >= config().get("FLUSH_INTERVAL", 5):
+            self._flushed = now
+            try:
+                self.flush()
+            except (IOError, OSError):
+                logger.exception("metrics.Registry: flush failed")
+
+    def flush(self):
+        """
+        Write this process' metrics file.
+        """
+        path = config().get("PATH", DEFAULT_SETTINGS["PATH"])
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        data = self.to_dict()
+        if not data["counters"] and not data["histograms"]:
+            return
+
+        fd, tmp = tempfile.mkstemp(dir=path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.rename(tmp, os.path.join(path, "{}.json".format(self.pid)))
+
+_registry = Registry()
+atexit.register(lambda: _registry.maybe_flush(force=True))
+
+def inc(name, value=1, **labels):
+    _registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    _registry.observe(name, value, **labels)
+
+
+
+#
+# Aggregation and exposition
+#
+
+def collect():
+    """
+    Sum the metrics files of all processes (flushing this process' first).
+
+    Returns:
+        (counters, histograms)  Dicts keyed by (name, labels) tuples
+    """
+    _registry.maybe_flush(force=True)
+
+    conf = config()
+    path = conf.get("PATH", DEFAULT_SETTINGS["PATH"])
+    max_age = conf.get("MAX_AGE", DEFAULT_SETTINGS["MAX_AGE"])
+
+    counters   = {}
+    histograms = {}
+
+    if not os.path.isdir(path):
+        return counters, histograms
+
+    now = time.time()
+    for name in os.listdir(path):
+        p = os.path.join(path, name)
+        try:
+            if now - os.stat(p).st_mtime > max_age:
+                os.remove(p)
+                continue
+            if not name.endswith(".json"):
+                continue
+            with open(p) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+
+        for metric, labels, value in data["counters"]:
+            key = (metric, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for metric, labels, h in data["histograms"]:
+            key = (metric, tuple(sorted(labels.items())))
+            total = histograms.get(key)
+            if total is None or len(total) != len(h):
+                histograms[key] = list(h)
+            else:
+                histograms[key] = [ a + b for a, b in zip(total, h) ]
+
+    return counters, histograms
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{"+",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\")
+                                                  .replace('"', '\\"')
+                                                  .replace("\n", "\\n"))
+                        for k, v in items)+"}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(gauges=None, collected=None):
+    """
+    Render all processes' metrics, and any extra gauges, in the Prometheus
+    text exposition format.
+
+    Arguments:
+        gauges:    list   (name, help, {labels tuple: value}) gauges computed
+                          at scrape time
+        collected: tuple  Result of collect(), if already called
+
+    Returns:
+        string
+    """
+    counters, histograms = collected or collect()
+    lines = []
+
+    for name in sorted(METRICS):
+        kind, help, buckets = METRICS[name]
+        samples = counters if kind == "counter" else histograms
+        keys = sorted(k for k in samples if k[0] == name)
+        if not keys:
+            continue
+
+        lines.append("# HELP {} {}".format(name, help))
+        lines.append("# TYPE {} {}".format(name, kind))
+
+        for key in keys:
+            labels = key[1]
+            if kind == "counter":
+                lines.append("{}{} {}".format(name, _labels(labels),
+                                              _number(samples[key])))
+                continue
+
+            h = samples[key]
+            cumulative = 0
+            for le, n in zip(buckets, h[:-2]):
+                cumulative += n
+                lines.append("{}_bucket{} {}".format(
+                    name, _labels(labels, [("le", _number(le))]), cumulative))
+            # Observations above the last bucket only count in +Inf
+            lines.append("{}_bucket{} {}".format(
+                    name, _labels(labels, [("le", "+Inf")]), h[-1]))
+            lines.append("{}_sum{} {}".format(name, _labels(labels),
+                                              _number(h[-2])))
+            lines.append("{}_count{} {}".format(name, _labels(labels),
+                                                _number(h[-1])))
+
+    for name, help, values in gauges or []:
+        lines.append("# HELP {} {}".format(name, help))
+        lines.append("# TYPE {} gauge".format(name))
+        for labels, value in sorted(values.items()):
+            lines.append("{}{} {}".format(name, _labels(labels),
+                                          _number(value)))
+
+    return "\n".join(lines)+"\n"
+
+def fit_cache_hit_ratio(counters):
+    # Hit ratio of all processes' fit cache lookups, None before any
+    hits = misses = 0
+    for (name, labels), value in counters.items():
+        if name == "bindfit_fit_cache_requests_total":
+            if dict(labels).get("result") == "hit":
+                hits += value
+            else:
+                misses += value
+    return hits/(hits + misses) if hits + misses else None
+
+
+
+#
+# Middleware
+#
+
+class MetricsMiddleware(object):
+    """
+    Record request latency by route (the resolved view, as URL names aren't
+    unique). Place first in MIDDLEWARE_CLASSES to include all other
+    middleware.
+    """
+
+    def process_request(self, request):
+        request._metrics_start = time.perf_counter()
+
+    def process_response(self, request, response):
+        start = getattr(request, "_metrics_start", None)
+        if start is None:
+            return response
+
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            route = "{}.{}".format(match.func.__module__, match.func.__name__)
+        else:
+            route = "unmatched"
+
+        observe("bindfit_http_request_duration_seconds",
+                time.perf_counter() - start,
+                route=route,
+                method=request.method,
+                status="{}xx".format(response.status_code//100))
+        return response
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bindfit', '0010_auto_20160602_1510'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, default=uuid.uuid4, serialize=False, editable=False)),
+                ('kind', models.CharField(max_length=20)),
+                ('status', models.CharField(default='queued', max_length=20, db_index=True)),
+                ('request', models.TextField()),
+                ('result', models.TextField(null=True, blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('progress', models.FloatField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True, blank=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bindfit', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='client',
+            field=models.CharField(max_length=100, blank=True),
+        ),
+    ]
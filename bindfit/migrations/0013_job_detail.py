@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bindfit', '0012_job_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='detail',
+            field=models.TextField(blank=True),
+        ),
+    ]
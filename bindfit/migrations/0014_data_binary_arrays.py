@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.contrib.postgres.fields
+
+import io
+import zlib
+
+import numpy as np
+
+
+# Frozen copy of the bindfit.arraycodec format at the time of this migration
+# (uncompressed little-endian float64 .npy, or zlib compressed with a ZNPY
+# prefix), so later codec changes don't change what it does
+
+def encode(array):
+    f = io.BytesIO()
+    np.lib.format.write_array(f, np.ascontiguousarray(array, dtype="<f8"),
+                              version=(1, 0), allow_pickle=False)
+    return f.getvalue()
+
+
+def decode(blob):
+    blob = bytes(blob)
+    if blob.startswith(b"ZNPY"):
+        blob = zlib.decompress(blob[4:])
+    return np.lib.format.read_array(io.BytesIO(blob), allow_pickle=False)
+
+
+def encode_arrays(apps, schema_editor):
+    # Move existing x and y arrays to binary storage. New rows are written
+    # as configured by settings.BINDFIT_DATA_STORAGE, and rows in either
+    # format can be read.
+    Data = apps.get_model("bindfit", "Data")
+    rows = Data.objects.filter(x_blob__isnull=True).only("id", "x", "y")
+    for data in rows.iterator():
+        data.x_blob = encode(np.array(data.x))
+        data.y_blob = encode(np.array(data.y))
+        data.x = None
+        data.y = None
+        data.save(update_fields=["x", "y", "x_blob", "y_blob"])
+
+
+def decode_arrays(apps, schema_editor):
+    Data = apps.get_model("bindfit", "Data")
+    rows = Data.objects.filter(x_blob__isnull=False).only("id", "x_blob",
+                                                          "y_blob")
+    for data in rows.iterator():
+        data.x = decode(data.x_blob).tolist()
+        data.y = decode(data.y_blob).tolist()
+        data.x_blob = None
+        data.y_blob = None
+        data.save(update_fields=["x", "y", "x_blob", "y_blob"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bindfit', '0013_job_detail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='data',
+            name='x',
+            field=django.contrib.postgres.fields.ArrayField(base_field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None), size=None, null=True, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='data',
+            name='y',
+            field=django.contrib.postgres.fields.ArrayField(base_field=django.contrib.postgres.fields.ArrayField(base_field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None), size=None), size=None, null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='x_blob',
+            field=models.BinaryField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='y_blob',
+            field=models.BinaryField(null=True, blank=True),
+        ),
+        migrations.RunPython(encode_arrays, decode_arrays),
+    ]
@@ -7,13 +7,16 @@ from django.contrib.postgres.fields import ArrayField, HStoreField
 import numpy as np
 import hashlib
 import uuid
+import json
 
 # For Excel read handling
 from xlrd import open_workbook
 
+from . import arraycodec
 from . import formatter 
 from . import functions 
 from . import helpers 
+from . import scheduler
 
 import logging
 logger = logging.getLogger('supramolecular')
@@ -24,7 +27,8 @@ class Data(models.Model):
 
     # 2D array of input x value fields (eg: [H]0 and [G]0 for NMR 1:1)
     x = ArrayField(
-            ArrayField(models.FloatField())
+            ArrayField(models.FloatField()),
+            null=True, blank=True
             )
 
     # 3D array of variable length 2D input y value fields 
@@ -32,9 +36,15 @@ class Data(models.Model):
     y = ArrayField(
             ArrayField(
                 ArrayField(models.FloatField())
-                )
+                ),
+            null=True, blank=True
             )
 
+    # x and y encoded by arraycodec, used instead of the ArrayFields above
+    # when set (see settings.BINDFIT_DATA_STORAGE)
+    x_blob = models.BinaryField(null=True, blank=True)
+    y_blob = models.BinaryField(null=True, blank=True)
+
     # Parsed header labels for each value
     labels_x = ArrayField(models.CharField(max_length=100, blank=True))
     labels_y = ArrayField(models.CharField(max_length=100, blank=True))
@@ -106,23 +116,58 @@ class Data(models.Model):
         nx = fmt["x"]
 
         x_labels = list(header[0:nx])
-        x_raw = array[:,0:nx]
-        x = [ list(x_raw[:,col]) for col in range(x_raw.shape[1]) ]
+        x = array[:,0:nx].T
 
         y_labels = list(header[nx:])
-        y_raw = array[:,nx:]
         # Add 3rd dimension to y for consistency w/ true 3D y inputs
-        y = [[ list(y_raw[:,col]) for col in range(y_raw.shape[1]) ]]
+        y = array[:,nx:].T[np.newaxis]
 
         logger.debug("Data.from_np: x and y array shapes")
-        logger.debug(np.array(x).shape)
-        logger.debug(np.array(y).shape)
+        logger.debug(x.shape)
+        logger.debug(y.shape)
 
-        return cls(id=id, x=x, y=y, labels_x=x_labels, labels_y=y_labels)
+        return cls.from_arrays(id, x, y, x_labels, y_labels)
 
-    def to_dict(self, fitter, dilute=False):
-        x = np.array(self.x)
-        y = np.array(self.y)[0]
+    @classmethod
+    def from_arrays(cls, id, x, y, labels_x, labels_y, storage=None,
+                    compress=None):
+        # Store x and y in the given or configured format (binary or array),
+        # see arraycodec
+        if storage is None:
+            storage = arraycodec.config().get(
+                    "FORMAT", arraycodec.DEFAULT_SETTINGS["FORMAT"])
+        if storage == "binary":
+            return cls(id=id,
+                       x_blob=arraycodec.encode(x, compress),
+                       y_blob=arraycodec.encode(y, compress),
+                       labels_x=labels_x, labels_y=labels_y)
+
+        return cls(id=id, x=np.asarray(x).tolist(), y=np.asarray(y).tolist(),
+                   labels_x=labels_x, labels_y=labels_y)
+
+    def x_array(self):
+        if self.x_blob is not None:
+            return arraycodec.decode(self.x_blob)
+        return np.array(self.x)
+
+    def y_array(self, block=None):
+        # block selects one of the 2D y arrays, default all (3D array)
+        if self.y_blob is not None:
+            y = arraycodec.decode(self.y_blob)
+            return y if block is None else y[block]
+        return np.array(self.y if block is None else self.y[block])
+
+    def save(self, *args, **kwargs):
+        super(Data, self).save(*args, **kwargs)
+        # Labels may have changed on re-upload of the same array
+        # (datacache imports this module)
+        from . import datacache
+        datacache.get_cache().invalidate(self.id)
+
+    def arrays(self, fitter, dilute=False, block=0):
+        # block selects one of the 2D y arrays stored in y
+        x = self.x_array()
+        y = self.y_array(block)
 
         # Calculate x values for plotting
         x_plot = functions.construct(fitter).format_x(x)
@@ -131,6 +176,10 @@ class Data(models.Model):
         if dilute:
             y = helpers.dilute(x[0], y)
 
+        return x, x_plot, y
+
+    def to_dict(self, fitter, dilute=False, block=0):
+        x, x_plot, y = self.arrays(fitter, dilute=dilute, block=block)
         return formatter.data(self.id, x, x_plot, y, self.labels_x, self.labels_y)
 
 class Fit(models.Model):
@@ -224,6 +273,9 @@ class Fit(models.Model):
 
 
     def to_dict(self):
+        # Imported here, datacache imports this module
+        from . import datacache
+
         meta_dict = {
             "author":    self.meta_author,
             "name":      self.meta_name,
@@ -286,7 +338,7 @@ class Fit(models.Model):
                                   fit_params_stderr) }
                        
             response = formatter.fit(fitter      =self.fitter_name,
-                                     data        =self.data.to_dict(self.fitter_name, self.options_dilute),
+                                     data        =datacache.get(self.data_id, self.fitter_name, self.options_dilute),
                                      y           =self.fit_y, 
                                      params      =params, 
                                      residuals   =self.qof_residuals,
@@ -305,7 +357,7 @@ class Fit(models.Model):
         else:
             # No fit, return only saved input data
             response = formatter.fit(self.fitter_name,
-                                     self.data.to_dict(self.fitter_name, self.options_dilute),
+                                     datacache.get(self.data_id, self.fitter_name, self.options_dilute),
                                      no_fit=self.no_fit,
                                      meta_dict=meta_dict,
                                      )
@@ -321,3 +373,64 @@ class Fit(models.Model):
                                          self.meta_author, 
                                          self.meta_timestamp)
         return response
+
+class Job(models.Model):
+    # Asynchronous fit/Monte Carlo calculation, see jobs.py
+    KIND_FIT       = "fit"
+    KIND_MC        = "mc"
+    # Parts of synchronous requests run on the worker pool, see batch.py
+    KIND_BATCH     = "batch"
+    KIND_LANDSCAPE = "landscape"
+
+    STATUS_QUEUED    = "queued"
+    STATUS_RUNNING   = "running"
+    STATUS_DONE      = "done"
+    STATUS_FAILED    = "failed"
+    STATUS_CANCELLED = "cancelled"
+
+    # Statuses of finished jobs
+    STATUS_FINAL = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    kind   = models.CharField(max_length=20)
+    status = models.CharField(max_length=20, default=STATUS_QUEUED, 
+                              db_index=True)
+
+    # Scheduling class (see scheduler.py) and submitting client for fair
+    # share
+    priority = models.PositiveSmallIntegerField(default=0, db_index=True)
+    client   = models.CharField(max_length=100, blank=True)
+
+    # Batch submitted asynchronously as a whole (see batch.submit), None for
+    # other jobs
+    batch = models.UUIDField(blank=True, null=True, db_index=True)
+
+    # JSON serialised request body (FitView or FitMonteCarloView input, or
+    # a batch item or landscape block) and response body
+    request = models.TextField()
+    result  = models.TextField(blank=True, null=True)
+    error   = models.TextField(blank=True)
+
+    # Fraction of calculation completed, 0-1
+    progress = models.FloatField(default=0)
+    # JSON serialised latest progress report (iteration, elapsed time, 
+    # current estimates), see jobs.Progress
+    detail   = models.TextField(blank=True)
+
+    created  = models.DateTimeField(auto_now_add=True)
+    started  = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def to_dict(self):
+        return formatter.job(self.id,
+                             self.kind,
+                             self.status,
+                             scheduler.PRIORITY_NAMES.get(self.priority),
+                             self.client,
+                             self.progress,
+                             json.loads(self.detail) if self.detail else None,
+                             self.created,
+                             self.started,
+                             self.finished,
+                             self.error)
@@ -0,0 +1,69 @@
+"""
+" Trace logging for the numerical core
+"
+" Objective and model functions run thousands of times per fit, so their
+" debug logging is guarded by a plain flag instead of relying on the logger
+" level:
+"
+"     if numtrace.on:
+"         logger.debug(...)
+"
+" costs one attribute lookup when tracing is off, with no argument
+" evaluation or logging calls. When enabled, objectives call tick() once per
+" evaluation and on is set for every Nth evaluation only. Per-fit logging
+" of full arrays (outside objectives) is guarded by enabled. Configured by
+" settings.BINDFIT_NUMTRACE, or at runtime with configure().
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+DEFAULT_SETTINGS = {
+        "ENABLED": False,
+        "EVERY":   100,   # Log every Nth objective evaluation
+        }
+
+# Tracing enabled, checked before tick()
+enabled = False
+# Current evaluation is traced, checked before logging
+on = False
+
+_every = 1
+_n = 0
+
+def configure(enable=False, every=1):
+    """
+    Enable or disable tracing at runtime.
+
+    Arguments:
+        enable: bool  Trace the numerical core
+        every:  int   Trace every Nth objective evaluation, 1 for all
+    """
+    global enabled, on, _every, _n
+    enabled = bool(enable)
+    on      = False
+    _every  = max(int(every), 1)
+    _n      = 0
+
+def tick():
+    """
+    Count an objective evaluation and decide whether to trace it. Only call
+    if enabled.
+    """
+    global _n, on
+    _n += 1
+    on = _n % _every == 0
+
+def _configure_from_settings():
+    try:
+        config = getattr(settings, "BINDFIT_NUMTRACE", DEFAULT_SETTINGS)
+    except ImproperlyConfigured:
+        config = DEFAULT_SETTINGS
+
+    configure(enable=config.get("ENABLED", False),
+              every=config.get("EVERY", DEFAULT_SETTINGS["EVERY"]))
+
+_configure_from_settings()
@@ -0,0 +1,286 @@
+"""
+" Plate-mode dose-response fitting
+"
+" Fits many dose-response curves at once with a vectorised Levenberg-Marquardt
+" damped Gauss-Newton solver. All curves are evaluated together as stacked
+" arrays, each curve has its own damping factor, and converged curves are
+" masked out of further iterations.
+"
+" The model is the four parameter logistic (4PL) Hill equation
+"
+"   y = bottom + (top - bottom)/(1 + 10**((logIC50 - x)*hillslope))
+"
+" with x the log inhibitor concentration. By default bottom and top are fixed
+" at 0 and 100, giving the two parameter model of functions.inhibitor_response.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from scipy.special import expit
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+LN10 = np.log(10)
+
+# Parameter order in the solver's parameter arrays
+PARAMS = ("logic50", "hillslope", "bottom", "top")
+
+# Result flags (bitmask)
+FLAG_MAX_ITER     = 1 # Did not converge within max_iter, or damping ran out
+FLAG_SINGULAR     = 2 # Singular normal matrix, errors unavailable
+FLAG_EXTRAPOLATED = 4 # logIC50 outside the tested dose range
+FLAG_INSUFFICIENT = 8 # Fewer finite responses than fitted parameters + 1
+
+FLAGS = {
+        "max_iter":     FLAG_MAX_ITER,
+        "singular":     FLAG_SINGULAR,
+        "extrapolated": FLAG_EXTRAPOLATED,
+        "insufficient": FLAG_INSUFFICIENT,
+        }
+
+def response(p, x):
+    """
+    Evaluate 4PL curves.
+
+    Arguments:
+        p: array  c x 4 parameters (see PARAMS) for c curves
+        x: array  c x n log doses
+
+    Returns:
+        array  c x n responses
+    """
+    w = _weight(p, x)
+    return p[:,2,np.newaxis] + (p[:,3] - p[:,2])[:,np.newaxis]*w
+
+def _weight(p, x):
+    # 1/(1 + 10**z) without overflow for large |z|
+    z = (p[:,0,np.newaxis] - x)*p[:,1,np.newaxis]
+    return expit(-LN10*z)
+
+def _jacobian(p, x, free):
+    """
+    Response and Jacobian with respect to the free parameters.
+
+    Returns:
+        tuple  (c x n responses, c x n x k Jacobian)
+    """
+    w = _weight(p, x)
+    span = (p[:,3] - p[:,2])[:,np.newaxis]
+    y = p[:,2,np.newaxis] + span*w
+
+    # d(w)/d(z) = -ln10 w (1 - w)
+    dw = -LN10*w*(1 - w)*span
+
+    columns = {
+            0: dw*p[:,1,np.newaxis],              # d/d logIC50
+            1: dw*(p[:,0,np.newaxis] - x),        # d/d hillslope
+            2: 1 - w,                             # d/d bottom
+            3: w,                                 # d/d top
+            }
+
+    J = np.stack([ columns[i] for i in free ], axis=-1)
+    return y, J
+
+def initial_params(x, y, bottom=0., top=100.):
+    """
+    Estimate initial parameters: logIC50 from the dose nearest the response
+    midpoint and a unit Hill slope signed by the overall trend.
+    """
+    c = y.shape[0]
+    p = np.empty((c, 4))
+
+    mid = (bottom + top)/2
+    # NaN responses (missing wells) never nearest
+    distance = np.where(np.isfinite(y), np.abs(y - mid), np.inf)
+    nearest = np.argmin(distance, axis=1)
+    p[:,0] = x[np.arange(c), nearest]
+
+    # Sign of response trend with dose
+    xc = x - np.nanmean(np.where(np.isfinite(y), x, np.nan), axis=1)[:,np.newaxis]
+    trend = np.nansum(xc*(y - np.nanmean(y, axis=1)[:,np.newaxis]), axis=1)
+    p[:,1] = np.where(trend*(top - bottom) >= 0, 1., -1.)
+
+    p[:,2] = bottom
+    p[:,3] = top
+
+    return p
+
+def fit(x, y, fit_bottom=False, fit_top=False, bottom=0., top=100.,
+        p0=None, max_iter=100, tol=1e-10):
+    """
+    Fit dose-response curves.
+
+    Arguments:
+        x:          array  n log doses shared by all curves, or c x n
+        y:          array  c x n responses, NaN for missing wells
+        fit_bottom: bool   Fit lower asymptote, otherwise fixed at bottom
+        fit_top:    bool   Fit upper asymptote, otherwise fixed at top
+        bottom:     float  Fixed (or initial) lower asymptote
+        top:        float  Fixed (or initial) upper asymptote
+        p0:         array  Optional c x 4 initial parameters (see PARAMS)
+        max_iter:   int    Maximum iterations per curve
+        tol:        float  Relative SSR change and step size convergence
+                           tolerance
+
+    Returns:
+        dict  Columnar results, see format_results
+    """
+    y = np.atleast_2d(np.asarray(y, dtype="float64"))
+    c, n = y.shape
+    x = np.broadcast_to(np.asarray(x, dtype="float64"), (c, n))
+
+    free = [0, 1] + ([2] if fit_bottom else []) + ([3] if fit_top else [])
+    k = len(free)
+
+    p = initial_params(x, y, bottom, top) if p0 is None \
+        else np.array(p0, dtype="float64")
+
+    # Missing wells contribute zero residual and zero Jacobian
+    valid = np.isfinite(y)
+    y0 = np.where(valid, y, 0.)
+    n_valid = valid.sum(axis=1)
+
+    flags = np.where(n_valid < k + 1, FLAG_INSUFFICIENT, 0)
+    lam = np.full(c, 1e-3)
+    n_iter = np.zeros(c, dtype=int)
+
+    r = np.where(valid, response(p, x) - y0, 0.)
+    ssr = np.einsum("cn,cn->c", r, r)
+
+    # Curves still iterating
+    active = flags == 0
+    converged = np.zeros(c, dtype=bool)
+
+    for it in range(max_iter):
+        idx = np.flatnonzero(active)
+        if not idx.size:
+            break
+
+        pa, xa, va = p[idx], x[idx], valid[idx]
+
+        fa, J = _jacobian(pa, xa, free)
+        J *= va[:,:,np.newaxis]
+        ra = np.where(va, fa - y0[idx], 0.)
+
+        JTJ = np.einsum("cnp,cnq->cpq", J, J)
+        JTr = np.einsum("cnp,cn->cp", J, ra)
+
+        # Levenberg-Marquardt damping of the diagonal
+        diag = np.einsum("cpp->cp", JTJ)
+        A = JTJ + (lam[idx,np.newaxis]*diag)[:,:,np.newaxis]*np.eye(k)
+
+        singular = np.zeros(idx.size, dtype=bool)
+        try:
+            step = -np.linalg.solve(A, JTr[:,:,np.newaxis])[:,:,0]
+        except np.linalg.LinAlgError:
+            # Solve curves individually, NaN steps are never accepted
+            step = np.full((idx.size, k), np.nan)
+            for i in range(idx.size):
+                try:
+                    step[i] = -np.linalg.solve(A[i], JTr[i])
+                except np.linalg.LinAlgError:
+                    singular[i] = True
+
+        p_new = pa.copy()
+        p_new[:,free] += step
+
+        r_new = np.where(va, response(p_new, xa) - y0[idx], 0.)
+        ssr_new = np.einsum("cn,cn->c", r_new, r_new)
+
+        # Accept improving steps, adapt damping per curve
+        with np.errstate(invalid="ignore"):
+            better = ssr_new < ssr[idx]
+        accept = idx[better]
+        p[accept]   = p_new[better]
+        lam[accept] = np.maximum(lam[accept]/10, 1e-12)
+        lam[idx[~better]] = np.minimum(lam[idx[~better]]*10, 1e12)
+
+        # Convergence: negligible step with negligible SSR improvement (or
+        # none possible), or exact fit
+        d_ssr = np.where(better, ssr[idx] - ssr_new, 0.)
+        small_ssr  = d_ssr <= tol*ssr[idx]
+        with np.errstate(invalid="ignore"):
+            small_step = (np.abs(step) <=
+                          tol**0.5*(np.abs(pa[:,free]) + tol**0.5)).all(axis=1)
+        done = (small_step & small_ssr) | (ssr_new <= 1e-300)
+        done &= ~singular
+
+        # Damping exhausted without converging: stuck, stop iterating and
+        # flag as FLAG_MAX_ITER
+        stuck = (lam[idx] >= 1e12) & ~done & ~singular
+        active[idx[stuck]] = False
+
+        ssr[accept] = ssr_new[better]
+        n_iter[idx] += 1
+
+        converged[idx[done]] = True
+        active[idx[done]] = False
+
+        flags[idx[singular]] |= FLAG_SINGULAR
+        active[idx[singular]] = False
+
+    flags[~converged & (flags == 0)] |= FLAG_MAX_ITER
+
+    # Parameter standard errors from the undamped normal matrix
+    _, J = _jacobian(p, x, free)
+    J *= valid[:,:,np.newaxis]
+    JTJ = np.einsum("cnp,cnq->cpq", J, J)
+
+    dof = n_valid - k
+    s2 = np.where(dof > 0, ssr/np.maximum(dof, 1), np.nan)
+
+    err = np.full((c, 4), np.nan)
+    for i in range(c):
+        if flags[i] & FLAG_INSUFFICIENT:
+            continue
+        try:
+            cov = np.linalg.inv(JTJ[i])*s2[i]
+            err[i, free] = np.sqrt(np.abs(np.diag(cov)))
+        except np.linalg.LinAlgError:
+            flags[i] |= FLAG_SINGULAR
+
+    # Tested dose range per curve
+    xv = np.where(valid, x, np.nan)
+    with np.errstate(invalid="ignore"):
+        outside = (p[:,0] < np.nanmin(xv, axis=1)) | \
+                  (p[:,0] > np.nanmax(xv, axis=1))
+    flags[outside] |= FLAG_EXTRAPOLATED
+
+    return format_results(p, err, ssr, n_valid, n_iter, flags)
+
+def _column(values):
+    # JSON serialisable list, None for non-finite values (fixed parameter
+    # errors, curves with too few responses)
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return np.where(np.isfinite(values), values, None).tolist()
+    return values.tolist()
+
+def format_results(p, err, ssr, n, n_iter, flags):
+    """
+    Columnar results table, one list per column with an entry per curve,
+    None where a value is undefined.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rms = np.sqrt(ssr/n)
+
+    results = {
+            "n_curves":  p.shape[0],
+            "flag_bits": FLAGS,
+            "columns": {
+                "ssr":       _column(ssr),
+                "rms":       _column(rms),
+                "n":         _column(n),
+                "n_iter":    _column(n_iter),
+                "flags":     _column(flags),
+                },
+            }
+
+    for i, name in enumerate(PARAMS):
+        results["columns"][name]        = _column(p[:,i])
+        results["columns"][name+"_err"] = _column(err[:,i])
+
+    return results
@@ -0,0 +1,198 @@
+"""
+" On-demand request profiling
+"
+" ProfilingMiddleware runs a view (and its response rendering) under
+" cProfile when the request has an X-Profile header or profile query
+" parameter, and the user is staff or gives the configured token in an
+" X-Profile-Token header (never in the URL, which ends up in access logs).
+" The profile is saved as <request id>.prof with a .json description, the
+" request id being the X-Request-ID header if set, and returned in the
+" X-Profile-Id response header. Stored profiles are summarised with the
+" profiles management command. Configured by settings.BINDFIT_PROFILING.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import io
+import hmac
+import json
+import time
+import uuid
+import pstats
+import cProfile
+
+from django.conf import settings
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "ENABLED":      True,
+        "TOKEN":        None, # Allows non-staff requests to be profiled
+        "PATH":         os.path.join(getattr(settings, "BINDFIT_VAR_DIR",
+                                             "var"), "profiles"),
+        "MAX_PROFILES": 500,  # Oldest profiles are removed beyond this
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_PROFILING", DEFAULT_SETTINGS)
+
+def _path():
+    return config().get("PATH", DEFAULT_SETTINGS["PATH"])
+
+def requested(request):
+    """
+    Return the request's profile flag (header or query parameter value), or
+    None if it didn't ask to be profiled.
+    """
+    flag = request.META.get("HTTP_X_PROFILE", None)
+    if flag is None:
+        flag = request.GET.get("profile", None)
+    return flag
+
+def authorised(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        return True
+
+    token = config().get("TOKEN", None)
+    if not token:
+        return False
+
+    given = request.META.get("HTTP_X_PROFILE_TOKEN", "")
+    return hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8"))
+
+def save(profiler, request_id, meta):
+    """
+    Save a profile as <request_id>.prof, with meta as <request_id>.json.
+    """
+    path = _path()
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    profiler.dump_stats(os.path.join(path, request_id+".prof"))
+    with open(os.path.join(path, request_id+".json"), "w") as f:
+        json.dump(meta, f, sort_keys=True)
+
+    cleanup(path, config().get("MAX_PROFILES",
+                               DEFAULT_SETTINGS["MAX_PROFILES"]))
+
+def cleanup(path, max_profiles):
+    # Remove oldest profiles beyond max_profiles
+    names = [ n[:-5] for n in os.listdir(path) if n.endswith(".prof") ]
+    names.sort(key=lambda n: os.path.getmtime(os.path.join(path, n+".prof")))
+
+    for name in names[:max(len(names) - max_profiles, 0)]:
+        for ext in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(path, name+ext))
+            except OSError:
+                pass
+
+def stored():
+    """
+    Return descriptions of stored profiles, oldest first.
+    """
+    path = _path()
+    if not os.path.isdir(path):
+        return []
+
+    profiles = []
+    for name in os.listdir(path):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(path, name)) as f:
+                profiles.append(json.load(f))
+        except (IOError, OSError, ValueError):
+            continue
+
+    return sorted(profiles, key=lambda p: p["time"])
+
+def summarise(request_ids, sort="cumulative", limit=30):
+    """
+    Combined statistics of the given stored profiles, as printed by pstats.
+
+    Returns:
+        string
+    """
+    path = _path()
+    files = [ os.path.join(path, request_id+".prof")
+              for request_id in request_ids ]
+
+    stream = io.StringIO()
+    stats = pstats.Stats(*files, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+
+#
+# Middleware
+#
+
+class ProfilingMiddleware(object):
+    """
+    Profile opted-in requests. Place last in MIDDLEWARE_CLASSES: profiling
+    starts in process_view, just before the view is called, and stops in
+    process_response, which runs first, after the response is rendered (so
+    including other middleware's process_template_response and post-render
+    callbacks).
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not config().get("ENABLED", True):
+            return None
+
+        if requested(request) is None:
+            return None
+        if not authorised(request):
+            logger.warning("ProfilingMiddleware: unauthorised profile "
+                           "request for {}".format(request.path))
+            return None
+
+        request_id = request.META.get("HTTP_X_REQUEST_ID", "") or \
+                     uuid.uuid4().hex
+        # Used as a file name
+        request_id = "".join(c for c in request_id
+                             if c.isalnum() or c in "-_")[:64]
+
+        request._profile = {
+                "id":       request_id,
+                "view":     "{}.{}".format(view_func.__module__,
+                                           view_func.__name__),
+                "profiler": cProfile.Profile(),
+                "tic":      time.perf_counter(),
+                }
+        request._profile["profiler"].enable()
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, "_profile", None)
+        if profile is None:
+            return response
+
+        # Also reached after an exception in the view, with the error
+        # response
+        profile["profiler"].disable()
+        duration = time.perf_counter() - profile["tic"]
+        del request._profile
+
+        try:
+            save(profile["profiler"], profile["id"], {
+                "id":       profile["id"],
+                "time":     time.time(),
+                "method":   request.method,
+                "path":     request.path,
+                "view":     profile["view"],
+                "status":   response.status_code,
+                "duration": duration,
+                })
+        except (IOError, OSError):
+            logger.exception("ProfilingMiddleware: saving profile failed")
+            return response
+
+        response["X-Profile-Id"] = profile["id"]
+        return response
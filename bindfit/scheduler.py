@@ -0,0 +1,133 @@
+"""
+" Priority-aware scheduling of asynchronous fit jobs
+"
+" Jobs belong to one of three priority classes. runfitworker asks the
+" Scheduler which queued jobs to start: the highest priority class with free
+" capacity goes first, and within a class the client with the fewest running
+" jobs goes first (oldest job first between equals).
+"
+" Non-interactive jobs may only occupy CPU_BUDGET worker slots. A further
+" INTERACTIVE_SLOTS slots are kept for interactive fits so they never wait
+" behind long Monte Carlo runs. When those slots push the number of running
+" jobs over the CPU budget, Monte Carlo jobs pause between iterations until
+" the interactive fits finish.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+
+from django.conf import settings
+
+PRIORITY_INTERACTIVE = 0 # Single fits from the UI
+PRIORITY_ANALYSIS    = 1 # Monte Carlo/statistics
+PRIORITY_BATCH       = 2 # Batch and admin jobs
+
+PRIORITY_NAMES = {
+        PRIORITY_INTERACTIVE: "interactive",
+        PRIORITY_ANALYSIS:    "analysis",
+        PRIORITY_BATCH:       "batch",
+        }
+
+PRIORITIES = { v: k for k, v in PRIORITY_NAMES.items() }
+
+DEFAULT_SETTINGS = {
+        "CPU_BUDGET":        2,
+        "INTERACTIVE_SLOTS": 1,
+        # Maximum running jobs per class, None for no limit beyond the budget
+        "CLASS_LIMITS": {
+            "interactive": None,
+            "analysis":    None,
+            "batch":       None,
+            },
+        }
+
+# Queued/running job as seen by the scheduler
+Entry = namedtuple("Entry", ["id", "priority", "client"])
+
+def config():
+    return getattr(settings, "BINDFIT_SCHEDULER", DEFAULT_SETTINGS)
+
+class Scheduler(object):
+    def __init__(self, cpu_budget=2, interactive_slots=1, class_limits=None):
+        self.cpu_budget        = cpu_budget
+        self.interactive_slots = interactive_slots
+
+        class_limits = class_limits or {}
+        self.class_limits = { p: class_limits.get(name)
+                              for p, name in PRIORITY_NAMES.items() }
+
+    @classmethod
+    def from_settings(cls):
+        c = config()
+        return cls(cpu_budget       =c.get("CPU_BUDGET", 2),
+                   interactive_slots=c.get("INTERACTIVE_SLOTS", 1),
+                   class_limits     =c.get("CLASS_LIMITS"))
+
+    @property
+    def slots(self):
+        # Worker processes needed
+        return self.cpu_budget + self.interactive_slots
+
+    def _capacity(self, priority, running):
+        # Can another job of this priority start alongside running?
+        n_class = sum(1 for e in running if e.priority == priority)
+        limit = self.class_limits.get(priority)
+        if limit is not None and n_class >= limit:
+            return False
+
+        if priority == PRIORITY_INTERACTIVE:
+            return len(running) < self.slots
+        else:
+            n_other = sum(1 for e in running
+                          if e.priority != PRIORITY_INTERACTIVE)
+            return (n_other < self.cpu_budget
+                    and len(running) < self.slots)
+
+    def select(self, queued, running):
+        """
+        Choose queued jobs to start.
+
+        Arguments:
+            queued:  list  Entry for each queued job, oldest first
+            running: list  Entry for each running job
+
+        Returns:
+            list  Entries to start, in order
+        """
+        running  = list(running)
+        queued   = list(queued)
+        selected = []
+
+        while queued:
+            candidates = [ e for e in queued
+                           if self._capacity(e.priority, running) ]
+            if not candidates:
+                break
+
+            priority = min(e.priority for e in candidates)
+
+            # Fair share: client with fewest running jobs of this class,
+            # queue order (oldest first) breaks ties
+            load = {}
+            for e in running:
+                if e.priority == priority:
+                    load[e.client] = load.get(e.client, 0) + 1
+
+            entry = min((e for e in candidates if e.priority == priority),
+                        key=lambda e: load.get(e.client, 0))
+
+            queued.remove(entry)
+            running.append(entry)
+            selected.append(entry)
+
+        return selected
+
+    def should_yield(self, running):
+        """
+        True if yielding jobs (Monte Carlo) should pause so interactive fits
+        running in reserved slots stay within the CPU budget.
+        """
+        return (len(running) > self.cpu_budget
+                and any(e.priority == PRIORITY_INTERACTIVE for e in running))
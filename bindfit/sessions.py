@@ -0,0 +1,313 @@
+"""
+" Incremental fitting sessions
+"
+" A session accumulates titration points as they arrive from an instrument
+" and refits after each append. Each fit starts from the previous optimum
+" and from the previous free concentration solutions of the points already
+" fitted (see functions._solve_binding_cubic). Sessions are held in a store
+" selected by settings.BINDFIT_SESSIONS and evicted after inactivity.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import uuid
+import pickle
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+
+import numpy as np
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import functions
+from . import helpers
+from .fitter import Fitter
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "BACKEND": "bindfit.sessions.LocMemStore",
+        "OPTIONS": {
+            "timeout":      1800, # Seconds of inactivity before eviction
+            "max_sessions": 1000,
+            },
+        }
+
+class SessionNotFound(Exception):
+    pass
+
+class SessionBusy(Exception):
+    # Another append to the session didn't finish in time
+    pass
+
+class Session(object):
+    def __init__(self, fitter_name, params, options,
+                 labels_x=None, labels_y=None):
+        """
+        Arguments:
+            fitter_name: string  Fitter key
+            params:      dict    Parsed initial parameters, as for FitView
+            options:     dict    Fit options (dilute, normalise, flavour,
+                                 method), as for FitView
+        """
+        self.id          = uuid.uuid4().hex
+        self.fitter_name = fitter_name
+        self.params      = params
+        self.options     = options
+        self.labels_x    = labels_x or []
+        self.labels_y    = labels_y or []
+
+        self.x = None # x x m input x data received so far
+        self.y = None # y x m input y data received so far
+
+        # Free concentration solutions of the last fit, one per point
+        self.roots = None
+        # Last optimised raw parameters
+        self.params_raw = None
+
+        self.n_fits = 0
+
+    @property
+    def n_points(self):
+        return 0 if self.x is None else self.x.shape[1]
+
+    def min_points(self):
+        # Fewest points fitted: enough for the parameters and at least one
+        # degree of freedom for the statistics
+        return len(self.params) + 2
+
+    def append(self, x, y):
+        """
+        Append points and refit.
+
+        Arguments:
+            x: array  x x k x data of k new points
+            y: array  y x k y data of k new points
+
+        Returns:
+            Fitter  Fitter with results for all points so far, or None if
+                    there are too few points to fit yet
+        """
+        x = np.atleast_2d(np.array(x, dtype=np.float64))
+        y = np.atleast_2d(np.array(y, dtype=np.float64))
+
+        if x.shape[1] != y.shape[1]:
+            raise ValueError("x and y must have the same number of points")
+
+        if self.x is None:
+            self.x, self.y = x, y
+        else:
+            self.x = np.hstack((self.x, x))
+            self.y = np.hstack((self.y, y))
+
+        if self.n_points < self.min_points():
+            return None
+
+        normalise = self.options.get("normalise", True)
+        function = functions.construct(self.fitter_name,
+                                       normalise=normalise,
+                                       flavour=self.options.get("flavour", ""))
+
+        y = self.y
+        if self.options.get("dilute", False):
+            # As applied by Data.to_dict
+            y = helpers.dilute(self.x[0], y)
+
+        fitter = Fitter(self.x, y, function, normalise=normalise)
+
+        # Warm start: previous free concentrations for the points included in
+        # the last successful fit, previous optimum as initial parameters.
+        # Points are kept if the fit raises, the next append refits them.
+        if self.roots is not None:
+            fitter.workspace.roots[:len(self.roots)] = self.roots
+
+        method = self.options.get("method", "")
+        if self.params_raw is None:
+            fitter.run_scipy(self.params, method=method)
+        else:
+            params = deepcopy(self.params)
+            for name, value in zip(sorted(params), self.params_raw):
+                params[name]["init"] = value
+
+            try:
+                fitter.run_scipy(params, method=method)
+            except np.linalg.LinAlgError:
+                # An optimum from few points can be a poor start for the 
+                # unbounded optimiser, refit from the initial parameters
+                logger.debug("Session.append: warm start failed, refitting")
+                fitter.workspace.roots[:] = np.nan
+                fitter.run_scipy(self.params, method=method)
+
+        self.roots      = fitter.workspace.roots.copy()
+        self.params_raw = fitter._params_raw
+        self.n_fits    += 1
+
+        return fitter
+
+
+
+#
+# Session stores
+#
+
+class LocMemStore(object):
+    """
+    In-process session store. Sessions are evicted after timeout seconds
+    without access, or least recently used first above max_sessions.
+    """
+
+    def __init__(self, timeout=1800, max_sessions=1000):
+        self.timeout      = timeout
+        self.max_sessions = max_sessions
+        self.evictions    = 0
+        self._sessions = OrderedDict() # id: (session, last access)
+        self._locks    = {}
+        self._lock     = threading.Lock()
+
+    def _evict(self, now):
+        while self._sessions:
+            key, (_, last) = next(iter(self._sessions.items()))
+            if (now - last > self.timeout
+                    or len(self._sessions) > self.max_sessions):
+                del self._sessions[key]
+                self._locks.pop(key, None)
+                self.evictions += 1
+            else:
+                break
+
+    def add(self, session):
+        with self._lock:
+            now = time.time()
+            self._sessions[session.id] = (session, now)
+            self._locks[session.id] = threading.Lock()
+            self._evict(now)
+
+    def get(self, id):
+        with self._lock:
+            now = time.time()
+            self._evict(now)
+            try:
+                session, _ = self._sessions.pop(id)
+            except KeyError:
+                raise SessionNotFound(id)
+            # Move to most recently used end
+            self._sessions[id] = (session, now)
+            return session
+
+    def save(self, session):
+        # Sessions are held by reference, only refresh the access time
+        self.get(session.id)
+
+    def lock(self, id):
+        # Lock serialising appends to one session
+        with self._lock:
+            lock = self._locks.get(id)
+        if lock is None:
+            raise SessionNotFound(id)
+        return lock
+
+    def delete(self, id):
+        with self._lock:
+            self._sessions.pop(id, None)
+            self._locks.pop(id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+class CacheLock(object):
+    """
+    Lock held as a key in a Django cache, exclusive between all threads and
+    processes sharing the cache (cache.add is atomic). Expires after expire
+    seconds in case its holder dies.
+    """
+
+    def __init__(self, cache, key, expire=60, wait=30, poll=0.05):
+        self.cache  = cache
+        self.key    = key
+        self.expire = expire
+        self.wait   = wait
+        self.poll   = poll
+        self._token = None
+
+    def __enter__(self):
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.wait
+        while not self.cache.add(self.key, token, self.expire):
+            if time.time() > deadline:
+                raise SessionBusy(self.key)
+            time.sleep(self.poll)
+        self._token = token
+        return self
+
+    def __exit__(self, *exc_info):
+        # Leave a lock taken over after expiring alone
+        if self.cache.get(self.key) == self._token:
+            self.cache.delete(self.key)
+        self._token = None
+
+class DjangoCacheStore(object):
+    """
+    Store sessions in one of Django's configured caches, shared between
+    processes if the cache is. The inactivity timeout is refreshed on each
+    save. Appends to the same session are serialised by a CacheLock, held
+    for at most lock_timeout seconds and waited for at most lock_wait
+    seconds (raising SessionBusy).
+    """
+
+    PREFIX = "bindfit:session:"
+    LOCK_PREFIX = "bindfit:session-lock:"
+
+    def __init__(self, alias="default", timeout=1800, lock_timeout=60,
+                 lock_wait=30):
+        from django.core.cache import caches
+        self.cache        = caches[alias]
+        self.timeout      = timeout
+        self.lock_timeout = lock_timeout
+        self.lock_wait    = lock_wait
+        self.evictions    = None
+
+    def add(self, session):
+        self.save(session)
+
+    def get(self, id):
+        value = self.cache.get(self.PREFIX+id)
+        if value is None:
+            raise SessionNotFound(id)
+        return pickle.loads(value)
+
+    def save(self, session):
+        self.cache.set(self.PREFIX+session.id,
+                       pickle.dumps(session, pickle.HIGHEST_PROTOCOL),
+                       self.timeout)
+
+    def lock(self, id):
+        # Lock serialising appends to one session
+        return CacheLock(self.cache, self.LOCK_PREFIX+id,
+                         expire=self.lock_timeout, wait=self.lock_wait)
+
+    def delete(self, id):
+        self.cache.delete(self.PREFIX+id)
+
+    def __len__(self):
+        return 0
+
+_store = None
+
+def get_store():
+    """
+    Return process-wide session store configured from
+    settings.BINDFIT_SESSIONS.
+    """
+    global _store
+
+    if _store is None:
+        config = getattr(settings, "BINDFIT_SESSIONS", DEFAULT_SETTINGS)
+        cls = import_string(config["BACKEND"])
+        _store = cls(**config.get("OPTIONS", {}))
+
+    return _store
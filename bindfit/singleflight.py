@@ -0,0 +1,262 @@
+"""
+" Single-flight coalescing of identical concurrent computations
+"
+" The first caller for a given key runs the computation, concurrent callers
+" with the same key wait for it to finish and share its result. Selected by
+" settings.BINDFIT_SINGLEFLIGHT.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import errno
+import fcntl
+import pickle
+import tempfile
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "BACKEND": "bindfit.singleflight.LocalLockTable",
+        "OPTIONS": {},
+        }
+
+class LockTableStats(object):
+    # Per-process counters
+    def __init__(self):
+        self.leaders   = 0 # Computations run
+        self.coalesced = 0 # Calls served by another caller's computation
+        self.timeouts  = 0 # Calls that gave up waiting and ran themselves
+        self._lock = threading.Lock()
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "leaders":   self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts":  self.timeouts,
+                }
+
+class LocalLockTable(object):
+    """
+    In-process lock table, coalesces calls between threads of one process
+    only.
+    """
+
+    def __init__(self, timeout=300):
+        self.timeout = timeout
+        self.stats = LockTableStats()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def run(self, key, fn):
+        """
+        Return fn(), or the result of an identical in-flight call of fn if
+        one is running under the same key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = {"done": threading.Event()}
+                self._flights[key] = flight
+
+        if not leader:
+            self.stats.increment("coalesced")
+            if flight["done"].wait(self.timeout) and "result" in flight:
+                return flight["result"]
+            # Leader failed or timed out, compute independently
+            self.stats.increment("timeouts")
+            return fn()
+
+        self.stats.increment("leaders")
+        try:
+            flight["result"] = fn()
+            return flight["result"]
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight["done"].set()
+
+class FileLockTable(object):
+    """
+    Lock table shared between processes through flock()ed files in a local
+    directory.
+
+    The leader holds an exclusive lock on <key>.lock while computing.
+    Callers finding it locked create a <key>.wait marker and wait for a
+    shared lock, and only if the marker exists does the leader write the
+    pickled result to <key>.result for them before releasing its lock. A new
+    leader for the same key removes the previous result and marker first, so
+    results are only shared between overlapping callers.
+
+    Files of keys not used for max_age are removed at most every
+    cleanup_interval. A lock file is only removed while exclusively locked,
+    and callers check that the file they locked is still the one at its
+    path, so two processes never lock different files for the same key.
+    """
+
+    def __init__(self, path, timeout=300, poll=0.05, max_age=3600,
+                 cleanup_interval=60):
+        self.path    = path
+        self.timeout = timeout
+        self.poll    = poll
+        self.max_age = max_age
+        self.cleanup_interval = cleanup_interval
+        self.stats   = LockTableStats()
+        self._next_cleanup = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _paths(self, key):
+        base = os.path.join(self.path, key)
+        return base+".lock", base+".wait", base+".result"
+
+    def _try_lock(self, fd, mode):
+        try:
+            fcntl.flock(fd, mode | fcntl.LOCK_NB)
+            return True
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+    def _current(self, fd, path):
+        # Is the locked file still the one at path (not removed by cleanup)?
+        try:
+            return os.fstat(fd).st_ino == os.stat(path).st_ino
+        except OSError:
+            return False
+
+    def run(self, key, fn):
+        """
+        Return fn(), or the result of an identical in-flight call of fn in
+        any process sharing this lock table's directory.
+        """
+        lock_path, wait_path, result_path = self._paths(key)
+        deadline = time.time() + self.timeout
+        waited = False
+
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if self._try_lock(fd, fcntl.LOCK_EX):
+                    if not self._current(fd, lock_path):
+                        continue
+                    self.stats.increment("leaders")
+                    return self._lead(fn, lock_path, wait_path, result_path)
+
+                if not waited:
+                    self.stats.increment("coalesced")
+                    waited = True
+
+                # Ask the leader to keep its result
+                _touch(wait_path)
+
+                # Wait for leader to release its exclusive lock
+                while not self._try_lock(fd, fcntl.LOCK_SH):
+                    if time.time() > deadline:
+                        self.stats.increment("timeouts")
+                        return fn()
+                    time.sleep(self.poll)
+
+                if not self._current(fd, lock_path):
+                    continue
+
+                try:
+                    with open(result_path, "rb") as f:
+                        return pickle.load(f)
+                except (IOError, OSError, EOFError):
+                    # Leader failed without a result, or finished before
+                    # seeing the wait marker: retry (possibly as leader)
+                    pass
+            finally:
+                # Closing releases any lock held
+                os.close(fd)
+
+    def _lead(self, fn, lock_path, wait_path, result_path):
+        # Remove result and waiters of any previous flight for this key, and
+        # mark the key as recently used
+        for path in (result_path, wait_path):
+            _remove(path)
+        os.utime(lock_path, None)
+
+        result = fn()
+
+        # Only keep the result for callers waiting for it
+        if os.path.exists(wait_path):
+            fd, tmp = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, result_path)
+            _remove(wait_path)
+
+        if time.time() >= self._next_cleanup:
+            self._next_cleanup = time.time() + self.cleanup_interval
+            self._cleanup()
+        return result
+
+    def _cleanup(self):
+        # Remove files of keys not used for max_age
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if now - os.stat(path).st_mtime <= self.max_age:
+                    continue
+                if name.endswith(".lock"):
+                    self._remove_lock(path)
+                elif name.endswith((".result", ".wait")) or \
+                        name.startswith("tmp"):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_lock(self, path):
+        # Remove a lock file nobody holds, while holding it so no other
+        # process can lock it in the meantime
+        fd = os.open(path, os.O_RDWR)
+        try:
+            if self._try_lock(fd, fcntl.LOCK_EX) and \
+                    self._current(fd, path):
+                os.remove(path)
+        finally:
+            os.close(fd)
+
+def _touch(path):
+    with open(path, "a"):
+        os.utime(path, None)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+_lock_table = None
+
+def get_lock_table():
+    """
+    Return process-wide lock table configured from
+    settings.BINDFIT_SINGLEFLIGHT.
+    """
+    global _lock_table
+
+    if _lock_table is None:
+        config = getattr(settings, "BINDFIT_SINGLEFLIGHT", DEFAULT_SETTINGS)
+        cls = import_string(config["BACKEND"])
+        _lock_table = cls(**config.get("OPTIONS", {}))
+
+    return _lock_table
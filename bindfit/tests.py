@@ -0,0 +1,1044 @@
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from importlib import import_module
+
+import numpy as np
+
+from django.apps import apps
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import arraycodec
+from . import batch
+from . import cache
+from . import compare
+from . import datacache
+from . import formatter
+from . import functions
+from . import helpers
+from . import jobs
+from . import models
+from . import plate
+from . import scheduler
+from . import sessions
+from . import singleflight
+from . import tracing
+from .benchmarks import synthetic_data, synthetic_x, params_init
+from .checkpoint import MonteCarloCheckpoint
+from .fitter import Fitter
+from .views import FitView
+
+class SolveBindingCubicTest(SimpleTestCase):
+    # _solve_binding_cubic must return the same free concentrations as
+    # _cubic_roots (np.roots) whatever its starting points, including for
+    # the negative constants unbounded optimisers try
+
+    K11 = (1e-6, 1e-2, 1., 1e2, 1e4, 1e6, 1e9,
+           -1e-2, -1., -1e2, -847., -1e4, -1e6)
+    K12 = (0., 1e-6, 1., 1e3, 1e6, 1e9, -1., -1e3, -1e6)
+
+    def polys(self):
+        x = synthetic_x("nmr1to2", 50)
+        for k11 in self.K11:
+            for k12 in self.K12:
+                # Solving for free guest (1:2) and free host (2:1)
+                for total, other in ((x[1], x[0]), (x[0], x[1])):
+                    a = np.ones(total.shape[0])*k11*k12
+                    b = 2*k11*k12*other + k11 - total*k11*k12
+                    c = 1 + k11*other - k11*total
+                    d = -1.*total
+                    yield (k11, k12), np.column_stack((a, b, c, d)), total
+
+    def test_matches_np_roots(self):
+        rng = np.random.RandomState(0)
+
+        for k, poly, upper in self.polys():
+            expected = functions._cubic_roots(poly)
+            tol = 1e-8*np.maximum(np.abs(expected), 1e-12*upper.max())
+
+            starts = {
+                    "none":     np.full(poly.shape[0], np.nan),
+                    "previous": expected*1.01,
+                    "random":   rng.rand(poly.shape[0])*upper,
+                    }
+            for name, roots in starts.items():
+                x = functions._solve_binding_cubic(poly, upper, roots)
+                self.assertTrue(np.all(np.abs(x - expected) <= tol),
+                                "k={}, start={}: max difference {}".format(
+                                    k, name, np.max(np.abs(x - expected))))
+                # Solutions are kept as the next starting points
+                np.testing.assert_array_equal(roots, x)
+
+
+class CompareRankTest(SimpleTestCase):
+    def items(self, *fits):
+        # formatter.batch_item dicts for (ssr, n, k) fits
+        return [ {"status": "ok", "error": None,
+                  "result": {"qof": {"ssr": ssr},
+                             "fit": {"n_y": n, "n_params": k}}}
+                 for ssr, n, k in fits ]
+
+    def specs(self):
+        return [ {"fitter": f, "options": {"flavour": ""}}
+                 for f in compare.FAMILIES["nmr"] ]
+
+    def test_exact_fit(self):
+        # ssr == 0 ranks best instead of failing on log(0)
+        rows = compare.rank(self.specs(),
+                            self.items((1e-3, 20, 3), (0., 20, 4),
+                                       (1e-4, 20, 4)))
+
+        self.assertEqual(rows[0]["fitter"], "nmr1to2")
+        self.assertTrue(np.isfinite(rows[0]["aicc"]))
+        self.assertAlmostEqual(sum(r["weight"] for r in rows), 1.)
+        self.assertEqual(rows[0]["f_test"]["f"], None)
+
+    def test_no_finite_aicc(self):
+        # Too few points for any model: unranked, no weights or deltas
+        rows = compare.rank(self.specs(),
+                            self.items((1e-3, 3, 3), (1e-4, 3, 4),
+                                       (1e-4, 3, 4)))
+
+        json.dumps(rows, allow_nan=False)
+        for row in rows:
+            self.assertIsNone(row["aicc"])
+            self.assertIsNone(row["rank"])
+            self.assertIsNone(row["weight"])
+            self.assertIsNone(row["delta_aicc"])
+
+    def test_undefined_aicc_unranked(self):
+        # Enough points for the simplest model only
+        rows = compare.rank(self.specs(),
+                            self.items((1e-3, 5, 3), (1e-4, 5, 4),
+                                       (1e-4, 5, 4)))
+
+        json.dumps(rows, allow_nan=False)
+        self.assertEqual(rows[0]["fitter"], "nmr1to1")
+        self.assertEqual([ r["rank"] for r in rows ], [1, None, None])
+        self.assertEqual([ r["weight"] for r in rows ], [1., 0., 0.])
+        self.assertEqual(rows[1]["aicc"], None)
+        self.assertEqual(rows[1]["delta_aicc"], None)
+
+    def test_information_criteria_exact_fit(self):
+        ic = helpers.information_criteria(0., 20, 3)
+        self.assertTrue(all(np.isfinite(v) for v in ic.values()))
+
+
+class MonteCarloTest(SimpleTestCase):
+    def fitter(self, fitter="nmr1to2"):
+        x, y, params = synthetic_data(fitter, 20, 2)
+        f = Fitter(x, y, functions.construct(fitter))
+        f.run_scipy(params_init(params, 0.5))
+        return f
+
+    def test_resume_from_checkpoint(self):
+        # A resumed calculation gives the uninterrupted one's results
+        n_iter = 12
+        errors = ([0.01, 0.01], 0.01)
+
+        expected = self.fitter().calc_monte_carlo(n_iter, *errors, seed=0)
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        checkpoint = MonteCarloCheckpoint(os.path.join(path, "mc.npz"),
+                                          interval=0)
+
+        class Interrupted(Exception):
+            pass
+
+        def interrupt(n_done, n_total, params_done):
+            if n_done == 5:
+                raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            self.fitter().calc_monte_carlo(n_iter, *errors, seed=0,
+                                           callback=interrupt,
+                                           checkpoint=checkpoint)
+        self.assertTrue(os.path.exists(checkpoint.path))
+
+        done = []
+        result = self.fitter().calc_monte_carlo(
+                n_iter, *errors, seed=0,
+                callback=lambda n_done, n_total, p: done.append(n_done),
+                checkpoint=checkpoint)
+
+        # Iteration 5 was saved before the interrupting callback
+        self.assertEqual(done, list(range(6, n_iter + 1)))
+        for key in expected:
+            self.assertEqual(result[key]["mc"], expected[key]["mc"])
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_aggregation_fitters(self):
+        # Aggregation fitters report Ke as [Ke, Kd]
+        for fitter in ("nmrdimer", "uvdimer"):
+            x, y, params = synthetic_data(fitter, 20, 2)
+            f = Fitter(x, y, functions.construct(fitter))
+            f.run_scipy(params_init(params, 0.5))
+            self.assertIsInstance(f.params["ke"]["value"], (list, tuple))
+
+            result = f.calc_monte_carlo(5, [0.01]*x.shape[0], 0.01, seed=0)
+
+            lower, upper = result["ke"]["mc"]
+            self.assertTrue(np.isfinite(lower) and np.isfinite(upper))
+            self.assertLessEqual(lower, upper)
+
+
+class PlateFitTest(SimpleTestCase):
+    def test_missing_wells_fixed_asymptotes(self):
+        x = np.linspace(-4, 1, 12)
+        p = np.array([[-2., 1., 0., 100.],
+                      [-1., -1.5, 0., 100.],
+                      [-2.5, 0.8, 0., 100.]])
+        y = plate.response(p, np.broadcast_to(x, (3, 12)))
+        y += np.random.RandomState(0).standard_normal(y.shape)
+        y[0, [2, 7]] = np.nan
+        # Too few responses to fit
+        y[2, 2:] = np.nan
+
+        results = plate.fit(x, y)
+        columns = results["columns"]
+
+        # Strict JSON, undefined values as null
+        json.dumps(formatter.plate("plate", results), allow_nan=False)
+
+        self.assertEqual(columns["bottom_err"], [None]*3)
+        self.assertEqual(columns["top_err"],    [None]*3)
+        self.assertEqual(columns["logic50_err"][2], None)
+        self.assertEqual(columns["flags"][2] & plate.FLAG_INSUFFICIENT,
+                         plate.FLAG_INSUFFICIENT)
+        self.assertEqual(columns["n"], [10, 12, 2])
+
+        for i in (0, 1):
+            self.assertEqual(columns["flags"][i], 0)
+            self.assertAlmostEqual(columns["logic50"][i], p[i,0], places=1)
+            self.assertIsNotNone(columns["logic50_err"][i])
+
+    def test_damping_exhausted_not_converged(self):
+        # From an unusable starting point no step reduces the SSR, so the
+        # damping runs out. The curve is flagged, not reported as converged
+        x = np.linspace(-4, 1, 12)
+        y = np.full((1, 12), 50.)
+        results = plate.fit(x, y, p0=[[np.nan, 1., 0., 100.]])
+
+        self.assertTrue(results["columns"]["flags"][0] & plate.FLAG_MAX_ITER)
+
+
+
+def save_data(fitter="nmr1to1", points=20, signals=2, storage=None):
+    # Saved synthetic input data for fitter, returns its ID
+    x, y, _ = synthetic_data(fitter, points, signals)
+    data = models.Data.from_arrays(
+            "test-{}-{}".format(fitter, storage),
+            x, y[np.newaxis],
+            [ "x{}".format(i) for i in range(x.shape[0]) ],
+            [ "y{}".format(i) for i in range(y.shape[0]) ],
+            storage=storage)
+    data.save()
+    return data.id
+
+@override_settings(BINDFIT_JOBS={"BACKEND": "bindfit.jobs.LocalBackend"})
+class LocalJobsTestCase(TestCase):
+    # Jobs run synchronously on submission
+
+    def setUp(self):
+        jobs._backend = None
+
+    def tearDown(self):
+        jobs._backend = None
+
+class BatchTest(LocalJobsTestCase):
+    def specs(self):
+        return compare.specs(save_data(), "nmr")[:2]
+
+    def test_run(self):
+        specs = self.specs() + [dict(self.specs()[0], data_id="missing")]
+
+        items = list(batch.run(specs))
+
+        self.assertEqual([ i["index"] for i in items ], [0, 1, 2])
+        self.assertEqual([ i["status"] for i in items ],
+                         ["ok", "ok", "error"])
+        self.assertEqual(items[0]["result"]["fitter"], specs[0]["fitter"])
+        self.assertEqual(items[2]["error"], "Input data not found.")
+        self.assertEqual(
+                models.Job.objects.filter(kind=models.Job.KIND_BATCH,
+                                          status=models.Job.STATUS_DONE
+                                          ).count(), 3)
+
+    @override_settings(BINDFIT_BATCH={"MAX_ITEMS": 10, "SYNC_MAX": 1})
+    def test_large_batch_returns_id(self):
+        specs = self.specs()
+
+        response = self.client.post(reverse("bindfit_fit_batch"),
+                                    json.dumps({"fits": specs}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        batch_id = json.loads(response.content.decode("utf-8"))["batch_id"]
+
+        response = self.client.get(reverse("bindfit_fit_batch_status",
+                                           kwargs={"id": batch_id}))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(result["status"], "done")
+        self.assertEqual(result["n_items"], 2)
+        self.assertEqual([ i["status"] for i in result["results"] ],
+                         ["ok", "ok"])
+
+    def test_status_pending_and_unknown(self):
+        # Not run by a worker yet
+        with override_settings(
+                BINDFIT_JOBS={"BACKEND": "bindfit.jobs.DatabaseBackend"}):
+            jobs._backend = None
+            batch_id = batch.submit(self.specs())
+
+        result = batch.status(batch_id)
+        self.assertEqual(result["status"], "running")
+        self.assertEqual([ i["status"] for i in result["results"] ],
+                         ["queued", "queued"])
+
+        self.assertEqual(batch.cancel(batch_id), 2)
+        result = batch.status(batch_id)
+        self.assertEqual(result["status"], "done")
+        self.assertEqual(result["n_failed"], 2)
+
+        for id in ("00000000-0000-0000-0000-000000000000", "not-a-uuid"):
+            response = self.client.get(reverse("bindfit_fit_batch_status",
+                                               kwargs={"id": id}))
+            self.assertEqual(response.status_code, 404)
+
+    def test_batch_class_uses_cpu_budget(self):
+        sched = scheduler.Scheduler.from_settings()
+        queued = [ scheduler.Entry(i, scheduler.PRIORITY_BATCH, "a")
+                   for i in range(5) ]
+        self.assertEqual(len(sched.select(queued, [])), sched.cpu_budget)
+
+
+
+class LockTableTestMixin(object):
+    # Leader/follower behaviour shared by the lock table backends, threads
+    # stand in for processes (flock()s of separately opened files conflict
+    # within a process too)
+
+    def table(self, timeout=5):
+        raise NotImplementedError
+
+    def start(self, fn, results, key="key"):
+        # Call run in a thread, appending its result to results
+        def target():
+            results.append(self.lock_table.run(key, fn))
+        t = threading.Thread(target=target)
+        t.start()
+        return t
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_follower_shares_result(self):
+        self.lock_table = self.table()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def lead():
+            calls.append("leader")
+            started.set()
+            release.wait(5)
+            return {"value": 1}
+
+        def follow():
+            calls.append("follower")
+            return {"value": 2}
+
+        results = []
+        leader = self.start(lead, results)
+        started.wait(5)
+        follower = self.start(follow, results)
+        self.wait_for(lambda: self.lock_table.stats.coalesced == 1)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(calls, ["leader"])
+        self.assertEqual(results, [{"value": 1}]*2)
+        self.assertEqual(self.lock_table.stats.to_dict(),
+                         {"leaders": 1, "coalesced": 1, "timeouts": 0})
+
+    def test_follower_timeout(self):
+        self.lock_table = self.table(timeout=0.2)
+        started, release = threading.Event(), threading.Event()
+
+        def lead():
+            started.set()
+            release.wait(5)
+            return "leader"
+
+        results = []
+        leader = self.start(lead, results)
+        started.wait(5)
+        self.assertEqual(self.lock_table.run("key", lambda: "follower"),
+                         "follower")
+        release.set()
+        leader.join()
+
+        self.assertEqual(self.lock_table.stats.timeouts, 1)
+
+    def test_leader_failure(self):
+        self.lock_table = self.table()
+        started, release = threading.Event(), threading.Event()
+
+        def lead():
+            started.set()
+            release.wait(5)
+            raise ValueError()
+
+        errors = []
+        def run_leader():
+            try:
+                self.lock_table.run("key", lead)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=run_leader)
+        leader.start()
+        started.wait(5)
+
+        results = []
+        follower = self.start(lambda: "follower", results)
+        self.wait_for(lambda: self.lock_table.stats.coalesced == 1)
+        release.set()
+        leader.join()
+        follower.join()
+
+        # Follower computes itself
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(results, ["follower"])
+
+    def test_sequential_calls_not_shared(self):
+        self.lock_table = self.table()
+        self.assertEqual(self.lock_table.run("key", lambda: 1), 1)
+        self.assertEqual(self.lock_table.run("key", lambda: 2), 2)
+        self.assertEqual(self.lock_table.stats.leaders, 2)
+
+class LocalLockTableTest(LockTableTestMixin, SimpleTestCase):
+    def table(self, timeout=5):
+        return singleflight.LocalLockTable(timeout=timeout)
+
+class FileLockTableTest(LockTableTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def table(self, timeout=5, **kwargs):
+        return singleflight.FileLockTable(self.path, timeout=timeout,
+                                          poll=0.01, **kwargs)
+
+    def test_result_only_written_for_waiters(self):
+        self.lock_table = self.table()
+        self.lock_table.run("key", lambda: 1)
+        self.assertEqual(sorted(os.listdir(self.path)), ["key.lock"])
+
+    def test_cleanup(self):
+        self.lock_table = self.table(max_age=60, cleanup_interval=0)
+        for key in ("old", "held", "new"):
+            self.lock_table.run(key, lambda: 1)
+        for name in ("old.lock", "held.lock"):
+            path = os.path.join(self.path, name)
+            os.utime(path, (time.time() - 120,)*2)
+
+        # A stale lock file still locked by a running leader is kept
+        fd = os.open(os.path.join(self.path, "held.lock"), os.O_RDWR)
+        try:
+            singleflight.fcntl.flock(fd, singleflight.fcntl.LOCK_EX)
+            self.lock_table._cleanup()
+        finally:
+            os.close(fd)
+
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ["held.lock", "new.lock"])
+        # Keys work as before
+        self.assertEqual(self.lock_table.run("old", lambda: 2), 2)
+
+
+
+class JobLifecycleTest(LocalJobsTestCase):
+    def fit_request(self):
+        return compare.specs(save_data(), "nmr")[0]
+
+    def get(self, name, id):
+        return self.client.get(reverse(name, kwargs={"id": id}))
+
+    def test_fit_and_monte_carlo(self):
+        job = jobs.submit(models.Job.KIND_FIT, self.fit_request(),
+                          client="test")
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, models.Job.STATUS_DONE)
+        self.assertEqual(job.progress, 1)
+        self.assertIsNotNone(job.started)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(job.priority, scheduler.PRIORITY_INTERACTIVE)
+
+        response = self.get("bindfit_fit_job", job.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))
+                         ["status"], "done")
+
+        response = self.get("bindfit_fit_job_result", job.id)
+        self.assertEqual(response.status_code, 200)
+        fit = json.loads(response.content.decode("utf-8"))
+        self.assertIn("params", fit["fit"])
+
+        mc = jobs.submit(models.Job.KIND_MC, {
+            "fit":     fit,
+            "options": {"n_iter": 5, "xdata_error": [0.01, 0.01],
+                        "ydata_error": 0.01, "seed": 0},
+            })
+        mc.refresh_from_db()
+        self.assertEqual(mc.status, models.Job.STATUS_DONE)
+        self.assertEqual(mc.priority, scheduler.PRIORITY_ANALYSIS)
+        params = json.loads(mc.result)
+        self.assertTrue(all("mc" in p for p in params.values()))
+
+    def test_failed(self):
+        job = jobs.submit(models.Job.KIND_FIT,
+                          dict(self.fit_request(), data_id="missing"))
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, models.Job.STATUS_FAILED)
+        self.assertTrue(job.error)
+        self.assertEqual(self.get("bindfit_fit_job_result",
+                                  job.id).status_code, 500)
+
+    def test_cancel(self):
+        with override_settings(
+                BINDFIT_JOBS={"BACKEND": "bindfit.jobs.DatabaseBackend"}):
+            jobs._backend = None
+            job = jobs.submit(models.Job.KIND_FIT, self.fit_request())
+        self.assertEqual(job.status, models.Job.STATUS_QUEUED)
+        self.assertEqual(self.get("bindfit_fit_job_result",
+                                  job.id).status_code, 202)
+
+        response = self.client.delete(reverse("bindfit_fit_job",
+                                              kwargs={"id": job.id}))
+        self.assertEqual(json.loads(response.content.decode("utf-8"))
+                         ["status"], "cancelled")
+        self.assertFalse(jobs.cancel(job.id))
+
+        # Cancelled jobs are never run
+        jobs.execute(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.STATUS_CANCELLED)
+        self.assertIsNone(job.started)
+
+    def test_claim_once(self):
+        with override_settings(
+                BINDFIT_JOBS={"BACKEND": "bindfit.jobs.DatabaseBackend"}):
+            jobs._backend = None
+            job = jobs.submit(models.Job.KIND_FIT, self.fit_request())
+
+        self.assertTrue(jobs.claim(job.id))
+        self.assertFalse(jobs.claim(job.id))
+
+    def test_unknown_job(self):
+        for id in ("00000000-0000-0000-0000-000000000000", "not-a-uuid"):
+            for name in ("bindfit_fit_job", "bindfit_fit_job_events",
+                         "bindfit_fit_job_result"):
+                self.assertEqual(self.get(name, id).status_code, 404)
+            response = self.client.delete(reverse("bindfit_fit_job",
+                                                  kwargs={"id": id}))
+            self.assertEqual(response.status_code, 404)
+
+
+
+class SchedulerTest(SimpleTestCase):
+    INTERACTIVE = scheduler.PRIORITY_INTERACTIVE
+    ANALYSIS    = scheduler.PRIORITY_ANALYSIS
+    BATCH       = scheduler.PRIORITY_BATCH
+
+    def entries(self, priority, n, client="a", start=0):
+        return [ scheduler.Entry("{}-{}".format(priority, start + i),
+                                 priority, client)
+                 for i in range(n) ]
+
+    def test_interactive_slots_reserved(self):
+        sched = scheduler.Scheduler(cpu_budget=2, interactive_slots=1)
+        self.assertEqual(sched.slots, 3)
+
+        # Analysis jobs only fill the CPU budget
+        queued = self.entries(self.ANALYSIS, 5)
+        running = sched.select(queued, [])
+        self.assertEqual(running, queued[:2])
+
+        # Leaving a slot for an interactive fit queued after them
+        queued = queued[2:] + self.entries(self.INTERACTIVE, 2)
+        selected = sched.select(queued, running)
+        self.assertEqual([ e.priority for e in selected ],
+                         [self.INTERACTIVE])
+
+    def test_priority_order(self):
+        sched = scheduler.Scheduler(cpu_budget=2, interactive_slots=1)
+        queued = (self.entries(self.BATCH, 2) + self.entries(self.ANALYSIS, 2)
+                  + self.entries(self.INTERACTIVE, 1))
+
+        selected = sched.select(queued, [])
+        self.assertEqual([ e.priority for e in selected ],
+                         [self.INTERACTIVE, self.ANALYSIS, self.ANALYSIS])
+
+    def test_class_limits(self):
+        sched = scheduler.Scheduler(cpu_budget=4, interactive_slots=1,
+                                    class_limits={"analysis": 1})
+        queued = self.entries(self.ANALYSIS, 3) + self.entries(self.BATCH, 3)
+
+        selected = sched.select(queued, [])
+        self.assertEqual([ e.priority for e in selected ],
+                         [self.ANALYSIS] + [self.BATCH]*3)
+
+        # Unlimited classes share the budget
+        sched = scheduler.Scheduler(cpu_budget=4, interactive_slots=1)
+        self.assertEqual(len(sched.select(self.entries(self.BATCH, 6), [])),
+                         4)
+
+    def test_fair_share(self):
+        sched = scheduler.Scheduler(cpu_budget=4, interactive_slots=0)
+        # Client a queued first
+        queued = (self.entries(self.BATCH, 4, client="a")
+                  + self.entries(self.BATCH, 4, client="b"))
+
+        selected = sched.select(queued, [])
+        self.assertEqual(sorted(e.client for e in selected),
+                         ["a", "a", "b", "b"])
+
+        # Client with fewer running jobs goes first
+        running = self.entries(self.BATCH, 2, client="a", start=10)
+        selected = sched.select(queued, running)
+        self.assertEqual([ e.client for e in selected ], ["b", "b"])
+
+        # Ties by queue order
+        self.assertEqual(selected[0], queued[4])
+
+    def test_should_yield(self):
+        sched = scheduler.Scheduler(cpu_budget=2, interactive_slots=1)
+        analysis = self.entries(self.ANALYSIS, 2)
+        interactive = self.entries(self.INTERACTIVE, 1)
+
+        self.assertFalse(sched.should_yield(analysis))
+        self.assertTrue(sched.should_yield(analysis + interactive))
+        self.assertFalse(sched.should_yield(analysis[:1] + interactive))
+
+class MonteCarloYieldTest(SimpleTestCase):
+    def test_pause_and_resume(self):
+        progress = jobs.MonteCarloProgress("job", ["k"])
+        # No progress report due during the test (no job row to write to)
+        progress._last = time.time() + 3600
+
+        event = threading.Event()
+        event.set()
+        done = threading.Event()
+        def iterate():
+            progress(1, 10, np.ones((1, 1)))
+            done.set()
+
+        jobs._yield_event = event
+        try:
+            t = threading.Thread(target=iterate)
+            t.start()
+
+            # Paused while interactive fits run
+            self.assertFalse(done.wait(0.3))
+
+            event.clear()
+            self.assertTrue(done.wait(5))
+            t.join()
+        finally:
+            jobs._yield_event = None
+
+
+
+class ArrayCodecTest(SimpleTestCase):
+    def array(self, *shape):
+        return np.random.RandomState(0).rand(*shape)
+
+    def test_round_trip(self):
+        for array in (self.array(2, 20), self.array(1, 5, 20),
+                      self.array(0, 3)):
+            for compress in (False, True):
+                blob = arraycodec.encode(array, compress)
+                self.assertEqual(blob.startswith(arraycodec.ZLIB_MAGIC),
+                                 compress)
+
+                decoded = arraycodec.decode(blob)
+                np.testing.assert_array_equal(decoded, array)
+                self.assertEqual(decoded.dtype, arraycodec.DTYPE)
+                self.assertFalse(decoded.flags.writeable)
+
+        # memoryview, as returned by BinaryField on some backends
+        blob = arraycodec.encode(self.array(2, 3))
+        np.testing.assert_array_equal(arraycodec.decode(memoryview(blob)),
+                                      self.array(2, 3))
+
+    def test_fortran_order(self):
+        array = np.asfortranarray(self.array(3, 7))
+        np.testing.assert_array_equal(
+                arraycodec.decode(arraycodec.encode(array)), array)
+
+        # Fortran ordered .npy written elsewhere
+        f = io.BytesIO()
+        np.lib.format.write_array(f, array, version=(1, 0))
+        np.testing.assert_array_equal(arraycodec.decode(f.getvalue()), array)
+
+    def test_converts_to_float64(self):
+        array = np.arange(6, dtype="int32").reshape(2, 3)
+        decoded = arraycodec.decode(arraycodec.encode(array))
+        self.assertEqual(decoded.dtype, arraycodec.DTYPE)
+        np.testing.assert_array_equal(decoded, array)
+
+    def test_wrong_dtype(self):
+        for dtype in ("<f4", ">f8", "<i8"):
+            f = io.BytesIO()
+            np.lib.format.write_array(f, np.zeros((2, 3), dtype=dtype))
+            with self.assertRaises(ValueError):
+                arraycodec.decode(f.getvalue())
+
+        with self.assertRaises(ValueError):
+            arraycodec.decode(b"not an array")
+
+class DataStorageTest(TestCase):
+    def arrays(self):
+        x, y, _ = synthetic_data("nmr1to1", 15, 3)
+        return x, y[np.newaxis]
+
+    def test_storage_formats(self):
+        x, y = self.arrays()
+        for storage in ("array", "binary"):
+            for compress in (False, True):
+                models.Data.from_arrays("data", x, y, ["h", "g"],
+                                        ["a", "b", "c"], storage=storage,
+                                        compress=compress).save()
+                data = models.Data.objects.get(id="data")
+
+                self.assertEqual(data.x_blob is not None,
+                                 storage == "binary")
+                np.testing.assert_array_equal(data.x_array(), x)
+                np.testing.assert_array_equal(data.y_array(), y)
+                np.testing.assert_array_equal(data.y_array(0), y[0])
+
+    def test_migration(self):
+        migration = import_module(
+                "bindfit.migrations.0014_data_binary_arrays")
+        x, y = self.arrays()
+        models.Data.from_arrays("data", x, y, ["h", "g"], ["a", "b", "c"],
+                                storage="array").save()
+
+        migration.encode_arrays(apps, None)
+        data = models.Data.objects.get(id="data")
+        self.assertIsNone(data.x)
+        self.assertIsNone(data.y)
+        np.testing.assert_array_equal(data.x_array(), x)
+        np.testing.assert_array_equal(data.y_array(), y)
+        # Current codec reads the migration's format
+        np.testing.assert_array_equal(arraycodec.decode(data.y_blob), y)
+
+        migration.decode_arrays(apps, None)
+        data = models.Data.objects.get(id="data")
+        self.assertIsNone(data.x_blob)
+        self.assertIsNone(data.y_blob)
+        np.testing.assert_array_equal(np.array(data.x), x)
+        np.testing.assert_array_equal(data.y_array(), y)
+
+
+
+class FitCacheKeyTest(SimpleTestCase):
+    def params(self, reverse=False):
+        items = [("k11", {"init": 100., "bounds": {"min": 0., "max": None},
+                          "value": 1.}),
+                 ("k12", {"init": 10.,  "bounds": {"max": None, "min": 0.}})]
+        return OrderedDict(reversed(items) if reverse else items)
+
+    def test_stable_under_ordering(self):
+        options = OrderedDict([("dilute", False), ("method", ""),
+                               ("normalise", True)])
+        key = cache.key("data", "nmr1to2", options, self.params())
+
+        self.assertEqual(key, cache.key("data", "nmr1to2",
+                                        OrderedDict(reversed(options.items())),
+                                        self.params(reverse=True)))
+        # Defaults are canonicalised, results are ignored
+        self.assertEqual(key, cache.key("data", "nmr1to2", {},
+                                        self.params()))
+
+        params = self.params()
+        params["k11"]["init"] = 101.
+        self.assertNotEqual(key, cache.key("data", "nmr1to2", options,
+                                           params))
+
+    def test_model_version(self):
+        def key(version):
+            cache._model_version = None
+            with self.settings(BINDFIT_MODEL_VERSION=version):
+                return cache.key("data", "nmr1to2", {}, self.params())
+
+        try:
+            self.assertEqual(key("1"), key("1"))
+            self.assertNotEqual(key("1"), key("2"))
+        finally:
+            cache._model_version = None
+
+class FitCacheBackendTest(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def check_lru(self, backend, age=lambda key: None):
+        # Room for two 40 byte values
+        for key in ("a", "b"):
+            backend.set(key, key.encode()*40)
+            age(key)
+        # Use a, so b is least recently used
+        self.assertEqual(backend.get("a"), b"a"*40)
+        backend.set("c", b"c"*40)
+
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), b"a"*40)
+        self.assertEqual(backend.get("c"), b"c"*40)
+        self.assertEqual(backend.evictions, 1)
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.size, 80)
+
+        # Values larger than the whole cache aren't stored
+        backend.set("d", b"d"*101)
+        self.assertIsNone(backend.get("d"))
+
+    def test_locmem(self):
+        self.check_lru(cache.LocMemBackend(max_size=100))
+
+    def test_file(self):
+        backend = cache.FileBackend(self.path, max_size=100)
+        times = iter(range(2))
+        # Distinct modification times, older than reads
+        def age(key):
+            t = time.time() - 100 + next(times)
+            os.utime(backend._path(key), (t, t))
+        self.check_lru(backend, age)
+
+    def test_django_cache(self):
+        # Eviction is left to the Django cache
+        backend = cache.DjangoCacheBackend()
+        backend.set("a", b"a"*40)
+        self.assertEqual(backend.get("a"), b"a"*40)
+        self.assertIsNone(backend.get("b"))
+
+class FitCacheTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_hit(self):
+        fit_cache = cache.get_cache()
+        stats = fit_cache.stats()
+        spec = compare.specs(save_data(), "nmr")[0]
+
+        response = FitView.run(json.loads(json.dumps(spec)))
+        self.assertFalse(response["cached"])
+        self.assertIsNotNone(response["diagnostics"])
+
+        response = FitView.run(json.loads(json.dumps(spec)))
+        self.assertTrue(response["cached"])
+        self.assertIsNone(response["diagnostics"])
+
+        new = fit_cache.stats()
+        self.assertEqual(new["hits"]   - stats["hits"],   1)
+        self.assertEqual(new["misses"] - stats["misses"], 1)
+        self.assertEqual(new["sets"]   - stats["sets"],   1)
+
+class DjangoCacheStoreLockTest(SimpleTestCase):
+    def setUp(self):
+        self.store = sessions.DjangoCacheStore(lock_timeout=60, lock_wait=0.2)
+
+    def tearDown(self):
+        self.store.cache.clear()
+
+    def test_per_session(self):
+        # Different sessions don't block each other
+        with self.store.lock("a"):
+            with self.store.lock("b"):
+                pass
+
+    def test_exclusive(self):
+        with self.store.lock("a"):
+            with self.assertRaises(sessions.SessionBusy):
+                with self.store.lock("a"):
+                    pass
+        # Released on exit
+        with self.store.lock("a"):
+            pass
+
+    def test_waits_for_release(self):
+        acquired = threading.Event()
+        def hold():
+            with self.store.lock("a"):
+                acquired.set()
+                time.sleep(0.05)
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait()
+        with self.store.lock("a"):
+            pass
+        thread.join()
+
+    def test_expired(self):
+        # A lock left by a dead holder expires
+        self.store.lock_timeout = 1
+        self.store.lock("a").__enter__()
+        self.store.lock_wait = 2
+        with self.store.lock("a"):
+            pass
+
+class DataCacheTest(TestCase):
+    def setUp(self):
+        self.data_id = save_data()
+        datacache.get_cache().clear()
+
+    def test_lru_by_size(self):
+        data_cache = datacache.DataCache(timeout=None)
+        data_cache.get(self.data_id, "nmr1to1")
+        size = data_cache.size
+
+        # Room for two entries of this size
+        data_cache.max_size = 2*size
+        data_cache.get(self.data_id, "nmr1to1", dilute=True)
+        self.assertEqual(data_cache.size, 2*size)
+
+        # Use the first, so the diluted entry is least recently used
+        data_cache.get(self.data_id, "nmr1to1")
+        data_cache.get(self.data_id, "nmr1to2")
+
+        self.assertEqual(data_cache.evictions, 1)
+        self.assertEqual(data_cache.size, 2*size)
+        stats = data_cache.stats()
+        data_cache.get(self.data_id, "nmr1to1")
+        data_cache.get(self.data_id, "nmr1to1", dilute=True)
+        self.assertEqual(data_cache.hits   - stats["hits"],   1)
+        self.assertEqual(data_cache.misses - stats["misses"], 1)
+
+    def test_timeout(self):
+        data_cache = datacache.DataCache(timeout=10)
+        data_cache.get(self.data_id, "nmr1to1")
+        data_cache.get(self.data_id, "nmr1to1")
+        self.assertEqual(data_cache.hits, 1)
+
+        for entry in data_cache._store.values():
+            entry.time -= 11
+        data_cache.get(self.data_id, "nmr1to1")
+        self.assertEqual(data_cache.hits, 1)
+        self.assertEqual(data_cache.misses, 2)
+
+    def test_invalidated_on_save(self):
+        datacache.get(self.data_id, "nmr1to1")
+
+        data = models.Data.objects.get(id=self.data_id)
+        data.labels_x = [ "new" ]*len(data.labels_x)
+        data.save()
+        self.assertEqual(datacache.get_cache().stats()["entries"], 0)
+
+        labels = datacache.get(self.data_id, "nmr1to1")["labels"]["data"]
+        self.assertEqual(labels["x"]["row_labels"], data.labels_x)
+
+    def test_read_only(self):
+        for _ in range(2):
+            # Both the parsed (miss) and the cached (hit) arrays
+            data = datacache.get(self.data_id, "nmr1to1")["data"]
+            for key in ("x", "x_plot", "y"):
+                with self.assertRaises(ValueError):
+                    data[key][0] = 0
+
+    def test_spans(self):
+        trace = tracing.Trace("test")
+        tracing._local.trace = trace
+        try:
+            datacache.get(self.data_id, "nmr1to1")
+            datacache.get(self.data_id, "nmr1to1")
+        finally:
+            tracing._local.trace = None
+
+        self.assertEqual([ s.name for s in trace.spans ],
+                         ["data-fetch", "data-to-dict", "data-cache-hit"])
+
+class FitGlobalTest(TestCase):
+    def post(self, fitter, datasets, spec):
+        return self.client.post(reverse("bindfit_fit_global"),
+                                 json.dumps({"fitter":   fitter,
+                                             "datasets": datasets,
+                                             "params":   spec["params"],
+                                             "options":  spec["options"]}),
+                                 content_type="application/json")
+
+    def test_matches_separate_fit(self):
+        data_id = save_data()
+        spec = compare.specs(data_id, "nmr")[0]
+        separate = FitView.run(json.loads(json.dumps(spec)))
+
+        # One dataset, and the same dataset twice
+        for n in (1, 2):
+            response = self.post(spec["fitter"],
+                                 [{"data_id": data_id}]*n, spec)
+            self.assertEqual(response.status_code, 200)
+            result = json.loads(response.content.decode("utf-8"))
+
+            self.assertEqual(len(result["datasets"]), n)
+            for key, param in result["params"].items():
+                self.assertAlmostEqual(
+                        param["value"]/separate["fit"]["params"][key]["value"],
+                        1., places=4)
+
+    def test_invalid(self):
+        data_id = save_data()
+        spec = compare.specs(data_id, "nmr")[0]
+
+        # Not a binding or aggregation fitter
+        for fitter in ("inhibitor", "nmrdata", "unknown"):
+            response = self.post(fitter, [{"data_id": data_id}], spec)
+            self.assertEqual(response.status_code, 400)
+
+        for datasets in ([], [{"data_id": data_id, "block": 1}],
+                         [{"data_id": data_id, "block": -1}],
+                         [{"data_id": data_id, "block": "0"}]):
+            response = self.post(spec["fitter"], datasets, spec)
+            self.assertEqual(response.status_code, 400)
+
+class FitLandscapeTest(TestCase):
+    def post(self, refine):
+        return self.client.post(
+                reverse("bindfit_fit_landscape"),
+                json.dumps({"fitter":  "nmr1to2",
+                            "data_id": save_data("nmr1to2"),
+                            "axes":    [{"name": "k1", "min": 1, "max": 1e4,
+                                         "n": 5},
+                                        {"name": "k2", "min": 1, "max": 1e4,
+                                         "n": 5}],
+                            "refine":  refine}),
+                content_type="application/json")
+
+    @override_settings(BINDFIT_LANDSCAPE={"MAX_REFINE": 2})
+    def test_refine_limit(self):
+        response = self.post(2)
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content.decode("utf-8"))
+        self.assertLessEqual(len(result["grids"]), 3)
+
+        for refine in (3, -1, "many", None):
+            self.assertEqual(self.post(refine).status_code, 400)
@@ -0,0 +1,218 @@
+"""
+" Request tracing
+"
+" TracingMiddleware starts a trace for a sampled fraction of requests. Code
+" along the fitting pipeline opens nested spans with span(), which are no-ops
+" for unsampled requests. Finished traces are passed to a sink (an in-memory
+" ring buffer or the log) and summarised in a Server-Timing response header.
+" Configured by settings.BINDFIT_TRACING.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import json
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+DEFAULT_SETTINGS = {
+        "SAMPLE_RATE":   0.0,  # Fraction of requests traced
+        "SINK":          "bindfit.tracing.RingBufferSink",
+        "OPTIONS":       {"size": 1000},
+        "SERVER_TIMING": True, # Add Server-Timing header to traced responses
+        }
+
+def config():
+    return getattr(settings, "BINDFIT_TRACING", DEFAULT_SETTINGS)
+
+_local = threading.local()
+
+class Span(object):
+    __slots__ = ("name", "parent", "start", "duration")
+
+    def __init__(self, name, parent, start):
+        self.name     = name
+        self.parent   = parent # Index of parent span in Trace.spans, or None
+        self.start    = start
+        self.duration = None
+
+class Trace(object):
+    def __init__(self, name):
+        self.name   = name
+        self.spans  = []
+        self._stack = []
+        self._t0    = time.perf_counter()
+        self.time   = time.time()
+
+    def open(self, name):
+        parent = self._stack[-1] if self._stack else None
+        self.spans.append(Span(name, parent, time.perf_counter()))
+        self._stack.append(len(self.spans) - 1)
+        return len(self.spans) - 1
+
+    def close(self, index):
+        span = self.spans[index]
+        span.duration = time.perf_counter() - span.start
+        # Close any spans left open inside this one
+        while self._stack and self._stack.pop() != index:
+            pass
+
+    def to_dict(self):
+        return {
+                "name":  self.name,
+                "time":  self.time,
+                "spans": [ {"name":     s.name,
+                            "parent":   s.parent,
+                            "start":    s.start - self._t0,
+                            "duration": s.duration}
+                           for s in self.spans ],
+                }
+
+    def server_timing(self):
+        """
+        Server-Timing header value with the total duration of each span name
+        (ms), in order of first occurrence.
+        """
+        totals = {}
+        order = []
+        for s in self.spans:
+            if s.duration is None:
+                continue
+            if s.name not in totals:
+                totals[s.name] = 0
+                order.append(s.name)
+            totals[s.name] += s.duration
+
+        return ", ".join("{};dur={:.2f}".format(name, totals[name]*1000)
+                         for name in order)
+
+def current():
+    """
+    Return the calling thread's active Trace, or None if not sampled.
+    """
+    return getattr(_local, "trace", None)
+
+@contextmanager
+def span(name):
+    """
+    Time the block as a span of the current trace, nested in any enclosing
+    span. Does nothing if the current request isn't traced.
+    """
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        yield
+        return
+
+    index = trace.open(name)
+    try:
+        yield
+    finally:
+        trace.close(index)
+
+
+
+#
+# Sinks
+#
+
+class RingBufferSink(object):
+    """
+    Keep the most recent size traces in memory (per process).
+    """
+
+    def __init__(self, size=1000):
+        self.traces = deque(maxlen=size)
+
+    def emit(self, trace):
+        self.traces.append(trace.to_dict())
+
+    def recent(self, n=100):
+        return list(self.traces)[-n:]
+
+class LogSink(object):
+    """
+    Log each trace as a JSON line at INFO level.
+    """
+
+    def __init__(self, logger_name="supramolecular.tracing"):
+        self.logger = logging.getLogger(logger_name)
+
+    def emit(self, trace):
+        self.logger.info(json.dumps(trace.to_dict(), sort_keys=True))
+
+    def recent(self, n=100):
+        return []
+
+_sink = None
+
+def get_sink():
+    """
+    Return process-wide trace sink configured from settings.BINDFIT_TRACING.
+    """
+    global _sink
+
+    if _sink is None:
+        conf = config()
+        cls = import_string(conf.get("SINK", DEFAULT_SETTINGS["SINK"]))
+        _sink = cls(**conf.get("OPTIONS", {}))
+
+    return _sink
+
+
+
+#
+# Middleware
+#
+
+class TracingMiddleware(object):
+    """
+    Trace a sampled fraction of requests, with a root span for the whole
+    request and a "render" span for response rendering. Place first in
+    MIDDLEWARE_CLASSES to include all other middleware.
+    """
+
+    def process_request(self, request):
+        _local.trace = None
+
+        if random.random() < config().get("SAMPLE_RATE", 0.0):
+            trace = Trace("{} {}".format(request.method, request.path))
+            _local.trace = trace
+            request._trace_span = trace.open("request")
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns, time it
+        trace = current()
+        if trace is not None:
+            index = trace.open("render")
+            def rendered(response):
+                trace.close(index)
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        trace = current()
+        _local.trace = None
+
+        if trace is None or not hasattr(request, "_trace_span"):
+            return response
+
+        trace.close(request._trace_span)
+
+        try:
+            get_sink().emit(trace)
+        except Exception:
+            logger.exception("TracingMiddleware: trace sink failed")
+
+        if config().get("SERVER_TIMING", True):
+            response["Server-Timing"] = trace.server_timing()
+
+        return response
@@ -4,10 +4,52 @@ from . import views
 
 urlpatterns = [
     url(r'^fit$',      views.FitView.as_view(),         name="bindfit_fit"),
+    url(r'^fit/global$',
+                       views.FitGlobalView.as_view(),
+                       name="bindfit_fit_global"),
+    url(r'^fit/landscape$',
+                       views.FitLandscapeView.as_view(),
+                       name="bindfit_fit_landscape"),
+    url(r'^fit/sessions$',
+                       views.FitSessionView.as_view(),
+                       name="bindfit_fit_sessions"),
+    url(r'^fit/sessions/(?P<id>[0-9a-zA-Z-]+)$',
+                       views.FitSessionDetailView.as_view(),
+                       name="bindfit_fit_session"),
+    url(r'^fit/batch$',views.FitBatchView.as_view(),    name="bindfit_fit_batch"),
+    url(r'^fit/batch/(?P<id>[0-9a-zA-Z-]+)$',
+                       views.FitBatchStatusView.as_view(),
+                       name="bindfit_fit_batch_status"),
+    url(r'^fit/compare$',
+                       views.FitCompareView.as_view(),
+                       name="bindfit_fit_compare"),
+    url(r'^fit/plate$',views.FitPlateView.as_view(),    name="bindfit_fit_plate"),
     url(r'^fit/extras/mc$',
                        views.FitMonteCarloView.as_view(),
                        name="bindfit_fit_save"),
     url(r'^fit/save$', views.FitSaveView.as_view(),     name="bindfit_fit_save"),
+    url(r'^fit/cache/stats$',
+                       views.FitCacheStatsView.as_view(),
+                       name="bindfit_fit_cache_stats"),
+    url(r'^fit/metrics$',
+                       views.FitMetricsView.as_view(),
+                       name="bindfit_fit_metrics"),
+    url(r'^fit/traces$',
+                       views.FitTracesView.as_view(),
+                       name="bindfit_fit_traces"),
+    url(r'^fit/jobs$', views.FitJobView.as_view(),      name="bindfit_fit_jobs"),
+    url(r'^fit/jobs/stats$',
+                       views.FitJobStatsView.as_view(),
+                       name="bindfit_fit_job_stats"),
+    url(r'^fit/jobs/(?P<id>[0-9a-zA-Z-]+)$',
+                       views.FitJobStatusView.as_view(),
+                       name="bindfit_fit_job"),
+    url(r'^fit/jobs/(?P<id>[0-9a-zA-Z-]+)/events$',
+                       views.FitJobEventsView.as_view(),
+                       name="bindfit_fit_job_events"),
+    url(r'^fit/jobs/(?P<id>[0-9a-zA-Z-]+)/result$',
+                       views.FitJobResultView.as_view(),
+                       name="bindfit_fit_job_result"),
     url(r'^edit$',     views.FitEditEmailView.as_view(),name="bindfit_edit"),
     url(r'^search$',   views.FitSearchView.as_view(),   name="bindfit_search"),
     url(r'^search/options$',  
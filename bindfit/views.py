@@ -1,13 +1,16 @@
 import os
+import json
 import string
 import random
 import datetime
 import uuid
+import time
 
 import pandas as pd
 import numpy  as np
 
 from django.core.mail import send_mail
+from django.http import HttpResponse, StreamingHttpResponse
 # For email validation on save
 from django.core.validators import validate_email
 # For email validation exception
@@ -19,6 +22,7 @@ from rest_framework.views import APIView
 from rest_framework.parsers import JSONParser, MultiPartParser 
 
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework import status
 
 from haystack.query  import SearchQuerySet
@@ -31,6 +35,21 @@ from . import models
 from . import formatter
 from . import functions
 from . import helpers 
+from . import cache
+from . import datacache
+from . import singleflight
+from . import jobs
+from . import batch
+from . import compare
+from . import plate
+from . import landscape
+from . import diagnostics
+from . import tracing
+from . import sessions
+from . import metrics
+from . import capture
+from . import globalfit
+from .globalfit import GlobalFitter
 from .fitter import Fitter
 
 import logging
@@ -81,33 +100,118 @@ class FitView(APIView):
             time:
             options:
                 dilute:
+            cached:         bool  True if response was served from the fit
+                                  cache
         """
 
         logger.debug("FitView.post: called")
 
-        # Parse request options
-        fitter_name = request.data["fitter"]
-
-        # Get input data to fit from database
-        dilute = request.data["options"]["dilute"] # Dilution factor flag
-                                                   # used for data retrieval
-
         try:
-            data = models.Data.objects.get(id=request.data["data_id"]).to_dict(
-                    fitter=fitter_name,
-                    dilute=dilute)
+            response = self.run(request.data)
         except exceptions.ObjectDoesNotExist:
             return Response({"detail": "Input data not given."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        logger.debug("views.FitView: data.to_dict() after retrieving")
-        logger.debug(data)
+        return Response(response)
 
-        datax = data["data"]["x"]
-        datay = data["data"]["y"]
+    @classmethod
+    def run(cls, request_data, callback=None):
+        """
+        Run (or retrieve cached) fit for a FitView request body and return the
+        response dict. Raises ObjectDoesNotExist if the data ID is unknown.
+
+        Arguments:
+            callback: Optional progress callback passed to Fitter.run_scipy
+        """
+
+        # Parse request options
+        fitter_name = request_data["fitter"]
+        data_id     = request_data["data_id"]
 
+        dilute = request_data["options"]["dilute"] # Dilution factor flag
+                                                   # used for data retrieval
+        # "Normalise" y data flag, i.e. subtract initial values from y data 
+        # (silly name choice, sorry)
+        normalise = request_data["options"].get("normalise", True)
+        # Chosen fitter "flavour" option if given
+        flavour   = request_data["options"].get("flavour",   "")
+        # Chosen fitter method if given
+        method    = request_data["options"].get("method",    "")
+
+        params = cls.parse_params(request_data["params"])
+
+        # Return previously calculated fit for identical input if available
+        fit_cache = cache.get_cache()
+        cache_key = cache.key(data_id, fitter_name, 
+                              request_data["options"], params)
+        with tracing.span("cache-get"):
+            response = fit_cache.get(cache_key)
+        if response is not None:
+            logger.debug("FitView.run: serving cached fit")
+            metrics.inc("bindfit_fit_cache_requests_total", result="hit")
+            response["cached"] = True
+            # No fitting work was done for this request
+            response["diagnostics"] = None
+            return response
+
+        metrics.inc("bindfit_fit_cache_requests_total", result="miss")
+
+        def fit():
+            # Numerical work counters and phase timings of this fit
+            with diagnostics.collect() as diag:
+                # Get input data to fit from database
+                with diag.phase("load"):
+                    data = datacache.get(data_id, fitter_name, dilute=dilute)
+
+                logger.debug("views.FitView: data.to_dict() after retrieving")
+                logger.debug(data)
+
+                datax = data["data"]["x"]
+                datay = data["data"]["y"]
+
+                # Create and run appropriate fitter, saving its inputs for
+                # replay if slow
+                with capture.watch(fitter_name, datax, datay,
+                                   request_data["options"], params) as case:
+                    with diag.phase("preprocess"), tracing.span("construct"):
+                        fitter = cls.create_fitter(fitter_name, datax, datay, 
+                                                   normalise, flavour)
+                    with tracing.span("run-scipy"):
+                        start = time.perf_counter()
+                        fitter.run_scipy(params, method=method, 
+                                         callback=callback)
+                        metrics.observe("bindfit_fit_duration_seconds",
+                                        time.perf_counter() - start,
+                                        fitter=fitter_name,
+                                        method=method or "default",
+                                        flavour=flavour or "none")
+                    if case is not None:
+                        case.finish(fitter, diag)
+                
+                # Build response dict
+                with diag.phase("format"), tracing.span("format"):
+                    response = cls.build_response(
+                            fitter_name, fitter, data, 
+                            dilute, normalise, method, flavour,
+                            bands=request_data["options"].get("bands", False))
+
+            diagnostics.log(fitter_name, diag)
+            metrics.inc("bindfit_objective_evaluations_total",
+                        diag.counters.get("objective", 0),
+                        fitter=fitter_name)
+
+            # Diagnostics describe this request's work only, so aren't 
+            # cached
+            fit_cache.set(cache_key, response)
+            response["diagnostics"] = formatter.diagnostics(diag)
+            return response
+
+        # Identical concurrent requests share a single fit
+        return singleflight.get_lock_table().run("fit-"+cache_key, fit)
+
+    @staticmethod
+    def parse_params(params):
         # Parse params to appropriate types
-        params = request.data["params"]
         for key in params:
             parsed = {
                     "init": float(params[key]["init"]),
@@ -128,26 +232,27 @@ class FitView(APIView):
         logger.debug("views.FitView: params parsed:")
         logger.debug(params)
 
-        # "Normalise" y data flag, i.e. subtract initial values from y data 
-        # (silly name choice, sorry)
-        normalise = request.data["options"].get("normalise", True)
-        # Chosen fitter "flavour" option if given
-        flavour   = request.data["options"].get("flavour",   "")
-        # Chosen fitter method if given
-        method    = request.data["options"].get("method",    "")
-
-        # Create and run appropriate fitter
-        fitter = self.create_fitter(fitter_name, datax, datay, normalise, flavour)
-        fitter.run_scipy(params, method=method)
-        
-        # Build response dict
-        response = self.build_response(fitter_name, fitter, data, 
-                                       dilute, normalise, method, flavour)
-        return Response(response)
+        return params
 
     @staticmethod
     def build_response(fitter_name, fitter, data, 
-                       dilute, normalise, method, flavour):
+                       dilute, normalise, method, flavour, bands=False):
+        """
+        Arguments:
+            bands: bool or dict  Include confidence and prediction bands
+                                 (see Fitter.bands). A dict may give the
+                                 number of dense grid "points" and the
+                                 confidence "level" (default 0.95).
+        """
+        bands_response = None
+        if bands:
+            bands = bands if isinstance(bands, dict) else {}
+            level = float(bands.get("level", 0.95))
+            b = fitter.bands(points=bands.get("points", None), level=level)
+            bands_response = formatter.bands(b["x"],
+                                             fitter.function.format_x(b["x"]),
+                                             b["y"], b["ci"], b["pi"], level)
+
         # Combined fitter and data dictionaries
         response = formatter.fit(fitter      =fitter_name,
                                  data        =data,
@@ -162,7 +267,8 @@ class FitView(APIView):
                                  dilute      =dilute,
                                  normalise   =normalise,
                                  method      =method,
-                                 flavour     =flavour)
+                                 flavour     =flavour,
+                                 bands       =bands_response)
         return response
 
     @staticmethod
@@ -176,6 +282,428 @@ class FitView(APIView):
 
 
 
+class FitSessionView(APIView):
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        """
+        Open an incremental fitting session
+
+        Request:
+            fitter:   string  Fitter key
+            params:   dict    Initial parameters, as for FitView
+            options:  dict    As for FitView
+            labels:   dict    Optional x and y row labels, as returned by 
+                              upload
+
+        Response:
+            See formatter.session
+        """
+        labels = request.data.get("labels", {})
+
+        session = sessions.Session(
+                request.data["fitter"],
+                FitView.parse_params(request.data["params"]),
+                request.data["options"],
+                labels_x=labels.get("x", None),
+                labels_y=labels.get("y", None))
+        sessions.get_store().add(session)
+
+        return Response(formatter.session(session.id, 
+                                          session.fitter_name,
+                                          session.n_points,
+                                          session.n_fits))
+
+
+
+class FitSessionDetailView(APIView):
+    parser_classes = (JSONParser,)
+
+    def get(self, request, id):
+        try:
+            session = sessions.get_store().get(id)
+        except sessions.SessionNotFound:
+            return Response({"detail": "Session not found or expired."},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        return Response(formatter.session(session.id, 
+                                          session.fitter_name,
+                                          session.n_points,
+                                          session.n_fits))
+
+    def post(self, request, id):
+        """
+        Append points and refit
+
+        Request:
+            x: array  x x k x data of k new points
+            y: array  y x k y data of k new points
+
+        Response:
+            See formatter.session
+        """
+        store = sessions.get_store()
+
+        error = None
+        try:
+            with store.lock(id):
+                session = store.get(id)
+                try:
+                    fitter = session.append(request.data["x"], 
+                                            request.data["y"])
+                except np.linalg.LinAlgError as e:
+                    # Points are kept, typically too few yet for a stable 
+                    # fit
+                    fitter = None
+                    error = "Fit failed: {}".format(e)
+                store.save(session)
+        except sessions.SessionNotFound:
+            return Response({"detail": "Session not found or expired."},
+                            status=status.HTTP_404_NOT_FOUND)
+        except sessions.SessionBusy:
+            return Response({"detail": "Session busy, retry later."},
+                            status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({"detail": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fit = None
+        if fitter is not None:
+            options = session.options
+            data = formatter.data(session.id,
+                                  fitter.xdata,
+                                  fitter.function.format_x(fitter.xdata),
+                                  fitter.ydata,
+                                  session.labels_x,
+                                  session.labels_y)
+            fit = FitView.build_response(session.fitter_name, fitter, data,
+                                         options["dilute"],
+                                         options.get("normalise", True),
+                                         options.get("method",    ""),
+                                         options.get("flavour",   ""))
+
+        return Response(formatter.session(session.id, 
+                                          session.fitter_name,
+                                          session.n_points,
+                                          session.n_fits,
+                                          fit=fit,
+                                          error=error))
+
+    def delete(self, request, id):
+        sessions.get_store().delete(id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+
+class FitGlobalView(APIView):
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        """
+        Request:
+            fitter:   string  Fitter key
+            datasets: array   Datasets to fit together:
+                data_id: string  Input data ID
+                block:   int     Optional index of y data block (default 0)
+            params:   dict    Shared parameters, as for FitView
+            options:  dict    As for FitView
+
+        Response:
+            See formatter.fit_global. Each dataset has a full FitView 
+            response with its own fit, coefficients and residuals.
+        """
+        fitter_name = request.data["fitter"]
+        datasets    = request.data["datasets"]
+        options     = request.data["options"]
+
+        if fitter_name not in globalfit.FITTERS:
+            return Response({"detail": "Global fitting requires a binding or "
+                                       "aggregation fitter."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        blocks = [ d.get("block", 0) for d in datasets ]
+        if not datasets or \
+                not all(isinstance(b, int) and not isinstance(b, bool) 
+                        and b >= 0 for b in blocks):
+            return Response({"detail": "Datasets must be a non-empty list "
+                                       "with non-negative integer blocks."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        dilute    = options["dilute"]
+        normalise = options.get("normalise", True)
+        flavour   = options.get("flavour",   "")
+        method    = options.get("method",    "")
+
+        params = FitView.parse_params(request.data["params"])
+
+        try:
+            data = [ datacache.get(d["data_id"], fitter_name,
+                                   dilute=dilute,
+                                   block=b)
+                     for d, b in zip(datasets, blocks) ]
+        except exceptions.ObjectDoesNotExist:
+            return Response({"detail": "Input data not found."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except IndexError:
+            return Response({"detail": "Data block not found."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with diagnostics.collect() as diag:
+            with diag.phase("preprocess"):
+                function = functions.construct(fitter_name, 
+                                               normalise=normalise, 
+                                               flavour=flavour)
+                fitter = GlobalFitter([ (d["data"]["x"], d["data"]["y"]) 
+                                        for d in data ],
+                                      function, 
+                                      normalise=normalise)
+            fitter.run_scipy(params, method=method)
+
+            with diag.phase("format"):
+                responses = [ FitView.build_response(fitter_name, f, d, 
+                                                     dilute, normalise, 
+                                                     method, flavour)
+                              for f, d in zip(fitter.fitters, data) ]
+
+        response = formatter.fit_global(fitter_name,
+                                        fitter.params,
+                                        responses,
+                                        fitter.time,
+                                        dilute=dilute,
+                                        normalise=normalise,
+                                        method=method,
+                                        flavour=flavour)
+        response["diagnostics"] = formatter.diagnostics(diag)
+        diagnostics.log(fitter_name, diag)
+
+        return Response(response)
+
+
+
+class FitBatchView(APIView):
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        """
+        Request:
+            fits:   array  FitView request bodies
+            stream: bool   If true, stream newline delimited JSON results as
+                           they complete instead of returning all results in
+                           order
+            async:  bool   If true, return a batch ID without waiting for
+                           the results. Always the case for batches larger
+                           than BINDFIT_BATCH SYNC_MAX.
+            client: string Optional client name for fair share scheduling
+                           of the fit jobs, defaults to the remote address
+
+        Response:
+            results:  array  For each fit, in order:
+                index:  int     Position in fits
+                status: string  "ok" or "error"
+                result: dict    FitView response
+                error:  string  Error message
+            n_failed: int    Number of failed fits
+
+            Or for asynchronous batches (202), formatter.batch_status, also
+            returned by FitBatchStatusView
+        """
+        specs  = request.data["fits"]
+        stream = request.data.get("stream", False)
+
+        max_items = batch.config().get("MAX_ITEMS", 500)
+        if len(specs) > max_items:
+            return Response(
+                    {"detail": "Batch limited to {} fits.".format(max_items)},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        # Client for fair share scheduling of the batch's fit jobs
+        client = request.data.get("client", None) or \
+                 request.META.get("REMOTE_ADDR", "")
+
+        # Don't hold a web worker for the whole of a large batch
+        if request.data.get("async", False) or \
+                len(specs) > batch.config().get("SYNC_MAX", 20):
+            batch_id = batch.submit(specs, client=client)
+            return Response(batch.status(batch_id),
+                            status=status.HTTP_202_ACCEPTED)
+
+        if stream:
+            lines = ( json.dumps(item, cls=JSONEncoder)+"\n"
+                      for item in batch.run(specs, ordered=False,
+                                            client=client) )
+            return StreamingHttpResponse(lines,
+                                         content_type="application/x-ndjson")
+
+        return Response(formatter.batch(list(batch.run(specs,
+                                                       client=client))))
+
+
+
+class FitBatchStatusView(APIView):
+    # Progress and results of an asynchronous batch, DELETE cancels its
+    # unfinished fits
+    parser_classes = (JSONParser,)
+
+    def get(self, request, id):
+        try:
+            response = batch.status(id)
+        except exceptions.ValidationError:
+            response = None
+
+        if response is None:
+            return Response({"detail": "Batch not found."},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(response)
+
+    def delete(self, request, id):
+        try:
+            batch.cancel(id)
+        except exceptions.ValidationError:
+            pass
+        return self.get(request, id)
+
+
+
+class FitCompareView(APIView):
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        """
+        Request:
+            data_id:      string  Input data ID
+            family:       string  "nmr" or "uv"
+            options:      dict    Optional dilute, normalise, method fit 
+                                  options
+            include_fits: bool    Include full FitView responses
+
+        Response:
+            data_id:
+            family:
+            models: array  Ranked by AICc, see formatter.compare_row
+        """
+        data_id      = request.data["data_id"]
+        family       = request.data["family"]
+        options      = request.data.get("options", {})
+        include_fits = request.data.get("include_fits", False)
+
+        if family not in compare.FAMILIES:
+            return Response({"detail": "Unknown data family."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows = compare.run(data_id, family, options)
+        return Response(formatter.compare(data_id, family, rows, 
+                                          include_fits=include_fits))
+
+
+
+class FitLandscapeView(APIView):
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        """
+        Request:
+            fitter:  string  Fitter key
+            data_id: string  Input data ID
+            axes:    array   Two grid axes:
+                name: string  Parameter name
+                min:  float
+                max:  float
+                n:    int     Grid points (default 50)
+                log:  bool    Log spaced (default true)
+            fixed:   dict    Values of any other parameters
+            options: dict    dilute, normalise and flavour, as for FitView
+            refine:  int     Number of refined rescans around the minimum
+                             valley (default 0, at most
+                             BINDFIT_LANDSCAPE MAX_REFINE)
+            valley:  float   Relative SSR tolerance defining the valley 
+                             (default 0.1)
+
+        Response:
+            See formatter.landscape
+        """
+        fitter_name = request.data["fitter"]
+        data_id     = request.data["data_id"]
+        options     = request.data.get("options", {})
+
+        dilute    = options.get("dilute",    False)
+        normalise = options.get("normalise", True)
+        flavour   = options.get("flavour",   "")
+
+        try:
+            data = datacache.get(data_id, fitter_name, dilute=dilute)
+        except exceptions.ObjectDoesNotExist:
+            return Response({"detail": "Input data not found."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fixed = { key: float(value) 
+                  for key, value in request.data.get("fixed", {}).items() }
+
+        tic = time.time()
+        try:
+            grids, minimum = landscape.run(
+                    fitter_name,
+                    np.array(data["data"]["x"], dtype=np.float64),
+                    np.array(data["data"]["y"], dtype=np.float64),
+                    landscape.param_names(fitter_name, flavour),
+                    request.data["axes"],
+                    fixed=fixed,
+                    normalise=normalise,
+                    flavour=flavour,
+                    refine=request.data.get("refine", 0),
+                    valley=request.data.get("valley", 0.1))
+        except ValueError as e:
+            return Response({"detail": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        toc = time.time()
+
+        return Response(formatter.landscape(data_id, fitter_name, options,
+                                            grids, minimum, toc - tic))
+
+
+
+class FitPlateView(APIView):
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        """
+        Request:
+            data_id: string  Input data uploaded with the inhibitor fitter,
+                             one curve per y column
+            data:    dict    Alternatively, inline data:
+                x: array  n log doses
+                y: array  c x n responses (null for missing wells)
+            options:
+                fit_bottom: bool   Fit lower asymptote (default fixed)
+                fit_top:    bool   Fit upper asymptote (default fixed)
+                bottom:     float  Fixed/initial lower asymptote (0)
+                top:        float  Fixed/initial upper asymptote (100)
+                max_iter:   int    Maximum iterations per curve
+
+        Response:
+            See formatter.plate
+        """
+        data_id = request.data.get("data_id", None)
+        options = request.data.get("options", {})
+
+        if data_id is not None:
+            data = datacache.get(data_id, "inhibitor")
+            x = data["data"]["x"][1] # x[0] is just 1s, as for inhibitor
+            y = data["data"]["y"]
+        else:
+            x = request.data["data"]["x"]
+            y = np.array(request.data["data"]["y"], dtype=np.float64)
+
+        results = plate.fit(x, y,
+                            fit_bottom=options.get("fit_bottom", False),
+                            fit_top   =options.get("fit_top",    False),
+                            bottom    =options.get("bottom",     0.),
+                            top       =options.get("top",        100.),
+                            max_iter  =options.get("max_iter",   100))
+
+        return Response(formatter.plate(data_id, results))
+
+
+
 class FitMonteCarloView(APIView):
     parser_classes = (JSONParser,)
 
@@ -187,10 +715,39 @@ class FitMonteCarloView(APIView):
 
         logger.debug("FitMonteCarloView.post: called")
 
-        fit            = request.data["fit"]
-        mc_n_iter      = request.data["options"]["n_iter"]
-        mc_xdata_error = request.data["options"]["xdata_error"]
-        mc_ydata_error = request.data["options"]["ydata_error"]
+        return Response(self.run(request.data))
+
+    @staticmethod
+    def run(request_data, callback=None, checkpoint=None):
+        """
+        Calculate Monte Carlo error for a FitMonteCarloView request body and
+        return the updated params dict. Identical concurrent requests share a
+        single calculation.
+
+        Arguments:
+            callback:   Optional progress callback passed to 
+                        Fitter.calc_monte_carlo
+            checkpoint: Optional MonteCarloCheckpoint passed to 
+                        Fitter.calc_monte_carlo
+        """
+        key = cache.digest({
+            "version": cache.model_version(),
+            "fit":     request_data["fit"],
+            "options": request_data["options"],
+            })
+
+        return singleflight.get_lock_table().run(
+                "mc-"+key, 
+                lambda: FitMonteCarloView.monte_carlo(request_data, callback,
+                                                      checkpoint))
+
+    @staticmethod
+    def monte_carlo(request_data, callback=None, checkpoint=None):
+        fit            = request_data["fit"]
+        mc_n_iter      = request_data["options"]["n_iter"]
+        mc_xdata_error = request_data["options"]["xdata_error"]
+        mc_ydata_error = request_data["options"]["ydata_error"]
+        mc_seed        = request_data["options"].get("seed", None)
 
         fitter_name       = fit["fitter"]
         data_id           = fit["data_id"]
@@ -204,9 +761,7 @@ class FitMonteCarloView(APIView):
         logger.debug(options_flavour)
 
         # Get data for fitting
-        data = models.Data.objects.get(id=data_id).to_dict(
-                fitter=fitter_name,
-                dilute=options_dilute)
+        data = datacache.get(data_id, fitter_name, dilute=options_dilute)
         datax = data["data"]["x"]
         datay = data["data"]["y"]
 
@@ -227,11 +782,194 @@ class FitMonteCarloView(APIView):
         params_updated = fitter.calc_monte_carlo(mc_n_iter, 
                                                  mc_xdata_error, 
                                                  mc_ydata_error,
-                                                 method=options_method)
+                                                 method=options_method,
+                                                 callback=callback,
+                                                 seed=mc_seed,
+                                                 checkpoint=checkpoint)
 
         # Build response dict
         response = params_updated
-        return Response(response)
+        return response
+
+
+
+class FitCacheStatsView(APIView):
+    parser_classes = (JSONParser,)
+
+    def get(self, request):
+        return Response(formatter.cache_stats(
+            cache.get_cache().stats(),
+            singleflight.get_lock_table().stats.to_dict(),
+            datacache.get_cache().stats()))
+
+
+
+class FitMetricsView(APIView):
+    # All processes' metrics in the Prometheus text exposition format, see
+    # metrics.py
+
+    def get(self, request):
+        collected = metrics.collect()
+        gauges = []
+
+        ratio = metrics.fit_cache_hit_ratio(collected[0])
+        if ratio is not None:
+            gauges.append(("bindfit_fit_cache_hit_ratio",
+                           "Fit cache hit ratio of all processes",
+                           {(): ratio}))
+
+        try:
+            queues = jobs.stats()
+        except Exception:
+            logger.exception("FitMetricsView: job queue stats failed")
+        else:
+            for key in ("queued", "running"):
+                gauges.append((
+                    "bindfit_jobs_"+key,
+                    "Asynchronous jobs {} by priority class".format(key),
+                    { (("priority", name),): s[key]
+                      for name, s in queues.items() }))
+
+        return HttpResponse(metrics.render(gauges, collected),
+                            content_type="text/plain; version=0.0.4; "
+                                         "charset=utf-8")
+
+
+
+class FitTracesView(APIView):
+    parser_classes = (JSONParser,)
+
+    def get(self, request):
+        # Recent request traces held by this process, if the trace sink 
+        # keeps them (see tracing.RingBufferSink)
+        n = int(request.query_params.get("n", 100))
+        return Response(formatter.traces(tracing.get_sink().recent(n)))
+
+
+
+class FitJobView(APIView):
+    # Submit a FitView or FitMonteCarloView request body for asynchronous 
+    # calculation
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        kind         = request.data["kind"]     # "fit" or "mc"
+        request_data = request.data["request"]  # Synchronous request body
+
+        # Other kinds are internal, see batch.map_jobs
+        if kind not in (models.Job.KIND_FIT, models.Job.KIND_MC):
+            return Response({"detail": "Unknown job kind: "+str(kind)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Optional priority class name ("interactive", "analysis", "batch"),
+        # defaults to the kind's class
+        priority     = request.data.get("priority", None)
+
+        # Client for fair share scheduling
+        client       = request.data.get("client", None) or \
+                       request.META.get("REMOTE_ADDR", "")
+
+        try:
+            job = jobs.submit(kind, request_data, 
+                              priority=priority, 
+                              client=client)
+        except ValueError as e:
+            return Response({"detail": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Local backend may already have finished the job
+        job.refresh_from_db()
+        return Response(job.to_dict(), status=status.HTTP_202_ACCEPTED)
+
+
+
+class FitJobStatsView(APIView):
+    # Queue depth and wait times per priority class
+    parser_classes = (JSONParser,)
+
+    def get(self, request):
+        return Response(jobs.stats())
+
+
+
+def _get_job(id):
+    # Job by ID, None if unknown or not a valid ID
+    try:
+        return models.Job.objects.get(id=id)
+    except (models.Job.DoesNotExist, exceptions.ValidationError):
+        return None
+
+def _job_not_found():
+    return Response({"detail": "Job not found."},
+                    status=status.HTTP_404_NOT_FOUND)
+
+
+
+class FitJobStatusView(APIView):
+    parser_classes = (JSONParser,)
+
+    def get(self, request, id):
+        job = _get_job(id)
+        if job is None:
+            return _job_not_found()
+        return Response(job.to_dict())
+
+    def delete(self, request, id):
+        # Cancel job
+        if _get_job(id) is None:
+            return _job_not_found()
+        jobs.cancel(id)
+        return Response(_get_job(id).to_dict())
+
+
+
+class FitJobEventsView(FitJobStatusView):
+    # Server-Sent Events stream of job progress, DELETE cancels the job.
+    # Each open stream holds a web worker (see jobs.events), clients on
+    # sync workers should poll FitJobStatusView instead.
+    # Query parameters:
+    #   cancel_on_close: Cancel the job if the client disconnects before it
+    #                    finishes
+
+    def get(self, request, id):
+        # Before streaming
+        if _get_job(id) is None:
+            return _job_not_found()
+
+        cancel_on_close = request.query_params.get("cancel_on_close", "") \
+                          in ("1", "true")
+
+        config = getattr(settings, "BINDFIT_JOBS", jobs.DEFAULT_SETTINGS)
+        response = StreamingHttpResponse(
+                jobs.events(id, 
+                            cancel_on_close=cancel_on_close,
+                            max_duration=config.get(
+                                "EVENTS_MAX_DURATION",
+                                jobs.EVENTS_MAX_DURATION)),
+                content_type="text/event-stream")
+        response["Cache-Control"]     = "no-cache"
+        # Disable proxy buffering (nginx)
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+
+class FitJobResultView(APIView):
+    parser_classes = (JSONParser,)
+
+    def get(self, request, id):
+        job = _get_job(id)
+        if job is None:
+            return _job_not_found()
+
+        if job.status == models.Job.STATUS_DONE:
+            return Response(json.loads(job.result))
+        elif job.status == models.Job.STATUS_FAILED:
+            return Response(job.to_dict(),
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        else:
+            # Not finished yet
+            return Response(job.to_dict(), status=status.HTTP_202_ACCEPTED)
 
 
 
@@ -0,0 +1,101 @@
+"""
+" Per-fit workspace holding preprocessed input data and reusable output
+" buffers for the objective function hot loop
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+import logging
+logger = logging.getLogger('supramolecular')
+
+class Workspace(object):
+    """
+    Preallocated arrays shared by every objective evaluation of a fit.
+
+    Created once per Fitter (and once more for Monte Carlo shifted data, which
+    is reloaded in place each iteration). Objective functions write their
+    intermediate and final results into these buffers instead of allocating
+    fresh arrays on every call.
+
+    Attributes:
+        x:          ndarray  x x m C-contiguous copy of input x data
+        y:          ndarray  y x m preprocessed (normalised if requested)
+                             y data
+        y_T:        ndarray  m x y C-contiguous transpose of y, used as the
+                             right hand side of the linear regression
+        y_init:     ndarray  Length y array of raw initial y values
+        fit:        ndarray  y x m output buffer for fitted data
+        residuals:  ndarray  y x m output buffer for residuals
+        molefrac:   ndarray  Species buffer, allocated by the model function
+                             on first evaluation and reused afterwards
+        roots:      ndarray  Length m free concentration solutions of the
+                             last evaluation, NaN before the first. Used by
+                             models solving cubics as starting points for
+                             the next evaluation, kept when new data is 
+                             loaded. None to always solve directly.
+    """
+
+    def __init__(self, xdata, ydata, normalise=True):
+        self.normalise = normalise
+
+        xdata = np.asarray(xdata, dtype=np.float64)
+        ydata = np.asarray(ydata, dtype=np.float64)
+
+        self.x         = np.empty(xdata.shape)
+        self.y         = np.empty(ydata.shape)
+        self.y_T       = np.empty(ydata.shape[::-1])
+        self.y_init    = np.empty(ydata.shape[0])
+        self.fit       = np.empty(ydata.shape)
+        self.residuals = np.empty(ydata.shape)
+
+        # Flat view of residuals for allocation-free sum of squares
+        self.residuals_flat = self.residuals.ravel()
+
+        # Populated by Function.objective on first evaluation
+        self.molefrac = None
+        self.roots    = np.full(xdata.shape[1], np.nan)
+
+        # Named scratch buffers, see Workspace.buffer
+        self._buffers = {}
+
+        self.load(xdata, ydata)
+
+    def load(self, xdata, ydata):
+        """
+        Copy new input data into the workspace and preprocess it in place.
+
+        Arguments:
+            xdata: ndarray  x x m array, same shape as the workspace's x
+            ydata: ndarray  y x m array of non-normalised observations, same
+                            shape as the workspace's y
+        """
+        self.x[...]      = xdata
+        self.y[...]      = ydata
+        self.y_init[...] = self.y[:,0]
+
+        if self.normalise:
+            # Subtract initial values from each row
+            self.y -= self.y_init[:,np.newaxis]
+
+        self.y_T[...] = self.y.T
+
+    def buffer(self, name, shape):
+        """
+        Return named scratch array of given shape, allocating it only on first
+        request (or if the requested shape changes).
+        """
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape)
+            self._buffers[name] = buf
+        return buf
+
+    def ssr(self):
+        """
+        Sum of squares of the residuals buffer, without temporaries.
+        """
+        r = self.residuals_flat
+        return r.dot(r)
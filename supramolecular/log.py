@@ -0,0 +1,73 @@
+"""
+" Asynchronous logging handlers
+"
+" QueueFileHandler hands records to a background thread that writes them to
+" a file, so requests don't wait on disk I/O. Use it in place of
+" logging.FileHandler in settings.LOGGING.
+"""
+
+from __future__ import print_function
+
+import os
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class QueueFileHandler(QueueHandler):
+    """
+    Queue records for a FileHandler run by a QueueListener thread.
+
+    Messages are formatted in the logging thread (arrays logged by reference
+    may change before the listener writes them), the formatter given to
+    this handler is applied by the file handler. Records are dropped, and
+    counted in dropped, while the queue is full. Forked child processes
+    (e.g. worker pools) start their own listener thread.
+    """
+
+    def __init__(self, filename, mode="a", encoding=None, delay=False,
+                 maxsize=10000):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.target  = logging.FileHandler(filename, mode, encoding, delay)
+
+        QueueHandler.__init__(self, queue.Queue(maxsize))
+        self._start()
+
+        atexit.register(self._stop)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._restart)
+
+    def _start(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def _restart(self):
+        # The parent's listener thread doesn't exist in a forked child
+        self.queue = queue.Queue(self.maxsize)
+        self._start()
+
+    def setFormatter(self, fmt):
+        # Records are formatted by the file handler, this handler only
+        # merges their arguments into the message
+        self.target.setFormatter(fmt)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._stop()
+        self.target.close()
+        QueueHandler.close(self)
@@ -48,6 +48,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'bindfit.metrics.MetricsMiddleware',
+    'bindfit.tracing.TracingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +60,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'supramolecular.disable.DisableCSRF',
+    'bindfit.profiling.ProfilingMiddleware',
 )
 
 ROOT_URLCONF = 'supramolecular.urls'
@@ -147,9 +150,10 @@ LOGGING = {
         },
     },
     'handlers': {
+        # Written by a background thread, see supramolecular/log.py
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'supramolecular.log.QueueFileHandler',
             'filename': os.path.join(BASE_DIR, 'supramolecular.log'),
             'formatter': 'verbose'
         },
@@ -183,3 +187,171 @@ HAYSTACK_CONNECTIONS = {
 
 #HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
 HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+
+# Bindfit fit result cache
+# BACKEND is one of bindfit.cache.LocMemBackend (per process), 
+# bindfit.cache.FileBackend (OPTIONS: path, max_size) or 
+# bindfit.cache.DjangoCacheBackend (OPTIONS: alias, timeout)
+BINDFIT_FIT_CACHE = {
+    'BACKEND': 'bindfit.cache.LocMemBackend',
+    'OPTIONS': {
+        'max_size': 64*1024*1024, # Bytes
+    },
+}
+
+# Per process cache of parsed input data arrays, see bindfit/datacache.py
+BINDFIT_DATA_CACHE = {
+    'MAX_SIZE': 32*1024*1024, # Bytes
+    'TIMEOUT':  300,          # Seconds before labels are reloaded, None to
+                              # keep entries until evicted
+}
+
+# Storage of uploaded input data arrays (bindfit Data rows): binary 
+# (little-endian float64 .npy blobs, optionally zlib compressed) or array 
+# (nested Postgres arrays) for new rows, see bindfit/arraycodec.py. Rows in
+# either format are read. Migration 0014 converts existing rows to binary.
+BINDFIT_DATA_STORAGE = {
+    'FORMAT':   'binary',
+    'COMPRESS': False,  # Smaller rows, but decoding then copies the array
+    'LEVEL':    6,      # zlib compression level
+}
+
+# Local state shared between worker processes (lock tables, file caches)
+BINDFIT_VAR_DIR = os.path.join(BASE_DIR, 'var')
+
+# Coalescing of identical concurrent fit/Monte Carlo requests
+# BACKEND is bindfit.singleflight.FileLockTable (across processes, OPTIONS:
+# path, timeout, max_age, cleanup_interval) or
+# bindfit.singleflight.LocalLockTable (single process)
+BINDFIT_SINGLEFLIGHT = {
+    'BACKEND': 'bindfit.singleflight.FileLockTable',
+    'OPTIONS': {
+        'path':    os.path.join(BINDFIT_VAR_DIR, 'singleflight'),
+        'timeout': 300, # Seconds to wait for an in-flight computation
+        'max_age': 3600, # Seconds before files of unused keys are removed
+    },
+}
+
+# Asynchronous fit jobs
+# BACKEND is bindfit.jobs.DatabaseBackend (jobs run by manage.py 
+# runfitworker) or bindfit.jobs.LocalBackend (run on submission)
+BINDFIT_JOBS = {
+    'BACKEND':   'bindfit.jobs.DatabaseBackend',
+    'OPTIONS':   {},
+    'POLL':      1.0, # runfitworker queue polling interval (s)
+    # Job progress event streams (fit/jobs/<id>/events) hold a web worker
+    # while open: serve them from async or threaded workers (e.g. gunicorn
+    # -k gevent or gthread). Streams end with a "timeout" event after this
+    # many seconds, clients then reconnect or poll fit/jobs/<id>.
+    'EVENTS_MAX_DURATION': 300,
+}
+
+# Monte Carlo job checkpoints, resumed when a requeued job is run again
+BINDFIT_CHECKPOINTS = {
+    'PATH':     os.path.join(BINDFIT_VAR_DIR, 'checkpoints'),
+    'INTERVAL': 30,        # Seconds between checkpoints
+    'MAX_AGE':  7*24*3600, # Seconds before abandoned checkpoints are removed
+}
+
+# Asynchronous fit job scheduling, see bindfit/scheduler.py
+# runfitworker runs CPU_BUDGET + INTERACTIVE_SLOTS worker processes
+BINDFIT_SCHEDULER = {
+    'CPU_BUDGET':        2, # Slots shared by all priority classes
+    'INTERACTIVE_SLOTS': 1, # Extra slots for interactive fits only
+    'CLASS_LIMITS': {       # Maximum running jobs per class, None for
+        'interactive': None, # no limit beyond CPU_BUDGET
+        'analysis':    None,
+        'batch':       None,
+    },
+}
+
+# Batch fitting (/bindfit/fit/batch). Items run as jobs of the batch 
+# priority class (see BINDFIT_SCHEDULER CLASS_LIMITS) on the runfitworker 
+# pool, or in the request process with the jobs LocalBackend. Batches of up
+# to SYNC_MAX fits are waited for in the request, larger ones (or any with
+# "async": true) return a batch ID to poll at /bindfit/fit/batch/<id>.
+BINDFIT_BATCH = {
+    'MAX_ITEMS': 500, # Maximum fits per batch request
+    'SYNC_MAX':  20,  # Maximum fits per batch waited for in the request
+    'POLL':      0.2, # Job polling interval while waiting for results (s)
+    'TIMEOUT':   120, # Cancel items waited for longer than this (s)
+}
+
+# Incremental fitting sessions
+# BACKEND is bindfit.sessions.LocMemStore (per process, OPTIONS: timeout, 
+# max_sessions) or bindfit.sessions.DjangoCacheStore (OPTIONS: alias, 
+# timeout, lock_timeout, lock_wait). Use DjangoCacheStore with a shared 
+# cache when serving from several processes.
+BINDFIT_SESSIONS = {
+    'BACKEND': 'bindfit.sessions.LocMemStore',
+    'OPTIONS': {
+        'timeout':      1800, # Seconds of inactivity before eviction
+        'max_sessions': 1000,
+    },
+}
+
+# SSR landscape scans
+# Large grids are evaluated as jobs on the runfitworker pool (waiting as
+# configured by BINDFIT_BATCH)
+BINDFIT_LANDSCAPE = {
+    'MAX_POINTS':   250000, # Maximum grid points per scan
+    'MAX_REFINE':   3,      # Maximum refined rescans per request
+    'PARALLEL_MIN': 2500,   # Smaller grids are evaluated in the web process
+    'CHUNK_ROWS':   8,      # Grid rows per worker task
+}
+
+# Per-fit numerical work counters and timings (returned as "diagnostics" in
+# fit responses)
+BINDFIT_DIAGNOSTICS = {
+    'LOG': False, # Also log each fit's diagnostics at INFO level
+}
+
+# Request tracing, see bindfit/tracing.py
+# SINK is bindfit.tracing.RingBufferSink (recent traces per process, served 
+# at fit/traces, OPTIONS: size) or bindfit.tracing.LogSink (OPTIONS: 
+# logger_name)
+BINDFIT_TRACING = {
+    'SAMPLE_RATE':   0.05, # Fraction of requests traced
+    'SINK':          'bindfit.tracing.RingBufferSink',
+    'OPTIONS':       {'size': 1000},
+    'SERVER_TIMING': True, # Add Server-Timing header to traced responses
+}
+
+# Debug logging of the fitting numerical core (objective and model function
+# arguments and intermediate arrays), independent of the logger level, see 
+# bindfit/numtrace.py. Off costs nothing in the objective hot loop.
+BINDFIT_NUMTRACE = {
+    'ENABLED': False,
+    'EVERY':   100,   # Log every Nth objective evaluation
+}
+
+# Prometheus-style metrics (request latency, fit durations, objective 
+# evaluations, Monte Carlo iterations, cache and job queue stats), served at
+# bindfit/fit/metrics, see bindfit/metrics.py. Each process writes its 
+# metrics to PATH, which must be shared by all WSGI and worker processes.
+BINDFIT_METRICS = {
+    'PATH':           os.path.join(BINDFIT_VAR_DIR, 'metrics'),
+    'FLUSH_INTERVAL': 5,          # Seconds between writes of each process' 
+                                  # metrics
+    'MAX_AGE':        7*24*3600,  # Remove files of processes gone this long
+}
+
+# Capture of slow fits for offline replay with the replayfits management 
+# command, see bindfit/capture.py
+BINDFIT_CAPTURE = {
+    'ENABLED':   True,
+    'THRESHOLD': 10,   # Capture fits taking longer than this (s)
+    'PATH':      os.path.join(BINDFIT_VAR_DIR, 'captures'),
+    'MAX_CASES': 200,  # Oldest cases are removed beyond this number
+}
+
+# On-demand profiling of requests with an X-Profile header or profile query
+# parameter, by staff or with TOKEN in an X-Profile-Token header, see
+# bindfit/profiling.py. Summarise stored profiles with the profiles
+# management command.
+BINDFIT_PROFILING = {
+    'ENABLED':      True,
+    'TOKEN':        None, # Set to a long random string to allow token access
+    'PATH':         os.path.join(BINDFIT_VAR_DIR, 'profiles'),
+    'MAX_PROFILES': 500,  # Oldest profiles are removed beyond this number
+}